@@ -0,0 +1,234 @@
+import os
+import sys
+import time
+import argparse
+import pandas as pd
+import numpy as np
+from instrumentation import start_run, count, timer
+
+# Script to assemble the combined gene feature table in-process
+# Replaces the CSV round-trip of Combined_table_numerical_features.R -> cleanup_csv_data.py -> pd.read_csv
+# Reads the per-group summary-metrics, GTEx and ENCODE outputs from the 'data' folder and joins them on 'Gene'
+# results/combined_gene_data.csv is still written so the R plotting scripts keep working
+
+data_dir = "data"
+output_csv = "results/combined_gene_data.csv"
+sequence_features_csv = "results/sequence_features.csv"
+paralog_clusters_csv = "results/paralog_clusters.csv"
+# The table with the sequence features and/or paralog clusters joined is written here, not to output_csv, which keeps
+# the columns the R and PCA scripts read
+joined_output_csv = "results/combined_gene_features.csv"
+
+gene_groups = ["RNU1", "RNU2", "RNU4", "RNU5", "RNU6", "RNU4ATAC", "RNU6ATAC", "RNU11", "RNU12", "VTRNA",
+               "RNY", "TRNA", "RN7SL", "RNU7", "RN7SK"]
+
+# The five numerical features, in the column order of combined_gene_data.csv
+feature_columns = ["PhastCons30_median", "PhyloP100_median", "PhyloP447_median", "GTEX_max", "ENCODE_max"]
+
+# Define the list of exceptions (genes that are pseudogenes but do not end with "P",from TRNA gene groups)
+exception_genes = ['TRA-AGC23-1', 'TRA-TGC9-1', 'TRC-ACA1-1', 'TRC-GCA25-1', 'TRE-CTC7-1',
+                   'TRE-CTC16-1', 'TRE-TTC6-1', 'TRE-TTC7-1', 'TRE-TTC8-1', 'TRE-TTC9-1',
+                   'TRE-TTC10-1', 'TRE-TTC11-1', 'TRE-TTC12-1', 'TRE-TTC13-1', 'TRF-GAA7-1',
+                   'TRF-GAA8-1', 'TRF-GAA9-1', 'TRF-GAA10-1', 'TRF-GAA11-1', 'TRF-GAA12-1',
+                   'TRG-CCC8-1', 'TRG-TCC5-1', 'TRG-TCC6-1', 'TRI-AAT10-1', 'TRI-AAT11-1',
+                   'TRK-CTT12-1', 'TRK-CTT13-1', 'TRK-CTT14-1', 'TRK-CTT15-1', 'TRK-CTT16-1',
+                   'TRK-TTT10-1', 'TRK-TTT12-1', 'TRK-TTT13-1', 'TRK-TTT15-1', 'TRL-AAG6-1',
+                   'TRL-AAG7-1', 'TRL-TAA5-1', 'TRL-TAG4-1', 'TRN-GTT16-5', 'TRN-GTT21-1',
+                   'TRN-GTT22-1', 'TRN-GTT23-1', 'TRQ-CTG9-1', 'TRQ-CTG11-1', 'TRQ-CTG13-1',
+                   'TRQ-CTG16-1', 'TRQ-CTG17-1', 'TRQ-TTG5-1', 'TRQ-TTG6-1', 'TRQ-TTG10-1',
+                   'TRR-CCT6-1', 'TRR-CCT7-1', 'TRR-CCT9-1', 'TRS-ACT1-1', 'TRUND-NNN3-1',
+                   'TRUND-NNN4-1', 'TRUND-NNN6-1', 'TRUND-NNN7-1', 'TRUND-NNN8-1', 'TRUND-NNN9-1',
+                   'TRUND-NNN10-1', 'TRV-CAC11-1', 'TRV-CAC11-2', 'TRX-CAT3-1', 'TRY-GTA11-1',
+                   'TRY-GTA12-1']
+
+# Define list of 2nd exceptions: have P but are functional genes
+exception_genes_2 = ['MT-TP', 'NMTRP-TGG1-1', 'TRP-AGG1-1', 'TRP-AGG2-1', 'TRP-AGG2-2', 'TRP-AGG2-3',
+                     'TRP-AGG2-4', 'TRP-AGG2-5', 'TRP-AGG2-6', 'TRP-AGG2-7', 'TRP-AGG2-8', 'TRP-AGG3-1',
+                     'TRP-AGG5-1', 'TRP-CGG1-1', 'TRP-CGG1-2', 'TRP-CGG1-3', 'TRP-CGG2-1', 'TRP-GGG1-1',
+                     'TRP-TGG1-1', 'TRP-TGG2-1', 'TRP-TGG3-1', 'TRP-TGG3-2', 'TRP-TGG3-3', 'TRP-TGG3-4',
+                     'TRP-TGG3-5', 'TRSUP-CTA1-1', 'TRSUP-CTA2-1', 'TRSUP-CTA3-1', 'TRSUP-TTA1-1', 'TRSUP-TTA2-1',
+                     'TRSUP-TTA3-1']
+
+gene_type_dtype = pd.CategoricalDtype(["Functional", "Pseudogene"])
+gene_group_dtype = pd.CategoricalDtype(gene_groups)
+
+# Per-group source files: (path template, value column in the file, feature column in the combined table)
+feature_sources = [
+    ("phastCons30_summary/{group}_phastCons30_summary_metrics.csv", "Median_Conservation", "PhastCons30_median"),
+    ("phyloP100_summary/{group}_phyloP100_summary_metrics.csv", "Median_Conservation", "PhyloP100_median"),
+    ("phyloP447_summary/{group}_phyloP447_summary_metrics.csv", "Median_Conservation", "PhyloP447_median"),
+    ("GTEX-expr_summary/{group}_expr.csv", "Max Expression", "GTEX_max"),
+    ("ENCODE-expr_summary/{group}_expr.csv", "Max_FPKM", "ENCODE_max"),
+]
+
+
+# Function to read one per-group output, keeping only the gene and the value column (typed on load)
+def read_feature_source(path, value_column, feature_column):
+    with timer("csv.read", source=feature_column):
+        frame = pd.read_csv(path, usecols=["Gene", value_column], dtype={"Gene": str, value_column: np.float64},
+                            engine="c")
+    count("rows.read", len(frame), source=feature_column)
+    return frame.rename(columns={value_column: feature_column})
+
+
+# Function to label genes as Functional or Pseudogene
+# Same rules as the R scripts: exception_genes_2 are functional, exception_genes are pseudogenes,
+# otherwise any gene symbol containing a "P" is a pseudogene
+def label_gene_types(genes):
+    genes = pd.Series(genes, dtype=str)
+    is_pseudogene = genes.str.contains("P", regex=False)
+    is_pseudogene[genes.isin(exception_genes)] = True
+    is_pseudogene[genes.isin(exception_genes_2)] = False
+    labels = np.where(is_pseudogene.to_numpy(), "Pseudogene", "Functional")
+    return pd.Categorical(labels, dtype=gene_type_dtype)
+
+
+# Function to combine the five per-group outputs of one gene group
+# Full outer hash-join on 'Gene', same as merge(..., all = TRUE) in Combined_table_numerical_features.R
+def assemble_group(gene_group, data_dir=data_dir):
+    group_data = None
+    for path_template, value_column, feature_column in feature_sources:
+        path = os.path.join(data_dir, path_template.format(group=gene_group))
+        frame = read_feature_source(path, value_column, feature_column)
+        if group_data is None:
+            group_data = frame
+        else:
+            group_data = group_data.merge(frame, on="Gene", how="outer", sort=False)
+
+    group_data = group_data.sort_values("Gene", kind="stable", ignore_index=True)
+    group_data["Gene_Type"] = label_gene_types(group_data["Gene"])
+    group_data["Gene_group"] = pd.Categorical([gene_group] * len(group_data), dtype=gene_group_dtype)
+    return group_data
+
+
+# Function to apply the cleanup_csv_data.py rule: remove TRNA rows where the gene has no hyphen
+def drop_invalid_rows(data):
+    invalid = (data["Gene_group"] == "TRNA") & ~data["Gene"].str.contains("-", regex=False)
+    count("rows.removed", int(invalid.sum()), reason="trna_no_hyphen")
+    if invalid.any():
+        print(f"Removing {int(invalid.sum())} TRNA rows with no hyphen in the gene symbol")
+    return data[~invalid].reset_index(drop=True)
+
+
+# Function to build the full combined gene table for all gene groups
+def assemble_combined_table(gene_groups=gene_groups, data_dir=data_dir):
+    frames = [assemble_group(gene_group, data_dir) for gene_group in gene_groups]
+    data = pd.concat(frames, ignore_index=True)
+    data["Gene_Type"] = data["Gene_Type"].astype(gene_type_dtype)
+    data["Gene_group"] = data["Gene_group"].astype(gene_group_dtype)
+    data = drop_invalid_rows(data)
+    return data[["Gene"] + feature_columns + ["Gene_Type", "Gene_group"]]
+
+
+# Function to get the compact float32 feature frame used by the model (the table itself keeps the float64 values read
+# from the source files, so the CSV written from it keeps their precision)
+# GTEX_max is -inf for genes with no GTEx signal at all, the model treats that as a missing value
+def feature_frame(data, features):
+    frame = data[list(features)].astype(np.float32, copy=False)
+    return frame.mask(np.isinf(frame))
+
+
+# Function to tell whether a CSV already holds the same table: same columns, labels and values (to the 15 significant
+# digits written by Combined_table_numerical_features.R)
+def same_combined_table(data, csv_path):
+    if not os.path.isfile(csv_path):
+        return False
+    try:
+        existing = pd.read_csv(csv_path, dtype={"Gene": str})
+    except (pd.errors.ParserError, ValueError):
+        return False
+    if list(existing.columns) != list(data.columns) or len(existing) != len(data):
+        return False
+    for column in data.columns:
+        if pd.api.types.is_numeric_dtype(data[column]):
+            if not pd.api.types.is_numeric_dtype(existing[column]) or not np.allclose(
+                    existing[column].to_numpy(np.float64), data[column].to_numpy(np.float64),
+                    rtol=1e-12, atol=0, equal_nan=True):
+                return False
+        elif not (existing[column].astype(str).to_numpy() == data[column].astype(str).to_numpy()).all():
+            return False
+    return True
+
+
+# Function to write the combined table in the format of the R script (NA for missing values)
+# The file is tracked, so it is only rewritten when the table changed (returns whether it was written)
+def save_combined_table(data, output_csv=output_csv):
+    if same_combined_table(data, output_csv):
+        count("rows.unchanged", len(data), output="combined_table")
+        return False
+    temp_output_csv = f"{output_csv}.tmp"
+    with timer("csv.write", output="combined_table"):
+        data.to_csv(temp_output_csv, index=False, na_rep="NA")
+    os.replace(temp_output_csv, output_csv)
+    count("rows.written", len(data), output="combined_table")
+    return True
+
+
+# Function to join the sequence features written by sequence_features.py (length, GC content, CpG ratio, k-mer
+# divergence from the closest functional copy and the k-mer spectrum) to the combined table, on 'Gene'
+def add_sequence_features(data, path=sequence_features_csv):
+    sequence = pd.read_csv(path).drop(columns=["Gene_group", "Closest_functional"])
+    numeric = sequence.columns.drop("Gene")
+    sequence[numeric] = sequence[numeric].astype(np.float32)
+    return data.merge(sequence, on="Gene", how="left")
+
+
+# Function to join the paralog clusters written by paralog_clusters.py (cluster number within the gene group, cluster
+# size, functional genes in the cluster and MinHash similarity to the closest functional copy) on 'Gene'
+def add_paralog_clusters(data, path=paralog_clusters_csv):
+    clusters = pd.read_csv(path, usecols=["Gene", "Paralog_cluster", "Cluster_size", "Cluster_functional",
+                                          "Functional_similarity"])
+    clusters["Functional_similarity"] = clusters["Functional_similarity"].astype(np.float32)
+    return data.merge(clusters, on="Gene", how="left")
+
+
+# Function to join the optional sequence features and paralog clusters to the combined table
+def join_extra_features(data, sequence_features=False, paralog_clusters=False):
+    if sequence_features:
+        data = add_sequence_features(data)
+    if paralog_clusters:
+        data = add_paralog_clusters(data)
+    return data
+
+
+# Function used by the modelling code: assemble the table, write the compatibility CSV and return the frame
+# The compatibility CSV only ever holds the five features; the joined columns are only returned in memory
+def load_combined_table(data_dir=data_dir, output_csv=output_csv, write_csv=True, sequence_features=False,
+                        paralog_clusters=False):
+    data = assemble_combined_table(data_dir=data_dir)
+    if write_csv:
+        save_combined_table(data, output_csv)
+    return join_extra_features(data, sequence_features, paralog_clusters)
+
+
+# Main Execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Assemble the combined gene feature table.")
+    parser.add_argument("--sequence-features", action="store_true",
+                        help=f"Also join the sequence features of {sequence_features_csv} (written to "
+                             f"{joined_output_csv}).")
+    parser.add_argument("--paralog-clusters", action="store_true",
+                        help=f"Also join the paralog clusters of {paralog_clusters_csv} (written to "
+                             f"{joined_output_csv}).")
+    args = parser.parse_args()
+    start_run("assemble_features")
+    start_time = time.perf_counter()
+    try:
+        combined_data = assemble_combined_table()
+        written = save_combined_table(combined_data)
+        joined = args.sequence_features or args.paralog_clusters
+        if joined:
+            joined_data = join_extra_features(combined_data, args.sequence_features, args.paralog_clusters)
+            joined_written = save_combined_table(joined_data, joined_output_csv)
+    except (FileNotFoundError, ValueError) as e:
+        sys.exit(f"Error assembling the combined gene table: {e}")
+    elapsed = time.perf_counter() - start_time
+
+    print(f"Assembled {len(combined_data)} genes across {combined_data['Gene_group'].nunique()} gene groups "
+          f"in {elapsed:.3f}s")
+    print(f"Functional Genes: {(combined_data['Gene_Type'] == 'Functional').sum()}")
+    print(f"Pseudogenes: {(combined_data['Gene_Type'] == 'Pseudogene').sum()}")
+    print(f"Results written to {output_csv}" if written else f"{output_csv} is up to date, not rewritten")
+    if joined:
+        print(f"Table with {len(joined_data.columns) - len(combined_data.columns)} joined columns "
+              + (f"written to {joined_output_csv}" if joined_written else f"in {joined_output_csv} is up to date"))
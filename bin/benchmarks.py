@@ -0,0 +1,748 @@
+import os
+import re
+import ast
+import csv
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import platform
+import threading
+import subprocess
+import struct
+from email.utils import formatdate
+from urllib.parse import urlparse, parse_qs, unquote
+from xml.etree.ElementTree import fromstring
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+import pyBigWig
+
+# Offline benchmark suite for the pipeline stages
+# Synthetic fixtures are written to a temporary directory laid out like the repository (data/ with BigWig tracks,
+# {group}_data.txt locus files and an ENCODE report), and HGNC, Ensembl REST and BioMart are replaced by a local mock
+# server with configurable latency. Each stage script runs unchanged in that directory and its metrics summary
+# (instrumentation.py) is read back. Results are appended to results/benchmark_history.json and compared with the
+# previous run of the same benchmark and parameters, so regressions show up
+
+bin_dir = os.path.dirname(os.path.abspath(__file__))
+history_file = "results/benchmark_history.json"
+
+benchmark_names = ["locus_fetch", "conservation", "gtex_scan", "encode", "bigbed_lookup", "model_training",
+                   "genome_screen", "interval_queries", "sequence_features", "paralog_clusters", "conservation_profile",
+                   "remote_bigwig"]
+
+# Synthetic genome: loci and track values are placed in the first covered_bases of each chromosome
+synthetic_chroms = [("chr1", 248956422), ("chr2", 242193529), ("chr3", 198295559), ("chrX", 156040895)]
+
+encode_tsv = "data/rna_expression_report_2024_11_20_22h_6m.tsv"
+
+
+# Function to make synthetic loci for one gene group: half of them pseudogenes, 100-300 bp long
+def make_loci(group, n_genes, covered_bases, seed=42):
+    rng = np.random.default_rng(seed)
+    loci = []
+    for number in range(1, n_genes + 1):
+        chrom = synthetic_chroms[rng.integers(len(synthetic_chroms))][0]
+        length = int(rng.integers(100, 301))
+        start = int(rng.integers(1, covered_bases - length))
+        gene = f"{group}-{number}P" if number % 2 == 0 else f"{group}-{number}"
+        loci.append({"gene": gene, "transcript": f"ENST{number:011d}", "chrom": chrom, "start": start,
+                     "end": start + length})
+    return loci
+
+
+# Function to write a {group}_data.txt locus file in the format of fetch_ncrna_data.py
+def write_locus_file(path, loci):
+    with open(path, "w") as file:
+        file.write("\n")
+        for locus in loci:
+            chrom = locus["chrom"].replace("chr", "")
+            location = f"{chrom}:{locus['start']:,}-{locus['end']:,}"
+            file.write(f"Processing {locus['gene']} with Transcript ID: {locus['transcript']}\n")
+            file.write(f"{locus['gene']} ({locus['transcript']}): Genomic Sequence ({location})\n")
+            file.write(f"UCSC Genome Browser link: https://genome.ucsc.edu/cgi-bin/hgTracks?db=hg38&position="
+                       f"{chrom}%3A{locus['start']}-{locus['end']}\n")
+            file.write("------\n")
+
+
+# Function to write a synthetic BigWig track with one value per base over the covered part of every chromosome
+def write_bigwig(path, covered_bases, seed=42, block_size=1_000_000):
+    rng = np.random.default_rng(seed)
+    bw = pyBigWig.open(path, "w")
+    bw.addHeader(synthetic_chroms, maxZooms=10)
+    for chrom, _ in synthetic_chroms:
+        for start in range(0, covered_bases, block_size):
+            size = min(block_size, covered_bases - start)
+            values = rng.gamma(0.5, 2.0, size=size).astype(np.float64)
+            bw.addEntries(chrom, start, values=values, span=1, step=1)
+    bw.close()
+    return os.path.getsize(path)
+
+
+# Function to write a synthetic BigBed annotation of the loci (name field "symbol transcript")
+# pyBigWig can only write BigWig files, so the BED file is converted with UCSC bedToBigBed when it is installed
+def write_bigbed(path, loci):
+    bed_to_bigbed = shutil.which("bedToBigBed")
+    if bed_to_bigbed is None:
+        return None
+    bed_path, sizes_path = f"{path}.bed", f"{path}.sizes"
+    with open(sizes_path, "w") as file:
+        file.writelines(f"{chrom}\t{size}\n" for chrom, size in synthetic_chroms)
+    with open(bed_path, "w") as file:
+        for locus in sorted(loci, key=lambda locus: (locus["chrom"], locus["start"])):
+            file.write(f"{locus['chrom']}\t{locus['start']}\t{locus['end']}\t{locus['gene']}_{locus['transcript']}\n")
+    subprocess.run([bed_to_bigbed, "-type=bed4", bed_path, sizes_path, path], check=True, capture_output=True)
+    return os.path.getsize(path)
+
+
+# Function to make a random genome sequence over the covered part of every chromosome, as 2bit codes
+# (T=0 C=1 A=2 G=3) with a run of N every 100 kb
+def make_genome(covered_bases, seed=42):
+    rng = np.random.default_rng(seed)
+    genome = {}
+    for chrom, _ in synthetic_chroms:
+        codes = rng.integers(0, 4, covered_bases, dtype=np.uint8)
+        n_blocks = [(start, min(500, covered_bases - start)) for start in range(50_000, covered_bases, 100_000)]
+        genome[chrom] = (codes, n_blocks)
+    return genome
+
+
+# Function to plant paralog families in a genome: every locus gets a copy of one of n_families template sequences
+# with a fraction of its bases mutated, as in gene groups made of near-identical copies
+def plant_paralogs(genome, loci, n_families, divergence, seed=42):
+    rng = np.random.default_rng(seed)
+    templates = rng.integers(0, 4, (n_families, max(locus["end"] - locus["start"] + 1 for locus in loci)),
+                             dtype=np.uint8)
+    for number, locus in enumerate(loci):
+        length = locus["end"] - locus["start"] + 1
+        copy = templates[(number // 2) % n_families, :length].copy()
+        mutated = rng.random(length) < divergence
+        copy[mutated] = (copy[mutated] + rng.integers(1, 4, mutated.sum(), dtype=np.uint8)) % 4
+        genome[locus["chrom"]][0][locus["start"] - 1:locus["end"]] = copy
+
+
+# Function to write a genome as a 2bit file (version 0, little-endian, no soft-masked blocks)
+def write_twobit(path, genome):
+    names = list(genome)
+    offset = 16 + sum(1 + len(name) + 4 for name in names)
+    index, records = [], []
+    for name in names:
+        codes, n_blocks = genome[name]
+        index.append(struct.pack("<B", len(name)) + name.encode() + struct.pack("<I", offset))
+        padded = np.r_[codes, np.zeros(-len(codes) % 4, dtype=np.uint8)].reshape(-1, 4)
+        packed = (padded[:, 0] << 6 | padded[:, 1] << 4 | padded[:, 2] << 2 | padded[:, 3]).astype(np.uint8)
+        record = (struct.pack("<II", len(codes), len(n_blocks))
+                  + np.array([start for start, _ in n_blocks] + [size for _, size in n_blocks], dtype="<u4").tobytes()
+                  + struct.pack("<II", 0, 0) + packed.tobytes())
+        records.append(record)
+        offset += len(record)
+    with open(path, "wb") as file:
+        file.write(struct.pack("<IIII", 0x1A412743, 0, len(names), 0))
+        file.writelines(index)
+        file.writelines(records)
+    return os.path.getsize(path)
+
+
+# Function to write a genome as a FASTA file with 60 bases per line
+def write_fasta(path, genome):
+    letters = np.frombuffer(b"TCAG", dtype=np.uint8)
+    with open(path, "wb") as file:
+        for name, (codes, n_blocks) in genome.items():
+            sequence = letters[codes]
+            for start, size in n_blocks:
+                sequence[start:start + size] = ord("N")
+            file.write(f">{name}\n".encode())
+            for start in range(0, len(sequence), 60):
+                file.write(sequence[start:start + 60].tobytes() + b"\n")
+    return os.path.getsize(path)
+
+
+# Function to write a synthetic ENCODE RNA-Get report: one metadata line, then one row per (gene, biosample)
+def write_encode_report(path, genes, n_rows, seed=42):
+    rng = np.random.default_rng(seed)
+    symbols = np.array(list(genes) + [f"OTHER{number}" for number in range(max(n_rows // 20, 1))])
+    with open(path, "w") as file:
+        file.write("# synthetic ENCODE RNA-Get report\n")
+        file.write("Feature ID\tGene symbol\tBiosample term name\tTPM\tFPKM\n")
+        for number, symbol in enumerate(rng.choice(symbols, size=n_rows)):
+            tpm = rng.gamma(0.3, 5.0)
+            file.write(f"ENSG{number:011d}\t{symbol}\tsample{number % 50}\t{tpm:.2f}\t{tpm * 0.8:.2f}\n")
+
+
+# Function to write a synthetic HGNC complete set with the loci as ncRNA genes and ncRNA pseudogenes
+# The transcript IDs stand in for the Ensembl gene IDs, so the mock server resolves both
+def write_hgnc_complete_set(path, loci):
+    with open(path, "w") as file:
+        file.write("hgnc_id\tsymbol\tname\tlocus_group\tlocus_type\tstatus\tgene_group\tensembl_gene_id\n")
+        for number, locus in enumerate(loci, start=1):
+            if locus["gene"].endswith("P"):
+                locus_group, locus_type, family = "pseudogene", "pseudogene", "Synthetic small nuclear RNA pseudogenes"
+            else:
+                locus_group, locus_type, family = "non-coding RNA", "RNA, small nuclear", "Synthetic small nuclear RNAs"
+            file.write(f"HGNC:{number}\t{locus['gene']}\tsynthetic locus\t{locus_group}\t{locus_type}\tApproved\t"
+                       f"{family}\t{locus['transcript']}\n")
+        # A protein-coding gene, which the genome-wide screen leaves out
+        file.write("HGNC:0\tSYNTH1\tsynthetic gene\tprotein-coding gene\tgene with protein product\tApproved\t\t"
+                   "ENSG00000000000\n")
+
+
+# Function to read the GTEx file list of fetch_expression_data.py without running the script
+def gtex_file_paths():
+    with open(os.path.join(bin_dir, "fetch_expression_data.py")) as file:
+        tree = ast.parse(file.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(target, "id", None) == "rna_seq_files" for target in node.targets):
+            return ast.literal_eval(node.value)
+    raise ValueError("rna_seq_files not found in fetch_expression_data.py")
+
+
+# Function to build the request handler of the mock annotation server
+# Mimics HGNC search (/hgnc/search/...), Ensembl REST lookup (/ensembl/lookup/id/...) and the BioMart XML query
+# that fetch_ncrna_data.py sends directly (/biomart/martservice?query=<XML>); the registry/datasets/...
+# metadata requests (/biomart/martservice?type=...) are still answered for older clients
+# A fraction error_rate of the requests is answered with 503 or 429 (Retry-After: 0) to exercise the retries
+def make_mock_handler(loci, latency, error_rate=0.0, seed=42):
+    rng = np.random.default_rng(seed)
+    rng_lock = threading.Lock()
+    by_transcript = {locus["transcript"]: locus for locus in loci}
+    by_gene = {}
+    for locus in loci:
+        by_gene.setdefault(locus["gene"], []).append(locus)
+
+    biomart_responses = {
+        "registry": '<MartRegistry><MartURLLocation name="ENSEMBL_MART_ENSEMBL" displayName="Ensembl Genes" '
+                    'serverVirtualSchema="default" /></MartRegistry>',
+        "datasets": "TableSet\thsapiens_gene_ensembl\tHuman genes (GRCh38)\t1\tGRCh38\t200\t50000\tdefault\t\n",
+        "filters": "hgnc_symbol\tHGNC symbol(s)\t\t\tfilters\ttext\n",
+        "configuration": '<DatasetConfig><AttributePage internalName="feature_page" displayName="Features">'
+                         '<AttributeGroup><AttributeCollection>'
+                         '<AttributeDescription internalName="ensembl_transcript_id" default="true" />'
+                         '</AttributeCollection></AttributeGroup></AttributePage></DatasetConfig>',
+        "attributes": "ensembl_transcript_id\tTranscript stable ID\t\tfeature_page\n"
+                      "external_gene_name\tGene name\t\tfeature_page\n",
+    }
+
+    class MockHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def send(self, status, body, content_type="application/json"):
+            data = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            time.sleep(latency)
+            with rng_lock:
+                draw = rng.random()
+            if draw < error_rate:
+                status = 429 if draw < error_rate / 2 else 503
+                self.send_response(status)
+                self.send_header("Retry-After", "0")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            url = urlparse(self.path)
+            path = unquote(url.path)
+
+            if path.startswith("/hgnc/search/"):
+                query = re.match(r"\*([^*]+)\*", path[len("/hgnc/search/"):])
+                genes = [gene for gene in by_gene if query and gene.startswith(query.group(1))]
+                self.send(200, json.dumps({"response": {"numFound": len(genes),
+                                                        "docs": [{"symbol": gene} for gene in genes]}}))
+            elif path.startswith("/ensembl/lookup/id/"):
+                locus = by_transcript.get(path.rsplit("/", 1)[-1])
+                if locus is None:
+                    self.send(400, json.dumps({"error": "ID not found"}))
+                else:
+                    self.send(200, json.dumps({"seq_region_name": locus["chrom"].replace("chr", ""),
+                                               "start": locus["start"], "end": locus["end"]}))
+            elif path.endswith("/martservice"):
+                params = parse_qs(url.query)
+                if "query" in params:
+                    query = fromstring(params["query"][0])
+                    symbol = query.find("./Dataset/Filter[@name='hgnc_symbol']").get("value")
+                    rows = [f"{locus['transcript']}\t{locus['gene']}\n" for locus in by_gene.get(symbol, [])]
+                    self.send(200, "".join(rows), "text/plain")
+                else:
+                    self.send(200, biomart_responses.get(params.get("type", [""])[0], ""), "text/plain")
+            else:
+                self.send(404, json.dumps({"error": "not found"}))
+
+        # Batched Ensembl REST lookup (POST /lookup/id with {"ids": [...]}), unknown IDs map to null
+        def do_POST(self):
+            time.sleep(latency)
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if unquote(urlparse(self.path).path).rstrip("/") != "/ensembl/lookup/id":
+                self.send(404, json.dumps({"error": "not found"}))
+                return
+            found = {}
+            for identifier in body.get("ids", []):
+                locus = by_transcript.get(identifier)
+                found[identifier] = None if locus is None else {
+                    "seq_region_name": locus["chrom"].replace("chr", ""), "start": locus["start"], "end": locus["end"]}
+            self.send(200, json.dumps(found))
+
+    return MockHandler
+
+
+# Function to start the mock server in a background thread, returns the server and its base URL
+def start_mock_server(loci, latency, error_rate=0.0):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_mock_handler(loci, latency, error_rate))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# Function to build the request handler of a static file server with HTTP range requests (as the hosts of the GTEx
+# and UCSC tracks), serving the files under root with a latency per request
+def make_static_handler(root, latency):
+    class StaticHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def send_file_headers(self, status, path, length, extra=None):
+            self.send_response(status)
+            self.send_header("Content-Length", str(length))
+            self.send_header("Last-Modified", formatdate(os.path.getmtime(path), usegmt=True))
+            self.send_header("Accept-Ranges", "bytes")
+            for key, value in (extra or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+
+        def resolve(self):
+            path = os.path.join(root, unquote(urlparse(self.path).path).lstrip("/"))
+            if not os.path.isfile(path):
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return None
+            return path
+
+        def do_HEAD(self):
+            time.sleep(latency)
+            path = self.resolve()
+            if path:
+                self.send_file_headers(200, path, os.path.getsize(path))
+
+        def do_GET(self):
+            time.sleep(latency)
+            path = self.resolve()
+            if not path:
+                return
+            size = os.path.getsize(path)
+            match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+            start, end = 0, size - 1
+            if match:
+                start, end = int(match.group(1)), min(int(match.group(2) or size - 1), size - 1)
+            with open(path, "rb") as file:
+                file.seek(start)
+                data = file.read(end - start + 1)
+            self.send_file_headers(206 if match else 200, path, len(data),
+                                   {"Content-Range": f"bytes {start}-{end}/{size}"} if match else None)
+            self.wfile.write(data)
+
+    return StaticHandler
+
+
+# Function to run a stage script in the fixture directory and read back its metrics summary
+def run_stage(script, arguments, workdir, env=None):
+    metrics_dir = os.path.join(workdir, "metrics", script.replace(".py", ""))
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    environment = dict(os.environ, NCRNA_METRICS_DIR=metrics_dir, NCRNA_LOG_LEVEL="ERROR", **(env or {}))
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, os.path.join(bin_dir, script), *arguments], cwd=workdir,
+                               env=environment, stdin=subprocess.DEVNULL, capture_output=True, text=True)
+    wall_time = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(f"{script} failed:\n{completed.stderr[-2000:]}")
+    summaries = sorted(glob.glob(os.path.join(metrics_dir, "*.json")))
+    metrics = {}
+    if summaries:
+        with open(summaries[-1]) as file:
+            metrics = json.load(file)
+    return wall_time, metrics
+
+
+def timer_total(metrics, prefix):
+    return round(sum(entry["total_s"] for key, entry in metrics.get("timers", {}).items() if key.startswith(prefix)), 6)
+
+
+def counter_total(metrics, prefix):
+    return sum(value for key, value in metrics.get("counters", {}).items() if key.startswith(prefix))
+
+
+def result(benchmark, params, wall_time, work, unit, **details):
+    return {"benchmark": benchmark, "params": params, "wall_time_s": round(wall_time, 6),
+            "throughput": round(work / wall_time, 3) if wall_time > 0 else None, "throughput_unit": unit,
+            "details": details}
+
+
+# Benchmark: HGNC search + BioMart transcript IDs + Ensembl lookup for every gene, against the mock server
+def bench_locus_fetch(workdir, group, loci, latency, error_rate):
+    server, base_url = start_mock_server(loci, latency, error_rate)
+    try:
+        env = {"NCRNA_HGNC_URL": f"{base_url}/hgnc", "NCRNA_ENSEMBL_REST_URL": f"{base_url}/ensembl",
+               "NCRNA_BIOMART_URL": f"{base_url}/biomart"}
+        output = os.path.join("fetched", f"{group}_data.txt")
+        os.makedirs(os.path.join(workdir, "fetched"), exist_ok=True)
+        wall_time, metrics = run_stage("fetch_ncrna_data.py", ["--query", group, "--output", output], workdir, env)
+    finally:
+        server.shutdown()
+    return result("locus_fetch", {"genes": len(loci), "latency_ms": latency * 1000, "error_rate": error_rate},
+                  wall_time, len(loci), "genes/s", http_s=timer_total(metrics, "http.request"),
+                  sleep_s=timer_total(metrics, "sleep"), requests=counter_total(metrics, "http.responses"),
+                  retries=counter_total(metrics, "http.retries"), loci_written=counter_total(metrics, "loci.written"),
+                  transient_failures=counter_total(metrics, "loci.skipped[reason=transient_error]"))
+
+
+# Benchmark: per-position conservation extraction of fetch_conservation_data.py
+def bench_conservation(workdir, group, n_genes, bigwig_size):
+    wall_time, metrics = run_stage("fetch_conservation_data.py", ["--group", group, "--track", "phyloP100"], workdir)
+    bases = counter_total(metrics, "bigwig.bases")
+    return result("conservation", {"genes": n_genes, "bigwig_mb": round(bigwig_size / 1024 ** 2, 1)}, wall_time,
+                  bases, "bases/s", bigwig_s=timer_total(metrics, "bigwig.values"),
+                  bigwig_calls=sum(entry["count"] for key, entry in metrics.get("timers", {}).items()
+                                   if key.startswith("bigwig.values")),
+                  rows_written=counter_total(metrics, "rows.written"))
+
+
+# Benchmark: GTEx maximum expression scan of fetch_expression_data.py over the synthetic tissue tracks
+def bench_gtex_scan(workdir, group, n_genes, n_tissues):
+    wall_time, metrics = run_stage("fetch_expression_data.py",
+                                   ["--group", group, "--output", f"data/GTEX-expr_summary/{group}_expr.csv",
+                                    "--skip-missing-tracks"], workdir)
+    return result("gtex_scan", {"genes": n_genes, "tissues": n_tissues}, wall_time, n_genes * n_tissues,
+                  "gene-tissues/s", bigwig_s=timer_total(metrics, "bigwig.values"),
+                  bases=counter_total(metrics, "bigwig.bases"), rows_written=counter_total(metrics, "rows.written"))
+
+
+# Benchmark: ENCODE report aggregation of fetch_ENCODE_expr.py
+def bench_encode(workdir, group, n_rows):
+    wall_time, metrics = run_stage("fetch_ENCODE_expr.py", ["--groups", group], workdir)
+    return result("encode", {"report_rows": n_rows}, wall_time, n_rows, "rows/s",
+                  scan_s=timer_total(metrics, "stage[step=scan_encode_report]"),
+                  rows_matched=counter_total(metrics, "rows.matched"))
+
+
+# Benchmark: BigBed symbol lookups of fetch_ncrna_hgnc.py (needs bedToBigBed to write the fixture)
+def bench_bigbed_lookup(bigbed_path, loci, n_lookups):
+    sys.path.insert(0, bin_dir)
+    from fetch_ncrna_hgnc import fetch_chromosomal_location
+    symbols = [locus["gene"] for locus in loci[:n_lookups]]
+    bigbed = pyBigWig.open(bigbed_path)
+    start = time.perf_counter()
+    found = sum(fetch_chromosomal_location(symbol, bigbed) is not None for symbol in symbols)
+    wall_time = time.perf_counter() - start
+    bigbed.close()
+    return result("bigbed_lookup", {"genes": len(loci), "lookups": len(symbols)}, wall_time, len(symbols),
+                  "lookups/s", found=found)
+
+
+# Benchmark: model training on the combined table upscaled with synthetic jittered copies
+def bench_model_training(scale, engine):
+    sys.path.insert(0, bin_dir)
+    from assemble_features import load_combined_table, feature_frame
+    from model_engines import build_engine, upscale_features
+    data = load_combined_table(write_csv=False)
+    X = np.ascontiguousarray(feature_frame(data, ["PhyloP100_median", "ENCODE_max"]).to_numpy())
+    y = (data["Gene_Type"] == "Functional").to_numpy().astype(np.int8)
+    X, y = upscale_features(X, y, scale)
+    model = build_engine(engine, n_jobs=-1)
+    start = time.perf_counter()
+    model.fit(X, y)
+    wall_time = time.perf_counter() - start
+    return result("model_training", {"scale": scale, "engine": engine}, wall_time, len(y), "rows/s")
+
+
+# Benchmark: genome-wide screening mode (genome_screen.py) over the synthetic loci, against the mock server
+def bench_genome_screen(workdir, loci, latency, chunk_size):
+    server, base_url = start_mock_server(loci, latency)
+    try:
+        wall_time, metrics = run_stage("genome_screen.py", ["--hgnc-file", "data/hgnc_complete_set.txt",
+                                                            "--output-dir", "screen", "--model-dir", "no_model",
+                                                            "--chunk-size", str(chunk_size)],
+                                       workdir, {"NCRNA_ENSEMBL_REST_URL": f"{base_url}/ensembl"})
+    finally:
+        server.shutdown()
+    with open(os.path.join(workdir, "screen", "throughput_report.csv")) as file:
+        report = {row["Stage"]: float(row["Seconds"]) for row in csv.DictReader(file)}
+    return result("genome_screen", {"genes": len(loci), "chunk_size": chunk_size, "latency_ms": latency * 1000},
+                  wall_time, len(loci), "loci/s", stage_s={stage: seconds for stage, seconds in report.items()
+                                                           if stage != "total"},
+                  loci_screened=counter_total(metrics, "loci.screened"))
+
+
+# Benchmark: interval index build and "pseudogenes within N bases of a functional gene" on random loci genome-wide
+def bench_interval_queries(n_loci, distance, seed=42):
+    sys.path.insert(0, bin_dir)
+    from interval_index import build_index, nearest
+    rng = np.random.default_rng(seed)
+    chrom_names = np.array([f"chr{number}" for number in range(1, 23)])
+    loci = {}
+    for kind in ["functional", "pseudogene"]:
+        starts = rng.integers(1, 200_000_000, n_loci)
+        loci[kind] = (rng.choice(chrom_names, n_loci), starts, starts + rng.integers(50, 500, n_loci))
+    start = time.perf_counter()
+    index = build_index(*loci["functional"])
+    build_time = time.perf_counter() - start
+    _, gaps, overlaps = nearest(index, *loci["pseudogene"])
+    wall_time = time.perf_counter() - start
+    return result("interval_queries", {"loci": n_loci, "distance": distance}, wall_time, n_loci, "queries/s",
+                  build_s=round(build_time, 6), within_distance=int((gaps <= distance).sum()),
+                  overlapping=int(overlaps.sum()))
+
+
+# Benchmark: sequence extraction from the memory-mapped genome and vectorised sequence features of all loci
+def bench_sequence_features(workdir, n_genes, genome_format, genome_size):
+    os.makedirs(os.path.join(workdir, "results"), exist_ok=True)
+    wall_time, metrics = run_stage("sequence_features.py",
+                                   ["--genome", f"data/hg38.{genome_format}", "--output",
+                                    f"results/sequence_features_{genome_format}.csv"], workdir)
+    bases = counter_total(metrics, "sequence.bases")
+    params = {"genes": n_genes, "genome_mb": round(genome_size / 1024 ** 2, 1)}
+    return result(f"sequence_features_{genome_format}", params, wall_time, bases, "bases/s",
+                  fetch_s=timer_total(metrics, "sequence.fetch"),
+                  features_s=timer_total(metrics, "stage[step=sequence_features]"),
+                  rows_written=counter_total(metrics, "rows.written"))
+
+
+# Benchmark: MinHash sketches, LSH candidate pairs and clustering of the loci of one gene group
+def bench_paralog_clusters(workdir, group, n_genes, n_families, divergence):
+    os.makedirs(os.path.join(workdir, "results"), exist_ok=True)
+    wall_time, metrics = run_stage("paralog_clusters.py", ["--genome", "data/hg38.2bit", "--groups", group,
+                                                          "--output", "results/paralog_clusters.csv"], workdir)
+    return result("paralog_clusters", {"genes": n_genes, "families": n_families, "divergence": divergence},
+                  wall_time, n_genes, "loci/s", minhash_s=timer_total(metrics, "stage[step=minhash]"),
+                  lsh_s=timer_total(metrics, "stage[step=lsh_candidates]"),
+                  candidate_pairs=counter_total(metrics, "paralog.candidate_pairs"),
+                  clusters=counter_total(metrics, "paralog.clusters"))
+
+
+# Benchmark: positional conservation meta-profile of one gene group, length-normalised and aligned from sequence
+# (the per-position scores are written by fetch_conservation_data.py first)
+def bench_conservation_profile(workdir, group, n_genes, align):
+    os.makedirs(os.path.join(workdir, "results"), exist_ok=True)
+    if not os.path.isfile(os.path.join(workdir, "data", "phyloP100_summary", f"{group}_cons_phyloP100_.csv")):
+        run_stage("fetch_conservation_data.py", ["--group", group, "--track", "phyloP100"], workdir)
+    wall_time, metrics = run_stage("conservation_profile.py",
+                                   ["--groups", group, "--tracks", "phyloP100", "--align", align, "--genome",
+                                    "data/hg38.2bit", "--output-dir", f"results/conservation_profiles_{align}"],
+                                   workdir)
+    return result(f"conservation_profile_{align}", {"genes": n_genes}, wall_time, n_genes, "loci/s",
+                  profile_s=timer_total(metrics, f"stage[step=profile_{align}]"),
+                  quantiles_s=timer_total(metrics, "stage[step=profile_quantiles]"),
+                  columns=counter_total(metrics, "profile.columns"))
+
+
+# Benchmark: fetch_expression_data.py and fetch_conservation_data.py reading the synthetic tracks by URL from a local
+# static file server (range requests through the block cache of remote_bigwig.py), with a cold and a warm cache
+# The outputs are checked against runs on the local files
+def bench_remote_bigwig(workdir, group, n_genes, n_tissues, latency):
+    os.makedirs(os.path.join(workdir, "results"), exist_ok=True)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_static_handler(workdir, latency))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    cache = os.path.join(workdir, "results", "remote_cache")
+    shutil.rmtree(cache, ignore_errors=True)
+    env = {"NCRNA_BIGWIG_CACHE": "off", "NCRNA_REMOTE_CACHE": cache}
+    conservation_csv = os.path.join(workdir, "data", "phyloP100_summary", f"{group}_cons_phyloP100_.csv")
+    track_bytes = sum(os.path.getsize(path) for path in glob.glob(os.path.join(workdir, "data", "*", "*.bw"))
+                      + glob.glob(os.path.join(workdir, "data", "*.bw")))
+
+    stages = {"expression": ("fetch_expression_data.py", ["--group", group, "--skip-missing-tracks"], "--output",
+                             "--track-url", f"{base_url}/data/GTEX-RNAseq"),
+              "conservation": ("fetch_conservation_data.py", ["--group", group, "--track", "phyloP100"], None,
+                               "--bigwig-url", f"{base_url}/data/hg38.phyloP100way.bw")}
+    timings, downloaded, requests = {}, 0, 0
+    try:
+        for stage, (script, arguments, output_option, url_option, url) in stages.items():
+            outputs = {}
+            for run in ["local", "cold", "warm"]:
+                output = os.path.join(workdir, "results", f"remote_{stage}_{run}.csv")
+                run_arguments = list(arguments) + ([output_option, output] if output_option else [])
+                if run != "local":
+                    run_arguments += [url_option, url]
+                timings[f"{stage}_{run}"], metrics = run_stage(script, run_arguments, workdir, env)
+                if not output_option:
+                    shutil.copy(conservation_csv, output)
+                with open(output, "rb") as file:
+                    outputs[run] = file.read()
+                if run != "local":
+                    downloaded += counter_total(metrics, "remote.bytes_downloaded")
+                    requests += counter_total(metrics, "remote.requests")
+            if not outputs["local"] == outputs["cold"] == outputs["warm"]:
+                raise RuntimeError(f"remote {stage} output differs from the local run")
+    finally:
+        server.shutdown()
+    cache_bytes = sum(os.path.getsize(path) for path in glob.glob(os.path.join(cache, "*", "0*")))
+    wall_time = timings["expression_cold"] + timings["conservation_cold"]
+    return result("remote_bigwig", {"genes": n_genes, "tissues": n_tissues, "latency_ms": latency * 1000},
+                  wall_time, n_genes * (n_tissues + 1), "locus_tracks/s",
+                  **{f"{name}_s": round(value, 3) for name, value in timings.items()},
+                  requests=requests, downloaded_mb=round(downloaded / 1024 ** 2, 3),
+                  cache_mb=round(cache_bytes / 1024 ** 2, 3), track_mb=round(track_bytes / 1024 ** 2, 3))
+
+
+# Function to build the fixture directory for the file-based benchmarks
+def build_fixtures(workdir, group, loci, covered_bases, n_tissues, encode_rows, need, n_families=10,
+                   divergence=0.03):
+    data_dir = os.path.join(workdir, "data")
+    for folder in ["phyloP100_summary", "GTEX-RNAseq", "GTEX-expr_summary", "ENCODE-expr_summary"]:
+        os.makedirs(os.path.join(data_dir, folder), exist_ok=True)
+    write_locus_file(os.path.join(data_dir, f"{group}_data.txt"), loci)
+
+    fixtures = {}
+    if "genome_screen" in need:
+        write_hgnc_complete_set(os.path.join(data_dir, "hgnc_complete_set.txt"), loci)
+        need = set(need) | {"conservation", "gtex_scan", "encode"}
+    if "remote_bigwig" in need:
+        need = set(need) | {"conservation", "gtex_scan"}
+    if "conservation" in need or "conservation_profile" in need:
+        fixtures["conservation_bigwig"] = write_bigwig(os.path.join(data_dir, "hg38.phyloP100way.bw"), covered_bases)
+    if "gtex_scan" in need:
+        for number, path in enumerate(gtex_file_paths()[:n_tissues]):
+            write_bigwig(os.path.join(workdir, path), covered_bases, seed=number)
+    if "encode" in need:
+        write_encode_report(os.path.join(workdir, encode_tsv), [locus["gene"] for locus in loci], encode_rows)
+    if "bigbed_lookup" in need:
+        fixtures["bigbed"] = write_bigbed(os.path.join(data_dir, "hgnc.bb"), loci)
+    if "sequence_features" in need or "paralog_clusters" in need or "conservation_profile" in need:
+        genome = make_genome(covered_bases)
+        plant_paralogs(genome, loci, n_families, divergence)
+        fixtures["2bit"] = write_twobit(os.path.join(data_dir, "hg38.2bit"), genome)
+        fixtures["fa"] = write_fasta(os.path.join(data_dir, "hg38.fa"), genome)
+    return fixtures
+
+
+# Function to compare each result with the previous run of the same benchmark and parameters
+def compare_with_history(results, history, threshold):
+    for entry in results:
+        previous = next((old for run in reversed(history) for old in run["results"]
+                         if old["benchmark"] == entry["benchmark"] and old["params"] == entry["params"]), None)
+        if previous is None:
+            entry["change"] = None
+            status = "new"
+        else:
+            entry["change"] = round(entry["wall_time_s"] / previous["wall_time_s"], 3)
+            status = "REGRESSION" if entry["change"] > threshold else "ok"
+        change = f"x{entry['change']:.2f} vs previous" if entry["change"] else "no previous run"
+        print(f"  {entry['benchmark']:<15} {entry['wall_time_s']:>9.3f}s  {entry['throughput'] or 0:>14,.1f} "
+              f"{entry['throughput_unit']:<15} {change:<20} {status}")
+    return [entry for entry in results if entry.get("change") and entry["change"] > threshold]
+
+
+def load_history(path):
+    if not os.path.isfile(path):
+        return []
+    with open(path) as file:
+        return json.load(file)
+
+
+def git_commit():
+    completed = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=bin_dir, capture_output=True, text=True)
+    return completed.stdout.strip() or None
+
+
+# Main Execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the pipeline stages on synthetic fixtures.")
+    parser.add_argument("--benchmarks", nargs="+", choices=benchmark_names, default=benchmark_names,
+                        help="Benchmarks to run (default: all).")
+    parser.add_argument("--group", default="RNU1",
+                        help="Gene group the synthetic loci are named after (one of the pipeline gene groups).")
+    parser.add_argument("--genes", type=int, default=500, help="Synthetic loci for the file-based stages.")
+    parser.add_argument("--locus-genes", type=int, default=20,
+                        help="Genes looked up against the mock server (fetch_ncrna_data.py sleeps 0.1s per transcript).")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Latency of every mock server response.")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of mock server responses that are 503 or 429 errors (default: 0).")
+    parser.add_argument("--covered-bases", type=int, default=2_000_000,
+                        help="Bases with values per chromosome in each synthetic BigWig (4 chromosomes).")
+    parser.add_argument("--tissues", type=int, default=3, help="Synthetic GTEx tissue tracks (at most 54).")
+    parser.add_argument("--encode-rows", type=int, default=200_000, help="Rows in the synthetic ENCODE report.")
+    parser.add_argument("--lookups", type=int, default=50, help="BigBed symbol lookups.")
+    parser.add_argument("--chunk-size", type=int, default=200, help="Loci per chunk of the genome-wide screen.")
+    parser.add_argument("--interval-loci", type=int, default=100_000,
+                        help="Functional loci and pseudogenes of the interval query benchmark (default: 100000).")
+    parser.add_argument("--distance", type=int, default=10_000, help="Distance of the interval query benchmark.")
+    parser.add_argument("--families", type=int, default=10,
+                        help="Paralog families planted in the synthetic genome (default: 10).")
+    parser.add_argument("--divergence", type=float, default=0.03,
+                        help="Fraction of mutated bases of each planted copy (default: 0.03).")
+    parser.add_argument("--model-scale", type=int, default=10, help="Upscaling factor of the model training table.")
+    parser.add_argument("--engine", default="random_forest", help="Model engine for the training benchmark.")
+    parser.add_argument("--history", default=history_file, help="JSON history file.")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="Slowdown vs the previous run reported as a regression (default: 1.2).")
+    parser.add_argument("--keep-fixtures", action="store_true", help="Keep the fixture directory and print its path.")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="ncrna_bench_")
+    loci = make_loci(args.group, args.genes, args.covered_bases)
+    results = []
+    try:
+        start = time.perf_counter()
+        fixtures = build_fixtures(workdir, args.group, loci, args.covered_bases, args.tissues, args.encode_rows,
+                                  args.benchmarks, args.families, args.divergence)
+        print(f"Fixtures written to {workdir} in {time.perf_counter() - start:.2f}s")
+
+        for benchmark in args.benchmarks:
+            print(f"Running {benchmark}...")
+            if benchmark == "locus_fetch":
+                results.append(bench_locus_fetch(workdir, args.group, loci[:args.locus_genes], args.latency_ms / 1000,
+                                                 args.error_rate))
+            elif benchmark == "conservation":
+                results.append(bench_conservation(workdir, args.group, args.genes, fixtures["conservation_bigwig"]))
+            elif benchmark == "gtex_scan":
+                results.append(bench_gtex_scan(workdir, args.group, args.genes, args.tissues))
+            elif benchmark == "encode":
+                results.append(bench_encode(workdir, args.group, args.encode_rows))
+            elif benchmark == "bigbed_lookup":
+                if fixtures["bigbed"] is None:
+                    print("Skipping bigbed_lookup: bedToBigBed is not installed (pyBigWig cannot write BigBed files)")
+                    continue
+                results.append(bench_bigbed_lookup(os.path.join(workdir, "data", "hgnc.bb"), loci, args.lookups))
+            elif benchmark == "genome_screen":
+                results.append(bench_genome_screen(workdir, loci, args.latency_ms / 1000, args.chunk_size))
+            elif benchmark == "interval_queries":
+                results.append(bench_interval_queries(args.interval_loci, args.distance))
+            elif benchmark == "paralog_clusters":
+                results.append(bench_paralog_clusters(workdir, args.group, args.genes, args.families,
+                                                      args.divergence))
+            elif benchmark == "sequence_features":
+                for genome_format in ["2bit", "fa"]:
+                    results.append(bench_sequence_features(workdir, args.genes, genome_format,
+                                                           fixtures[genome_format]))
+            elif benchmark == "conservation_profile":
+                for align in ["bins", "sequence"]:
+                    results.append(bench_conservation_profile(workdir, args.group, args.genes, align))
+            elif benchmark == "remote_bigwig":
+                results.append(bench_remote_bigwig(workdir, args.group, args.genes, args.tissues,
+                                                   args.latency_ms / 1000))
+            elif benchmark == "model_training":
+                results.append(bench_model_training(args.model_scale, args.engine))
+    finally:
+        if args.keep_fixtures:
+            print(f"Fixtures kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    history = load_history(args.history)
+    print("\nBenchmark results:")
+    regressions = compare_with_history(results, history, args.threshold)
+
+    history.append({"timestamp": time.strftime("%Y-%m-%d %H:%M:%S"), "git_commit": git_commit(),
+                     "python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count(),
+                     "results": results})
+    os.makedirs(os.path.dirname(args.history) or ".", exist_ok=True)
+    with open(args.history, "w") as file:
+        json.dump(history, file, indent=2)
+    print(f"History written to {args.history}")
+    if regressions:
+        sys.exit(f"{len(regressions)} benchmark(s) slower than x{args.threshold} of the previous run")
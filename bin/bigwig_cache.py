@@ -0,0 +1,183 @@
+import os
+import time
+import atexit
+import sqlite3
+import hashlib
+import logging
+import threading
+import numpy as np
+from instrumentation import count, timer, log_event
+
+# Persistent memo cache of BigWig interval queries, shared across reruns of fetch_expression_data.py and
+# fetch_conservation_data.py
+# Entries are keyed by the content fingerprint of the track and the interval (chrom, start, end, 0-based half-open as
+# in pyBigWig values()), so a replaced track never serves stale values. Each entry holds the float32 values of the
+# interval (exact: BigWig stores float32)
+# Stored in one SQLite database; when it grows past the size limit the least recently used entries are evicted
+# Several processes can share the cache (e.g. the conservation and expression stages, or shards on one file system):
+# the database is in WAL mode and every insert is committed at once, so no process holds the write lock for long, and
+# any SQLite error (such as a lock that outlasts the timeout) is treated as a miss or a skipped store, never as a
+# failed read of the track
+# Tuned with environment variables:
+#   NCRNA_BIGWIG_CACHE      cache directory (default: results/bigwig_cache, 'off' to disable)
+#   NCRNA_BIGWIG_CACHE_MB   size limit of the cached values in MB (default: 2048)
+
+cache_dir = os.environ.get("NCRNA_BIGWIG_CACHE", "results/bigwig_cache")
+cache_limit = int(float(os.environ.get("NCRNA_BIGWIG_CACHE_MB", "2048")) * 1024 ** 2)
+database_file = "intervals.sqlite"
+
+# Bytes read from each end of a track for its fingerprint: the header, zoom headers and chromosome tree are at the
+# start and the data index at the end, so together with the size they change whenever the content does
+fingerprint_bytes = 1 << 20
+
+_connection = None
+_open_failed = False
+_pending_hits = {}
+_lock = threading.Lock()
+
+
+# Function to fingerprint a BigWig file from its size and the bytes at both ends
+def track_fingerprint(path):
+    size = os.path.getsize(path)
+    digest = hashlib.sha1(str(size).encode())
+    with open(path, "rb") as file:
+        digest.update(file.read(fingerprint_bytes))
+        if size > fingerprint_bytes:
+            file.seek(max(fingerprint_bytes, size - fingerprint_bytes))
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+# Function to record a cache operation that failed, so the caller can carry on as if the cache had missed
+def cache_error(operation, error):
+    count("bigwig_cache.errors", operation=operation)
+    log_event("bigwig_cache_error", logging.WARNING, operation=operation, error=str(error))
+
+
+# Function to open the cache database on first use (None when the cache is disabled or cannot be opened, in which
+# case the run carries on without it)
+def connection():
+    global _connection, _open_failed
+    if cache_dir.lower() == "off" or _open_failed:
+        return None
+    with _lock:
+        if _connection is None:
+            os.makedirs(cache_dir, exist_ok=True)
+            try:
+                _connection = open_database(os.path.join(cache_dir, database_file))
+            except sqlite3.Error as e:
+                cache_error("open", e)
+                _open_failed = True
+                return None
+            atexit.register(close)
+        return _connection
+
+
+# Function to open the database in WAL mode (readers do not wait for writers) and create the table
+def open_database(path):
+    database = sqlite3.connect(path, timeout=60, check_same_thread=False)
+    try:
+        database.execute("PRAGMA journal_mode=WAL")
+        database.execute("PRAGMA synchronous=NORMAL")
+        database.execute("""CREATE TABLE IF NOT EXISTS intervals (
+                fingerprint TEXT, chrom TEXT, start INTEGER, end INTEGER, vals BLOB, size INTEGER, last_used REAL,
+                PRIMARY KEY (fingerprint, chrom, start, end))""")
+        database.execute("CREATE INDEX IF NOT EXISTS intervals_last_used ON intervals (last_used)")
+        database.commit()
+    except sqlite3.Error:
+        database.close()
+        raise
+    return database
+
+
+# Function to look up the values of an interval (a float32 array, or None on a miss)
+def get(fingerprint, chrom, start, end, track=None):
+    database = connection()
+    if database is None:
+        return None
+    with _lock:
+        try:
+            row = database.execute("SELECT vals FROM intervals WHERE fingerprint = ? AND chrom = ? AND start = ? AND "
+                                   "end = ?", (fingerprint, chrom, start, end)).fetchone()
+        except sqlite3.Error as e:
+            cache_error("get", e)
+            row = None
+        if row is None:
+            count("bigwig_cache.misses", track=track)
+            return None
+        # Recency updates are written in one batch when the cache is closed
+        _pending_hits[(fingerprint, chrom, start, end)] = time.time()
+    count("bigwig_cache.hits", track=track)
+    count("bigwig_cache.bases", end - start, track=track)
+    return np.frombuffer(row[0], dtype=np.float32)
+
+
+# Function to store the values of an interval (committed at once, see above)
+# The columns are named so caches written with the former summary stats columns can still be used
+def put(fingerprint, chrom, start, end, values):
+    database = connection()
+    if database is None:
+        return
+    values = np.asarray(values, dtype=np.float32)
+    with _lock:
+        try:
+            with database:
+                database.execute("INSERT OR REPLACE INTO intervals (fingerprint, chrom, start, end, vals, size, "
+                                 "last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                 (fingerprint, chrom, start, end, values.tobytes(), values.nbytes, time.time()))
+        except sqlite3.Error as e:
+            cache_error("put", e)
+
+
+# Function to read the values of an interval through the cache: bw.values() on a miss, stored for the next run
+def values(bw, fingerprint, chrom, start, end, track=None):
+    cached = get(fingerprint, chrom, start, end, track)
+    if cached is not None:
+        return cached
+    with timer("bigwig.values", track=track):
+        result = bw.values(chrom, start, end, numpy=True)
+    count("bigwig.bases", end - start, track=track)
+    put(fingerprint, chrom, start, end, result)
+    return result.astype(np.float32)
+
+
+# Function to evict the least recently used entries until the cached values fit in the size limit (with 10% slack,
+# so eviction does not run on every close)
+def evict(database, limit):
+    total = database.execute("SELECT COALESCE(SUM(size), 0) FROM intervals").fetchone()[0]
+    if total <= limit:
+        return 0
+    evicted = freed = 0
+    rows = database.execute("SELECT fingerprint, chrom, start, end, size FROM intervals ORDER BY last_used")
+    victims = []
+    for fingerprint, chrom, start, end, size in rows:
+        if total - freed <= 0.9 * limit:
+            break
+        victims.append((fingerprint, chrom, start, end))
+        freed += size
+        evicted += 1
+    rows.close()
+    database.executemany("DELETE FROM intervals WHERE fingerprint = ? AND chrom = ? AND start = ? AND end = ?",
+                         victims)
+    count("bigwig_cache.evictions", evicted)
+    log_event("bigwig_cache_evicted", logging.INFO, entries=evicted, bytes=freed, limit=limit)
+    return evicted
+
+
+# Function to write the pending recency updates, evict and close the cache (registered to run at exit)
+def close():
+    global _connection
+    with _lock:
+        if _connection is None:
+            return
+        try:
+            with _connection:
+                _connection.executemany("UPDATE intervals SET last_used = ? WHERE fingerprint = ? AND chrom = ? AND "
+                                        "start = ? AND end = ?",
+                                        [(used,) + key for key, used in _pending_hits.items()])
+                evict(_connection, cache_limit)
+        except sqlite3.Error as e:
+            cache_error("close", e)
+        _pending_hits.clear()
+        _connection.close()
+        _connection = None
@@ -0,0 +1,100 @@
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from assemble_features import load_combined_table, feature_frame, feature_columns, gene_groups
+from instrumentation import start_run, count, timer
+
+# Script to compute bootstrap confidence intervals for group-level medians (and other quantiles) of every feature
+# One interval per (gene group, gene type, feature, quantile), plus the pooled genes of each gene type
+# Resamples are drawn as NumPy index matrices in chunks (bounded memory) and the (group, type, feature) cells are
+# spread across a process pool
+# The output is a tidy table the R plotting scripts can read to draw error bars around the group medians
+
+output_csv = "results/bootstrap_quantile_intervals.csv"
+
+# Upper bound on the number of elements of one resampling chunk (chunk size x number of genes)
+max_chunk_elements = 4_000_000
+
+
+# Function to bootstrap the quantiles of one set of values
+# Returns the point estimates and the percentile interval of each quantile
+def bootstrap_quantiles(values, quantiles, n_resamples, confidence, seed):
+    n = len(values)
+    rng = np.random.default_rng(seed)
+    chunk_size = max(1, max_chunk_elements // n)
+    statistics = np.empty((n_resamples, len(quantiles)), dtype=np.float64)
+
+    done = 0
+    while done < n_resamples:
+        size = min(chunk_size, n_resamples - done)
+        indices = rng.integers(0, n, size=(size, n))
+        statistics[done:done + size] = np.quantile(values[indices], quantiles, axis=1).T
+        done += size
+
+    alpha = (1 - confidence) / 2
+    lower, upper = np.quantile(statistics, [alpha, 1 - alpha], axis=0)
+    return np.quantile(values, quantiles), lower, upper
+
+
+# Function run in a worker process: intervals for one (gene group, gene type, feature) cell
+def run_cell(task):
+    gene_group, gene_type, feature, values, quantiles, n_resamples, confidence, seed = task
+    rows = []
+    if len(values) == 0:
+        return rows
+    estimates, lower, upper = bootstrap_quantiles(values, quantiles, n_resamples, confidence, seed)
+    for quantile, estimate, low, high in zip(quantiles, estimates, lower, upper):
+        rows.append({"Gene_group": gene_group, "Gene_Type": gene_type, "Feature": feature,
+                     "Quantile": quantile, "Estimate": estimate, "CI_lower": low, "CI_upper": high,
+                     "n": len(values), "Resamples": n_resamples, "Confidence": confidence})
+    return rows
+
+
+# Function to build one task per (gene group, gene type, feature), plus the pooled genes of each gene type
+def build_tasks(data, quantiles, n_resamples, confidence, seed):
+    features = feature_frame(data, feature_columns)
+    tasks = []
+    for gene_group in gene_groups + ["Pooled"]:
+        in_group = np.ones(len(data), dtype=bool) if gene_group == "Pooled" else \
+            (data["Gene_group"] == gene_group).to_numpy()
+        for gene_type in ["Functional", "Pseudogene"]:
+            in_cell = in_group & (data["Gene_Type"] == gene_type).to_numpy()
+            for feature in feature_columns:
+                values = features[feature].to_numpy()[in_cell]
+                values = values[~np.isnan(values)].astype(np.float64)
+                tasks.append((gene_group, gene_type, feature, values, quantiles, n_resamples, confidence,
+                              [seed, len(tasks)]))
+    return tasks
+
+
+# Main Execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bootstrap confidence intervals for group-level feature quantiles.")
+    parser.add_argument("--resamples", type=int, default=10000, help="Bootstrap resamples (default: 10000).")
+    parser.add_argument("--quantiles", type=float, nargs="+", default=[0.25, 0.5, 0.75],
+                        help="Quantiles to estimate (default: 0.25 0.5 0.75).")
+    parser.add_argument("--confidence", type=float, default=0.95, help="Confidence level (default: 0.95).")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores).")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed.")
+    parser.add_argument("--output", default=output_csv, help="Output CSV file.")
+    args = parser.parse_args()
+    start_run("bootstrap_intervals")
+
+    start = time.perf_counter()
+    combined_data = load_combined_table(write_csv=False)
+    tasks = build_tasks(combined_data, args.quantiles, args.resamples, args.confidence, args.seed)
+    # Largest cells first so the pool is not left waiting on the pooled cells at the end
+    order = sorted(range(len(tasks)), key=lambda number: -len(tasks[number][3]))
+
+    with timer("stage", step="bootstrap"), ProcessPoolExecutor(max_workers=args.workers) as pool:
+        cell_rows = dict(zip(order, pool.map(run_cell, [tasks[number] for number in order])))
+    count("cells.skipped", sum(1 for task in tasks if len(task[3]) == 0), reason="no_values")
+
+    intervals = pd.DataFrame([row for number in range(len(tasks)) for row in cell_rows[number]])
+    # Features are float32 in the combined table, so 7 significant digits is their full precision
+    intervals.to_csv(args.output, index=False, float_format="%.7g")
+    count("rows.written", len(intervals), output="bootstrap_intervals")
+    print(f"{len(intervals)} intervals from {args.resamples} resamples in {time.perf_counter() - start:.2f}s")
+    print(f"Results written to {args.output}")
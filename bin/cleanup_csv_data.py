@@ -1,6 +1,7 @@
 import csv
 import os
 import sys
+from instrumentation import start_run, count
 
 # Path to the input file (update this path as needed)
 input_file = "results/combined_gene_data.csv"  # Input CSV file with the specified fields
@@ -42,6 +43,8 @@ def clean_gene_data():
             writer.writeheader()
             writer.writerows(valid_rows)
 
+        count("rows.written", len(valid_rows), output="combined_table")
+        count("rows.removed", len(invalid_rows), reason="trna_no_hyphen")
         print(f"Data cleaned successfully. Invalid rows have been removed.")
         if invalid_rows:
             print(f"\nInvalid rows removed (these had no hyphen in the gene and belonged to 'TRNA'):")
@@ -54,4 +57,5 @@ def clean_gene_data():
 
 # Main execution logic
 if __name__ == "__main__":
+    start_run("cleanup_csv_data")
     clean_gene_data()
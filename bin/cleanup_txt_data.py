@@ -1,12 +1,25 @@
 import re
 import os
 import sys
+import argparse
+from instrumentation import start_run, count
 
 # Regular expression to extract chromosome, start, and end information
 pattern = re.compile(r"(MT|\d+|X|Y|chr[\w\d_]+):([\d,]+)-([\d,]+)")
 
+# The input file, output file and the answer for TRNA genes without a hyphen can be passed on the command line
+# (used by pipeline.py). By default the input file is cleaned in place and the user is asked for each TRNA gene
+parser = argparse.ArgumentParser(description="Clean a {gene}_data.txt file or list genes of a {gene}_data_temp.txt file.")
+parser.add_argument("--input", default="data/TRNA_data.txt", help="Input file (default: data/TRNA_data.txt).")
+parser.add_argument("--output", help="Output file for cleaned gene data (default: overwrite the input file).")
+parser.add_argument("--no-hyphen", choices=["ask", "keep", "delete"], default="ask",
+                    help="What to do with TRNA gene blocks without a hyphen (default: ask).")
+args = parser.parse_args()
+start_run("cleanup_txt_data")
+
 # Path to the input file (update this path as needed)
-input_file = "data/TRNA_data.txt"  # This will be set for your gene data or temp data file
+input_file = args.input  # This will be set for your gene data or temp data file
+output_file = args.output or input_file
 
 # Ensure the input file exists
 if not os.path.isfile(input_file):
@@ -32,22 +45,34 @@ def clean_gene_data():
                 gene_match = re.search(r"Processing (.+) with Transcript ID", gene_data)
                 if gene_match:
                     current_gene = gene_match.group(1)
+                elif "Lookup failed" in gene_data:
+                    print(f"Warning: Lookup failed with a transient error in data segment:\n{gene_data.strip()}\n"
+                          f"Rerun fetch_ncrna_data.py for this gene.")
+                    count("loci.skipped", reason="transient_error")
+                    invalid_lines.append(gene_data)  # Store for invalid lines
+                    continue
                 elif "No location found" in gene_data:
                     print(f"Warning: No location found for gene {current_gene} in data segment.")
+                    count("loci.skipped", reason="no_location")
                     invalid_lines.append(gene_data)  # Store for invalid lines
                     continue
                 else:
                     print(f"Warning: Gene symbol not found in data segment:\n{gene_data}\n")
+                    count("loci.skipped", reason="no_gene_symbol")
                     invalid_lines.append(gene_data)  # Store for invalid lines
                     continue
 
-                if input_file == "data/TRNA_data.txt":
+                if os.path.basename(input_file) == "TRNA_data.txt":
                     # Check if the gene symbol contains at least one hyphen
                     if '-' not in current_gene:
                         print(f"Gene symbol '{current_gene}' does not contain a hyphen. Current block:\n{gene_data}")
-                        user_response = input("Do you want to delete this block? (y/n): ").strip().lower()
+                        if args.no_hyphen == "ask":
+                            user_response = input("Do you want to delete this block? (y/n): ").strip().lower()
+                        else:
+                            user_response = "y" if args.no_hyphen == "delete" else "n"
                         if user_response == 'y':
                             print(f"Block for gene '{current_gene}' marked for deletion.")
+                            count("loci.skipped", reason="no_hyphen")
                             continue  # Skip adding this block to valid_lines
 
                 # Extract the location string
@@ -59,13 +84,16 @@ def clean_gene_data():
                         end = int(location_match.group(3).replace(',', ''))
                     except ValueError as e:
                         print(f"Error parsing start/end positions for gene {current_gene}: {e}")
+                        count("loci.skipped", reason="bad_coordinates")
                         invalid_lines.append(gene_data)  # Store for invalid lines
                         continue
 
                     # If both gene and location are valid, store the gene data
                     valid_lines.append(gene_data)
+                    count("loci.kept")
                 else:
                     print(f"Warning: Location pattern not found for gene {current_gene} in data segment.")
+                    count("loci.skipped", reason="no_location_pattern")
                     invalid_lines.append(gene_data)  # Store for invalid lines
 
         # If invalid lines exist, print them
@@ -75,16 +103,17 @@ def clean_gene_data():
                 print(invalid_line)
 
         # Check if any changes have been made
-        if valid_lines == genes_data:
+        if valid_lines == genes_data and output_file == input_file:
             print("Nothing changed.")
         else:
-            # Overwrite the original file with only the valid lines
-            with open(input_file, 'w') as outfile:
+            # Overwrite the original file (or write the output file) with only the valid lines
+            with open(output_file, 'w') as outfile:
                 outfile.write("------".join(valid_lines))  # Join valid lines and write them back
             print(f"\nData cleaned successfully. Invalid lines have been removed.")
 
     except Exception as e:
         print(f"An unexpected error occurred while cleaning data: {e}")
+        sys.exit(1)
 
 
 # Function to handle {gene}_data_temp.txt
@@ -0,0 +1,343 @@
+import os
+import sys
+import time
+import argparse
+import warnings
+import numpy as np
+import pandas as pd
+from summarise_conservation import track_files
+from instrumentation import start_run, count, timer
+
+# Group-wide positional meta-profile of conservation across the copies of a gene group
+# The per-base scores of every copy (first locus of each gene, as written by fetch_conservation_data.py) are put on
+# the coordinates of the functional reference of the group, one row per copy of a score matrix:
+#   bins      each locus is cut into --bins bins of equal relative length (mean score per bin), in genomic orientation
+#             (the locus files have no strand)
+#   sequence  each locus is aligned to the reference sequence (overlap alignment, both orientations), so a column is
+#             one reference base and insertions, truncations and reverse-strand copies are placed correctly
+# The matrix is memory-mapped (results/conservation_profiles/{group}_{track}_scores.npy) and its position-wise
+# quantiles are computed over blocks of columns for all copies, the functional copies and the pseudogenes
+# Written per gene group and track: {group}_{track}_profile.csv (one row per class and position, long format for
+# plotting) and {group}_{track}_copies.csv (matrix row, orientation and alignment of each copy)
+
+output_dir = "results/conservation_profiles"
+
+quantiles = [0.1, 0.25, 0.5, 0.75, 0.9]
+quantile_columns = ["Q10", "Q25", "Median", "Q75", "Q90"]
+profile_classes = ["All", "Functional", "Pseudogene"]
+
+# Alignment scores (base codes A=0 C=1 G=2 T=3 N=4 as in sequence_features.py; N scores 0 against any base)
+match_score, mismatch_score, gap_score = 1, -1, -2
+substitution = np.where(np.eye(5, dtype=bool), match_score, mismatch_score).astype(np.int32)
+substitution[4, :] = substitution[:, 4] = 0
+complement = np.array([3, 2, 1, 0, 4], dtype=np.uint8)
+
+# Copies whose alignment matrix would be larger than this fall back to length-normalised positions
+max_alignment_cells = 4_000_000
+
+# Columns of the score matrix read at a time for the quantiles
+columns_per_block = 1024
+
+
+# Function to choose the functional reference of a gene group: the requested gene if it is in the group, otherwise the
+# functional gene with the shortest name (RNU1-1, RN7SK), ties in alphabetical order
+def choose_reference(copies, requested=()):
+    genes = copies["Gene"].tolist()
+    for gene in requested:
+        if gene in genes:
+            return genes.index(gene)
+    functional = copies[copies["Gene_Type"] == "Functional"]
+    if functional.empty:
+        return None
+    names = functional["Gene"]
+    return int(names.index[np.lexsort((names.to_numpy(), names.str.len().to_numpy()))[0]])
+
+
+# Function to read the per-base score vector of every copy from the per-position scores of a group
+# Returns one concatenated float32 array and the offsets of each copy in it (NaN where a position has no score)
+def read_score_vectors(scores_csv, copies):
+    with timer("csv.read", source="conservation_scores"):
+        scores = pd.read_csv(scores_csv, usecols=["Gene", "Chromosome", "Position", "Score"],
+                             dtype={"Gene": str, "Chromosome": str, "Position": np.int64, "Score": np.float32})
+    count("rows.read", len(scores), source="conservation_scores")
+
+    lengths = (copies["End"] - copies["Start"] + 1).to_numpy(dtype=np.int64)
+    offsets = np.r_[0, np.cumsum(lengths)]
+    located = copies[["Gene", "Chromosome", "Start", "End"]].assign(Row=np.arange(len(copies)))
+    scores = scores.merge(located, on="Gene", suffixes=("", "_locus"))
+    # Genes with several loci have the scores of all of them; only those of the first locus are kept
+    scores = scores[(scores["Chromosome"] == scores["Chromosome_locus"]) & (scores["Position"] >= scores["Start"])
+                    & (scores["Position"] <= scores["End"])]
+    values = np.full(offsets[-1], np.nan, dtype=np.float32)
+    values[offsets[scores["Row"].to_numpy()] + (scores["Position"] - scores["Start"]).to_numpy()] = \
+        scores["Score"].to_numpy()
+    return values, offsets
+
+
+# Function to put every score vector on n_bins bins of equal relative length (mean of the scores in each bin)
+# Bins of loci shorter than n_bins hold no base; they take the score of the base under their centre
+def bin_profiles(values, offsets, n_bins):
+    lengths = np.diff(offsets)
+    copy_of = np.repeat(np.arange(len(lengths)), lengths)
+    position = np.arange(len(values)) - offsets[copy_of]
+    cells = copy_of * n_bins + position * n_bins // lengths[copy_of]
+
+    scored = ~np.isnan(values)
+    sums = np.bincount(cells[scored], weights=values[scored], minlength=len(lengths) * n_bins)
+    counts = np.bincount(cells[scored], minlength=len(lengths) * n_bins)
+    filled = np.bincount(cells, minlength=len(lengths) * n_bins).reshape(-1, n_bins) > 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        profiles = (sums / counts).reshape(-1, n_bins)
+
+    centres = offsets[:-1, None] + ((np.arange(n_bins) + 0.5) * lengths[:, None] / n_bins).astype(np.int64)
+    centres = np.minimum(centres, np.maximum(offsets[1:, None] - 1, 0))
+    centre_values = values[centres] if len(values) else np.full(profiles.shape, np.nan)
+    profiles = np.where(filled, profiles, np.where(lengths[:, None] > 0, centre_values, np.nan))
+    return profiles.astype(np.float32)
+
+
+# Function to align a sequence to the reference (overlap alignment, linear gaps: the ends of either sequence may be
+# left out for free, as for truncated copies)
+# Each row of the score matrix is computed with array operations: the best left-gap chain is a running maximum
+# Returns the alignment score and, for each reference base, the aligned position in the sequence (-1 for a gap)
+def align(reference, codes):
+    n, m = len(reference), len(codes)
+    scores = np.zeros((n + 1, m + 1), dtype=np.int32)
+    match = substitution[reference[:, None], codes[None, :]]
+    column_gaps = np.arange(m + 1, dtype=np.int32) * gap_score
+    best_left = np.empty(m + 1, dtype=np.int32)
+    best_left[0] = 0
+    for i in range(1, n + 1):
+        np.maximum(scores[i - 1, :-1] + match[i - 1], scores[i - 1, 1:] + gap_score, out=best_left[1:])
+        scores[i] = np.maximum.accumulate(best_left - column_gaps) + column_gaps
+
+    # The alignment ends in the last row or column (the rest of the other sequence is left out)
+    last_row, last_column = int(scores[n].argmax()), int(scores[:, m].argmax())
+    if scores[n, last_row] >= scores[last_column, m]:
+        i, j = n, last_row
+    else:
+        i, j = last_column, m
+    score = int(scores[i, j])
+
+    mapping = np.full(n, -1, dtype=np.int64)
+    while i > 0 and j > 0:
+        if scores[i, j] == scores[i - 1, j - 1] + match[i - 1, j - 1]:
+            mapping[i - 1] = j - 1
+            i, j = i - 1, j - 1
+        elif scores[i, j] == scores[i - 1, j] + gap_score:
+            i -= 1
+        elif scores[i, j] == scores[i, j - 1] + gap_score:
+            j -= 1
+        else:
+            break
+    return score, mapping
+
+
+# Function to put every score vector on the bases of the reference by aligning the sequence of each copy (forward and
+# reverse complement) to the reference sequence
+# Copies identical to the reference on fewer than min_identity of its bases (another family, or too truncated) are
+# left out of the profile
+# Returns the profiles and, per copy, the orientation, alignment, alignment score and identity to the reference
+def aligned_profiles(values, offsets, codes, code_offsets, reference, min_identity=0.5):
+    n_copies, n_columns = len(offsets) - 1, len(reference)
+    profiles = np.full((n_copies, n_columns), np.nan, dtype=np.float32)
+    details = {"Orientation": [], "Alignment": [], "Alignment_score": [], "Identity": []}
+    for copy in range(n_copies):
+        sequence = codes[code_offsets[copy]:code_offsets[copy + 1]]
+        copy_values = values[offsets[copy]:offsets[copy + 1]]
+        if len(sequence) != len(copy_values) or len(sequence) == 0:
+            # Sequence missing from the genome (or of another length than the scored locus)
+            count("profile.copies_skipped", reason="no_sequence")
+            for key, value in zip(details, [None, "none", None, None]):
+                details[key].append(value)
+            continue
+
+        if len(sequence) * n_columns > max_alignment_cells:
+            mapping = ((np.arange(n_columns) + 0.5) * len(sequence) / n_columns).astype(np.int64)
+            orientation, alignment, score = "+", "length", None
+        else:
+            forward = align(reference, sequence)
+            reverse = align(reference, complement[sequence[::-1]])
+            if reverse[0] > forward[0]:
+                (score, mapping), orientation = reverse, "-"
+                copy_values = copy_values[::-1]
+                sequence = complement[sequence[::-1]]
+            else:
+                (score, mapping), orientation = forward, "+"
+            alignment = "sequence"
+        aligned = mapping >= 0
+        identity = (sequence[mapping[aligned]] == reference[aligned]).sum() / n_columns
+        if alignment == "sequence" and identity < min_identity:
+            alignment = "unaligned"
+        else:
+            profiles[copy, aligned] = copy_values[mapping[aligned]]
+        for key, value in zip(details, [orientation, alignment, score, round(float(identity), 4)]):
+            details[key].append(value)
+        count("profile.copies_aligned", alignment=alignment)
+    return profiles, details
+
+
+# Function to write the score matrix to a memory-mapped .npy file (through a temporary file) and map it read-only
+def write_score_matrix(path, profiles):
+    matrix = np.lib.format.open_memmap(f"{path}.tmp", mode="w+", dtype=np.float32, shape=profiles.shape)
+    matrix[:] = profiles
+    matrix.flush()
+    del matrix
+    os.replace(f"{path}.tmp", path)
+    return np.load(path, mmap_mode="r")
+
+
+# Function to compute the position-wise quantiles of some rows of the score matrix, a block of columns at a time
+def profile_quantiles(matrix, rows):
+    n_columns = matrix.shape[1]
+    summary = {"N_copies": np.zeros(n_columns, dtype=np.int64), "Mean": np.full(n_columns, np.nan)}
+    summary.update({column: np.full(n_columns, np.nan) for column in quantile_columns})
+    if len(rows) == 0:
+        return summary
+    with warnings.catch_warnings():
+        # Columns without any score (all NaN) give NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        for first in range(0, n_columns, columns_per_block):
+            block = np.asarray(matrix[rows, first:first + columns_per_block], dtype=np.float64)
+            columns = slice(first, first + block.shape[1])
+            summary["N_copies"][columns] = (~np.isnan(block)).sum(axis=0)
+            summary["Mean"][columns] = np.nanmean(block, axis=0)
+            for column, values in zip(quantile_columns, np.nanquantile(block, quantiles, axis=0)):
+                summary[column][columns] = values
+    return summary
+
+
+# Function to build the meta-profile of one gene group and track
+# copies: loci of the group (first locus of each gene) with Gene, Chromosome, Start, End and Gene_Type
+# Returns the profile table, the copies table and the path of the score matrix
+def conservation_profile(copies, scores_csv, matrix_path, mode="bins", n_bins=100, genome=None, reference_genes=(),
+                         min_identity=0.5):
+    copies = copies.reset_index(drop=True)
+    reference = choose_reference(copies, reference_genes)
+    if reference is None:
+        raise ValueError("no functional reference in the group")
+    values, offsets = read_score_vectors(scores_csv, copies)
+    lengths = np.diff(offsets)
+    copies_table = copies[["Gene", "Gene_Type", "Chromosome", "Start", "End"]].copy()
+    copies_table["Row"] = np.arange(len(copies))
+    scored_bases = np.bincount(np.repeat(np.arange(len(copies)), lengths), weights=~np.isnan(values),
+                               minlength=len(copies))
+    copies_table["Scored_fraction"] = np.round(scored_bases / np.maximum(lengths, 1), 4)
+
+    with timer("stage", step=f"profile_{mode}"):
+        if mode == "bins":
+            profiles = bin_profiles(values, offsets, n_bins)
+            reference_length = lengths[reference]
+            reference_positions = np.floor((np.arange(n_bins) + 0.5) * reference_length / n_bins).astype(np.int64) + 1
+            reference_bases = None
+        else:
+            from sequence_features import fetch_loci, bases
+            codes, code_offsets = fetch_loci(genome, copies["Chromosome"], copies["Start"], copies["End"])
+            reference_codes = codes[code_offsets[reference]:code_offsets[reference + 1]]
+            if len(reference_codes) == 0:
+                raise ValueError(f"no sequence for the reference {copies['Gene'][reference]}")
+            profiles, details = aligned_profiles(values, offsets, codes, code_offsets, reference_codes,
+                                                 min_identity)
+            for key, column in details.items():
+                copies_table[key] = column
+            reference_positions = np.arange(1, len(reference_codes) + 1)
+            reference_bases = bases[reference_codes]
+
+    with timer("stage", step="profile_quantiles"):
+        matrix = write_score_matrix(matrix_path, profiles)
+        is_functional = (copies["Gene_Type"] == "Functional").to_numpy()
+        class_rows = {"All": np.arange(len(copies)), "Functional": np.flatnonzero(is_functional),
+                      "Pseudogene": np.flatnonzero(~is_functional)}
+        frames = []
+        for profile_class in profile_classes:
+            frame = pd.DataFrame({"Class": profile_class, "Position": np.arange(1, matrix.shape[1] + 1),
+                                  "Reference_position": reference_positions})
+            if reference_bases is not None:
+                frame["Reference_base"] = reference_bases
+            frame["Reference_score"] = matrix[reference]
+            for column, summary in profile_quantiles(matrix, class_rows[profile_class]).items():
+                frame[column] = summary
+            frames.append(frame)
+    profile = pd.concat(frames, ignore_index=True)
+    profile.insert(0, "Reference", copies["Gene"][reference])
+    count("profile.copies", len(copies))
+    count("profile.columns", matrix.shape[1])
+    return profile, copies_table, matrix_path
+
+
+# Function to build the figure spec of a profile (median and interquartile range of the functional copies and the
+# pseudogenes, drawn by render_figures.py)
+def profile_figure_spec(profile, name, track):
+    classes = {}
+    rows = profile[profile["Class"] == "All"]
+    for profile_class in ["Functional", "Pseudogene"]:
+        class_rows = profile[profile["Class"] == profile_class]
+        if class_rows["N_copies"].sum() > 0:
+            classes[profile_class] = {column: class_rows[column].to_numpy() for column in ["Median", "Q25", "Q75"]}
+    return {"kind": "conservation_profile", "name": name, "position": rows["Reference_position"].to_numpy(),
+            "classes": classes, "xlabel": f"Position in {profile['Reference'].iloc[0]}", "ylabel": track}
+
+
+# Main Execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Positional conservation meta-profiles of the copies of gene groups.")
+    parser.add_argument("--groups", nargs="+", help="Gene groups (default: every group with per-position scores).")
+    parser.add_argument("--tracks", nargs="+", choices=list(track_files), default=list(track_files),
+                        help="Conservation tracks (default: all with per-position scores).")
+    parser.add_argument("--align", choices=["bins", "sequence"], default="bins",
+                        help="Put the copies on length-normalised bins (default) or align their sequences to the "
+                             "reference (needs --genome).")
+    parser.add_argument("--bins", type=int, default=100, help="Bins of the length-normalised profile (default: 100).")
+    parser.add_argument("--genome", help="hg38 2bit file or FASTA file for --align sequence "
+                                         "(default: data/hg38.2bit or data/hg38.fa).")
+    parser.add_argument("--reference", nargs="+", default=[],
+                        help="Functional reference gene(s), used for the group they belong to (default: the "
+                             "functional gene with the shortest name).")
+    parser.add_argument("--min-identity", type=float, default=0.5,
+                        help="Fraction of the reference bases a copy must match to enter an aligned profile "
+                             "(default: 0.5).")
+    parser.add_argument("--output-dir", default=output_dir, help="Output directory.")
+    parser.add_argument("--plot", action="store_true", help="Also render a PNG of each profile.")
+    args = parser.parse_args()
+    start_run("conservation_profile")
+
+    from interval_index import read_all_loci
+    genome = None
+    if args.align == "sequence":
+        from sequence_features import open_genome
+        try:
+            genome = open_genome(args.genome)
+        except (FileNotFoundError, ValueError) as e:
+            sys.exit(f"Error: {e}")
+
+    start = time.perf_counter()
+    loci = read_all_loci().drop_duplicates("Gene", keep="first")
+    groups = args.groups or list(loci["Gene_group"].unique())
+    os.makedirs(args.output_dir, exist_ok=True)
+    specs = []
+    for gene_group in groups:
+        copies = loci[loci["Gene_group"] == gene_group]
+        for track in args.tracks:
+            scores_csv = track_files[track][0].format(group=gene_group)
+            if copies.empty or not os.path.isfile(scores_csv):
+                continue
+            base = os.path.join(args.output_dir, f"{gene_group}_{track}")
+            try:
+                profile, copies_table, _ = conservation_profile(copies, scores_csv, f"{base}_scores.npy", args.align,
+                                                                args.bins, genome, args.reference, args.min_identity)
+            except ValueError as e:
+                print(f"Skipping {gene_group} {track}: {e}")
+                continue
+            profile.insert(0, "Track", track)
+            profile.insert(0, "Gene_group", gene_group)
+            profile.to_csv(f"{base}_profile.csv", index=False, float_format="%.6g")
+            copies_table.to_csv(f"{base}_copies.csv", index=False)
+            count("rows.written", len(profile), output="conservation_profile")
+            print(f"{gene_group} {track}: {len(copies_table)} copies on {profile['Position'].max()} positions of "
+                  f"{profile['Reference'].iloc[0]}, written to {base}_profile.csv")
+            specs.append(profile_figure_spec(profile, f"{gene_group}_{track}_profile", track))
+
+    if args.plot and specs:
+        from render_figures import render_figures
+        render_figures(specs, figure_dir=args.output_dir, workers=1)
+    print(f"{len(specs)} profiles in {time.perf_counter() - start:.2f}s")
@@ -1,4 +1,6 @@
 import csv
+import argparse
+from instrumentation import start_run, count, timer
 
 # Step 1: Extract Gene Symbols from the TXT file
 def extract_gene_symbols(txt_file):
@@ -26,18 +28,24 @@ def fetch_max_expression_data(tsv_file, gene_symbols):
         reader.fieldnames = [field.strip() for field in reader.fieldnames]
         gene_data = {gene: {'TPM': [], 'FPKM': []} for gene in gene_symbols}
 
-        # Store TPM and FPKM values for each gene symbol
+        # Store TPM and FPKM values for each gene symbol (rows counted locally, added to the metrics once)
+        rows_read = rows_matched = 0
         for row in reader:
+            rows_read += 1
             gene_symbol = row['Gene symbol']  # Adjust after checking headers
             if gene_symbol in gene_symbols:
+                rows_matched += 1
                 gene_data[gene_symbol]['TPM'].append(float(row['TPM']))
                 gene_data[gene_symbol]['FPKM'].append(float(row['FPKM']))
+        count("rows.read", rows_read, input="encode_report")
+        count("rows.matched", rows_matched, input="encode_report")
         
         # Find max TPM and FPKM for each gene
         for gene, values in gene_data.items():
             if values['TPM']:
                 max_tpm = max(values['TPM'])
             else:
+                count("genes.without_expression", source="encode")
                 max_tpm = None
             if values['FPKM']:
                 max_fpkm = max(values['FPKM'])
@@ -59,22 +67,32 @@ def save_to_csv(data, output_csv):
         
         # Write the data rows
         writer.writerows(data)
+    count("rows.written", len(data), output="encode_expression")
 
 # Main Execution
 if __name__ == "__main__":
     
     
     gene_groups = ["RNU1", "RNU2", "RNU4", "RNU5", "RNU6", "RNU4ATAC", "RNU6ATAC", "RNU11", "RNU12", "VTRNA", "RNY", "TRNA", "RN7SL", "RNU7", "RN7SK"]
+
+    # Optionally restrict to some gene groups (used by pipeline.py to run one group per node)
+    parser = argparse.ArgumentParser(description="Fetch maximum ENCODE TPM and FPKM for each gene group.")
+    parser.add_argument("--groups", nargs="+", choices=gene_groups, default=gene_groups, help="Gene groups to process.")
+    args = parser.parse_args()
+    start_run("fetch_ENCODE_expr")
     
-    for gene_group in gene_groups:        
+    for gene_group in args.groups:        
         # Input file paths
         txt_file = f"data/{gene_group}_data.txt"  # Replace with the path to your TXT file
         tsv_file = "data/rna_expression_report_2024_11_20_22h_6m.tsv" 
         output_csv = f"data/ENCODE-expr_summary/{gene_group}_expr.csv"
         
         # Process the files
-        gene_symbols = extract_gene_symbols(txt_file)
-        max_expression_data = fetch_max_expression_data(tsv_file, gene_symbols)
-        save_to_csv(max_expression_data, output_csv)
+        with timer("stage", step="extract_gene_symbols"):
+            gene_symbols = extract_gene_symbols(txt_file)
+        with timer("stage", step="scan_encode_report"):
+            max_expression_data = fetch_max_expression_data(tsv_file, gene_symbols)
+        with timer("stage", step="write_csv"):
+            save_to_csv(max_expression_data, output_csv)
         
         print(f"Results saved to {output_csv}")
@@ -1,29 +1,61 @@
 import re
-import pyBigWig
 import csv
 import os
 import sys
+import argparse
+import logging
+from collections import Counter
+from interval_index import merge_clusters
+import bigwig_cache
+from remote_bigwig import is_remote, open_track
+from sharding import add_shard_arguments, shard_of, shard_path, write_manifest
+from instrumentation import start_run, count, timer, log_event
 
+# The gene group and conservation type can be passed on the command line (used by pipeline.py),
+# otherwise the conservation type is asked for as before
+parser = argparse.ArgumentParser(description="Fetch per-position conservation scores for a gene group.")
+parser.add_argument("--group", default="RN7SK", help="Gene group to process (default: RN7SK).")
+parser.add_argument("--track", choices=["phastCons30", "phyloP100", "phyloP447"], help="Conservation track.")
+parser.add_argument("--bigwig-url", help="Read the track from this URL with HTTP range requests (through the block "
+                                         "cache of remote_bigwig.py) instead of the local BigWig file.")
+add_shard_arguments(parser)
+args = parser.parse_args()
+start_run("fetch_conservation_data")
 
-gene_group = "RN7SK" # Update with the gene group you are working with
-cons_type = input("Enter the conservation type (a: phastCons30, b: phyloP100, c: phyloP447): ").strip().lower() # Get the conservation type from the user
+gene_group = args.group # Update with the gene group you are working with
+if args.track:
+    cons_type = {"phastCons30": "a", "phyloP100": "b", "phyloP447": "c"}[args.track]
+else:
+    cons_type = input("Enter the conservation type (a: phastCons30, b: phyloP100, c: phyloP447): ").strip().lower() # Get the conservation type from the user
 
 # Define the BigWig file and output file based on the conservation type
 if (cons_type == "a"):
     bw_file = "data/hg38.phastCons30way.bw"
+    track = "phastCons30"
     output_file = f"data/phastCons30_summary/{gene_group}_cons.csv"  # Define the output file for CSV format
 elif (cons_type == "b"):
     bw_file = "data/hg38.phyloP100way.bw"
+    track = "phyloP100"
     output_file = f"data/phyloP100_summary/{gene_group}_cons_phyloP100_.csv"  # Define the output file for CSV format
 elif (cons_type == "c"):
     bw_file = "data/hg38.phyloP447way.bw"
+    track = "phyloP447"
     output_file = f"data/phyloP447_summary/{gene_group}_cons_phyloP447_.csv"  # Define the output file for CSV format
 else:
     sys.exit(f"Error: Conservation type '{cons_type}' is not supported.")
+# The track name (used in metrics, cache keys and the shard manifest) comes from the conservation type, not the file
+# name, so a --bigwig-url with any name is labelled the same as the local file
+if args.bigwig_url:
+    bw_file = args.bigwig_url
 
 # Define the input file containing the gene data
 input_file = f"data/{gene_group}_data.txt"
 
+# In shard mode only this shard's loci are written, to a partial output merged by sharding.py
+serial_output_file = output_file
+if args.shard:
+    output_file = shard_path(output_file, args.shard)
+
 temp_output_file = f"{output_file}.tmp"  # Temporary file for output
 
 # Regular expression to extract chromosome, start, and end information
@@ -31,28 +63,49 @@ temp_output_file = f"{output_file}.tmp"  # Temporary file for output
 pattern = re.compile(r"(chr[\w\d_]+|\d+|X|Y|MT):([\d,]+)-([\d,]+)")
 
 # Ensure input files exist
-if not os.path.isfile(bw_file):
+if not is_remote(bw_file) and not os.path.isfile(bw_file):
     sys.exit(f"Error: BigWig file '{bw_file}' does not exist.")
 if not os.path.isfile(input_file):
     sys.exit(f"Error: Input file '{input_file}' does not exist.")
 
+# Function to read the score of every position of an interval, one value() call per position as before
+# Returns {position: score}, positions without a score map to the reason they were skipped
+# Intervals read without errors are kept in the interval cache (as the range i = start..end), so a rerun over the
+# same loci and track does not read the BigWig again
+def read_position_scores(bw, chrom, start, end):
+    cached = bigwig_cache.get(fingerprint, chrom, start, end + 1, track)
+    if cached is not None:
+        return {i: float(score) for i, score in zip(range(start, end + 1), cached)}
+    count("bigwig.bases", end - start + 1, track=track)
+    scores = {}
+    for i in range(start, end + 1):
+        try:
+            with timer("bigwig.values", track=track):
+                values = bw.values(chrom, i, i + 1)
+            scores[i] = values[0] if values else "no_score"  # Ensure that scores are returned for the position
+        except RuntimeError as e:
+            scores[i] = "bigwig_error"
+            log_event("bigwig_error", logging.DEBUG, track=track, chrom=chrom, position=i, error=str(e))
+    if not any(isinstance(score, str) for score in scores.values()):
+        bigwig_cache.put(fingerprint, chrom, start, end + 1, list(scores.values()))
+    return scores
+
+
 try:
     # Open the bigWig file
-    bw = pyBigWig.open(bw_file)
+    bw = open_track(bw_file)
     if not bw.isBigWig():
         sys.exit(f"Error: File '{bw_file}' is not a valid BigWig file.")
+    fingerprint = bw.fingerprint if is_remote(bw_file) else bigwig_cache.track_fingerprint(bw_file)
 
-    # Open the input file and the output CSV file
-    with open(input_file, 'r') as infile, open(temp_output_file, 'w', newline='') as outfile:
-        writer = csv.writer(outfile)
+    # Step 1: Parse the loci of the input file
+    loci = []
+    with open(input_file, 'r') as infile:
         raw_data = infile.read()
 
         # Split the raw data based on '------' to get each gene's information
         genes_data = raw_data.split("------")
 
-        # Write the CSV header
-        writer.writerow(['Gene', 'Chromosome', 'Position', 'Score'])
-
         current_gene = None
         for gene_data in genes_data:
             # Extract the gene symbol
@@ -60,7 +113,8 @@ try:
             if gene_match:
                 current_gene = gene_match.group(1)
             else:
-                print(f"Warning: Gene symbol not found in data segment:\n{gene_data}\n")
+                count("loci.skipped", reason="no_gene_symbol")
+                log_event("locus_skipped", logging.DEBUG, reason="no_gene_symbol", segment=gene_data.strip()[:200])
                 continue
 
             # Extract the location string
@@ -77,32 +131,76 @@ try:
                     start = int(location_match.group(2).replace(',', ''))
                     end = int(location_match.group(3).replace(',', ''))
                 except ValueError as e:
-                    print(f"Error parsing start/end positions for gene {current_gene}: {e}")
+                    count("loci.skipped", reason="bad_coordinates")
+                    log_event("locus_skipped", logging.WARNING, reason="bad_coordinates", gene=current_gene, error=str(e))
                     continue
-
-                # Get individual scores for each position in the range
-                for i in range(start, end + 1):
-                    try:
-                        scores = bw.values(chrom, i, i + 1)
-                        if scores:  # Ensure that scores are returned for the position
-                            score = scores[0]  # Extract the score for the current position
-                            writer.writerow([current_gene, chrom, i, score])
-                        else:
-                            print(f"Warning: No score data for {chrom}:{i}")
-                    except RuntimeError as e:
-                        print(f"Error fetching scores for {chrom}:{i}: {e}")
-                        continue
+                loci.append((current_gene, chrom, start, end))
             else:
-                print(f"Warning: Location pattern not found for gene {current_gene} in data segment.")
+                count("loci.skipped", reason="no_location")
+                log_event("locus_skipped", logging.INFO, reason="no_location", gene=current_gene)
+
+    # Step 2: Merge overlapping loci (duplicate transcripts, nested or neighbouring copies) so that every position
+    # is read from the BigWig once; the scores of a cluster are kept until its last locus is written
+    cluster_of, spans = merge_clusters([locus[1] for locus in loci], [locus[2] for locus in loci],
+                                       [locus[3] for locus in loci])
+    remaining = Counter(cluster_of.tolist())
+    cluster_scores = {}
+    count("bigwig.bases_deduplicated", sum(end - start + 1 for _, _, start, end in loci)
+          - sum(end - start + 1 for _, start, end in spans), track=track)
+
+    # Loci of one cluster go to the same shard, so shared positions are still read once
+    if args.shard:
+        shard_keys = [spans[cluster][0] if args.shard_by == "chrom" else "{}:{}-{}".format(*spans[cluster])
+                      for cluster in cluster_of.tolist()]
+        in_shard = [shard_of(key, args.shard[1]) == args.shard[0] for key in shard_keys]
+    else:
+        in_shard = [True] * len(loci)
+    shard_units = []
+
+    # Step 3: Write the score of each position of each locus, in the order of the input file
+    with open(temp_output_file, 'w', newline='') as outfile:
+        writer = csv.writer(outfile)
+
+        # Write the CSV header
+        writer.writerow(['Gene', 'Chromosome', 'Position', 'Score'])
+
+        for locus_number, ((current_gene, chrom, start, end), cluster) in enumerate(zip(loci, cluster_of.tolist())):
+            if not in_shard[locus_number]:
+                continue
+            if cluster not in cluster_scores:
+                span_chrom, span_start, span_end = spans[cluster]
+                cluster_scores[cluster] = read_position_scores(bw, span_chrom, span_start, span_end)
+            scores = cluster_scores[cluster]
+
+            # Get individual scores for each position in the range
+            count("loci.processed")
+            rows_written = 0
+            for i in range(start, end + 1):
+                score = scores[i]
+                if isinstance(score, str):
+                    count("positions.skipped", reason=score)
+                    continue
+                writer.writerow([current_gene, chrom, i, score])
+                rows_written += 1
+            count("rows.written", rows_written, output="conservation")
+            shard_units.append((locus_number, rows_written))
+
+            remaining[cluster] -= 1
+            if remaining[cluster] == 0:
+                del cluster_scores[cluster]
         
     # Rename the temporary output file to the final output file after successful completion
     os.rename(temp_output_file, output_file)
+    if args.shard:
+        write_manifest(serial_output_file, args.shard, f"fetch_conservation_data:{track}", args.shard_by,
+                       [input_file], len(loci), shard_units)
     print(f"Data successfully saved to {output_file}")
 
 except Exception as e:
-    print(f"An unexpected error occurred: {e}")
+    log_event("unexpected_error", logging.ERROR, error=str(e))
     if os.path.exists(temp_output_file):
         os.remove(temp_output_file)
+    sys.exit(1)
 finally:
     # Close the bigWig file if it was successfully opened
     if 'bw' in locals() and not bw.close:
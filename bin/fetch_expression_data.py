@@ -1,10 +1,18 @@
 import os
-import pyBigWig
+import sys
+import argparse
+import logging
 import csv
 import re
+from instrumentation import start_run, count, log_event
+import bigwig_cache
+from remote_bigwig import is_remote, open_track
+from sharding import add_shard_arguments, shard_of, shard_path, write_manifest
 
 # Script to fetch expression data for specified genes from RNAseq data
-# Need to download all data files and place in a directory named 'GTEX-RNAseq' in the 'data' folder
+# Need to download all data files and place in a directory named 'GTEX-RNAseq' in the 'data' folder, or read them
+# by URL with --track-url (HTTP range requests through the block cache of remote_bigwig.py, nothing is downloaded
+# beyond the blocks of the loci)
 # RNAseq data files are in BigWig format and contain expression values for different tissues
 # Gene data file should be in the 'data' folder and contain gene names and genomic locations
 
@@ -66,12 +74,29 @@ rna_seq_files = [
     "data/GTEX-RNAseq/GTEX-ZVT2-0326-SM-5E44G.Ovary.RNAseq.bw"
 ]
 
-gene_group = "RN7SK" #Update on the gene group you're working on
+# The gene group and output file can be passed on the command line (used by pipeline.py)
+parser = argparse.ArgumentParser(description="Fetch maximum GTEx RNA-seq expression for a gene group.")
+parser.add_argument("--group", default="RN7SK", help="Gene group to process (default: RN7SK).")
+parser.add_argument("--output", help="Output CSV file (default: data/<group>_expr.csv).")
+parser.add_argument("--track-url", help="Read the BigWig files from this base URL (<url>/<file name>) with HTTP range "
+                                        "requests instead of data/GTEX-RNAseq/.")
+parser.add_argument("--skip-missing-tracks", action="store_true",
+                    help="Leave tracks that do not exist out of the maximum instead of failing (for partial track "
+                         "sets, e.g. the synthetic ones of benchmarks.py). Tracks that exist but cannot be read "
+                         "still fail the run.")
+add_shard_arguments(parser)
+args = parser.parse_args()
+start_run("fetch_expression_data")
+
+gene_group = args.group #Update on the gene group you're working on
 
 #Alter these file paths for each specified gene groups
 # Path to input gene file and output CSV file
 gene_file_path = f"data/{gene_group}_data.txt"
-output_csv = f"data/{gene_group}_expr.csv"
+output_csv = args.output or f"data/{gene_group}_expr.csv"
+serial_output_csv = output_csv
+if args.shard:
+    output_csv = shard_path(output_csv, args.shard)
 
 # Regular expressions for extracting gene name and genomic location
 gene_pattern = re.compile(r"Processing (.+?) with Transcript ID")
@@ -88,14 +113,16 @@ try:
             # Extract gene name
             gene_match = gene_pattern.search(section)
             if not gene_match:
-                print(f"Warning: No gene found in section:\n{section}\n")
+                count("loci.skipped", reason="no_gene_symbol")
+                log_event("locus_skipped", logging.DEBUG, reason="no_gene_symbol", segment=section.strip()[:200])
                 continue
             gene_name = gene_match.group(1)
             
             # Extract chromosome, start, and end positions
             location_match = location_pattern.search(section)
             if not location_match:
-                print(f"Warning: No location found for gene {gene_name} in section:\n{section}\n")
+                count("loci.skipped", reason="no_location")
+                log_event("locus_skipped", logging.INFO, reason="no_location", gene=gene_name)
                 continue
             chromosome = location_match.group(1)
             start = int(location_match.group(2).replace(",", ""))  # Remove commas and convert to int
@@ -110,21 +137,42 @@ try:
             # Append parsed gene details to the genes list
             genes.append({"name": gene_name, "chromosome": chromosome, "start": start, "end": end})
 except FileNotFoundError:
-    print(f"Gene file not found: {gene_file_path}")
+    log_event("gene_file_not_found", logging.ERROR, path=gene_file_path)
 except Exception as e:
-    print(f"Error reading gene file: {e}")
+    log_event("gene_file_error", logging.ERROR, path=gene_file_path, error=str(e))
 
 # Initialize dictionary to store max expression values for each gene
 gene_max_info = {gene["name"]: {"max_value": float('-inf'), "location": None} for gene in genes}
 
+# In shard mode only the genes of this shard are processed (all loci of a gene, keyed by the gene or the chromosome of
+# its first locus), in the serial order of gene_max_info
+gene_numbers = {name: number for number, name in enumerate(gene_max_info)}
+if args.shard:
+    first_chromosome = {}
+    for gene in genes:
+        first_chromosome.setdefault(gene["name"], gene["chromosome"])
+    shard_genes = {name for name in gene_max_info
+                   if shard_of(first_chromosome[name] if args.shard_by == "chrom" else name, args.shard[1])
+                   == args.shard[0]}
+    genes = [gene for gene in genes if gene["name"] in shard_genes]
+    gene_max_info = {name: info for name, info in gene_max_info.items() if name in shard_genes}
+
 # Step 2: Process each RNAseq file to find max expression for each gene
+# Loci are read in genome order, so remote tracks are read forward and benefit from the prefetched blocks (the
+# maximum of a gene does not depend on the order)
+genes_in_genome_order = sorted(genes, key=lambda gene: (gene["chromosome"], gene["start"]))
+unreadable_tracks = []
 for file_path in rna_seq_files:
+    if args.track_url:
+        file_path = f"{args.track_url.rstrip('/')}/{os.path.basename(file_path)}"
+    # Extract tissue/body location from the filename (e.g., "Esophagus_Muscularis")
+    tissue = os.path.basename(file_path).split('.')[1]
     try:
-        with pyBigWig.open(file_path) as bw:
-            # Extract tissue/body location from the filename (e.g., "Esophagus_Muscularis")
-            body_location = os.path.basename(file_path).split('.')[1].replace('_', ' ')
+        with open_track(file_path) as bw:
+            body_location = tissue.replace('_', ' ')
+            fingerprint = bw.fingerprint if is_remote(file_path) else bigwig_cache.track_fingerprint(file_path)
             chrom_sizes = bw.chroms()
-            for gene in genes:
+            for gene in genes_in_genome_order:
                 chrom = gene["chromosome"]
                 start = gene["start"]
                 end = gene["end"]
@@ -132,7 +180,9 @@ for file_path in rna_seq_files:
 
                 # Validate bounds
                 if chrom not in chrom_sizes or start < 0 or end > chrom_sizes[chrom]:
-                    print(f"Skipping invalid interval {chrom}:{start}-{end} for gene {gene['name']} in {file_path}")
+                    count("loci.skipped", reason="invalid_interval")
+                    log_event("locus_skipped", logging.DEBUG, reason="invalid_interval", gene=gene["name"],
+                              interval=f"{chrom}:{start}-{end}", track=tissue)
                     # if_yes = input("Do you want to continue? (y/n): ")
                     # if if_yes == 'n':
                     #     exit()
@@ -140,11 +190,14 @@ for file_path in rna_seq_files:
                     #     continue
                     continue
                 
-                # Fetch expression values in the specified genomic range
+                # Fetch expression values in the specified genomic range (from the interval cache when an
+                # earlier run read them from the same track)
                 try:
-                    values = bw.values(chrom, start, end)
+                    values = bigwig_cache.values(bw, fingerprint, chrom, start, end, track=tissue).tolist()
                 except RuntimeError as e:
-                    print(f"No data available for {chrom}:{start}-{end} in {file_path}: {e}")
+                    count("loci.skipped", reason="no_data")
+                    log_event("locus_skipped", logging.DEBUG, reason="no_data", gene=gene["name"],
+                              interval=f"{chrom}:{start}-{end}", track=tissue, error=str(e))
                     continue
                 
                 valid_values = [value for value in values if value is not None]
@@ -157,11 +210,24 @@ for file_path in rna_seq_files:
                         gene_max_info[gene["name"]]["location"] = body_location
                               
     except FileNotFoundError:
-        print(f"File not found: {file_path}")
+        count("bigwig.files_skipped", reason="not_found")
+        log_event("bigwig_not_found", logging.WARNING, path=file_path)
+        if not args.skip_missing_tracks:
+            unreadable_tracks.append(tissue)
     except RuntimeError as e:
-        print(f"Error processing {file_path}: {e}")
+        count("bigwig.files_skipped", reason="bigwig_error")
+        log_event("bigwig_error", logging.WARNING, path=file_path, error=str(e))
+        unreadable_tracks.append(tissue)
     except Exception as e:
-        print(f"Error processing {file_path}: {e}")
+        count("bigwig.files_skipped", reason="error")
+        log_event("bigwig_error", logging.WARNING, path=file_path, error=str(e))
+        unreadable_tracks.append(tissue)
+
+# The maximum is taken over every tissue, so a table missing some of them would be wrong without looking wrong:
+# nothing is written (and the previous output is kept) unless every listed track was read
+if unreadable_tracks:
+    sys.exit(f"Error: {len(unreadable_tracks)} of {len(rna_seq_files)} GTEx tracks could not be read "
+             f"({', '.join(unreadable_tracks)}); {output_csv} was not written.")
 
 # Step 3: Write results to CSV
 try:
@@ -171,6 +237,10 @@ try:
         
         for gene, info in gene_max_info.items():
             csv_writer.writerow([gene, info["max_value"], info["location"]])
+            count("rows.written", output="gtex_expression")
+    if args.shard:
+        write_manifest(serial_output_csv, args.shard, "fetch_expression_data", args.shard_by, [gene_file_path],
+                       len(gene_numbers), [(gene_numbers[gene], 1) for gene in gene_max_info])
     print(f"Results written to {output_csv}")
 except IOError as e:
-    print(f"Error writing to CSV file {output_csv}: {e}")
\ No newline at end of file
+    log_event("write_error", logging.ERROR, path=output_csv, error=str(e))
\ No newline at end of file
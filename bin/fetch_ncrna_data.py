@@ -1,12 +1,28 @@
-import requests
-import biomart
+import os
+import sys
 import time
+import argparse
+import logging
+from xml.etree.ElementTree import Element, SubElement, tostring
+import requests
+import http_client
+from http_client import TransientError
+from instrumentation import start_run, count, timer, log_event
 
 gene_group = 'TRNA'
 
+# Service base URLs (can be pointed at a local mock server, e.g. by benchmarks.py)
+hgnc_rest_url = os.environ.get('NCRNA_HGNC_URL', 'https://rest.genenames.org')
+ensembl_rest_url = os.environ.get('NCRNA_ENSEMBL_REST_URL', 'https://rest.ensembl.org')
+biomart_url = os.environ.get('NCRNA_BIOMART_URL', 'http://www.ensembl.org/biomart')
+
+# Passes over the genes whose lookups failed with a transient error (after the retries of http_client.py)
+deferred_passes = int(os.environ.get('NCRNA_DEFERRED_PASSES', '2'))
+
 # Function to search HGNC database for gene symbols starting with a query term.
 # This function performs an HTTP request to the HGNC database and retrieves gene symbols
 # that start with the query term.
+# Raises TransientError if HGNC cannot be reached, since no gene list can be built without it.
 def search_hgnc_genes(query):
     # Check if query is valid (non-empty string)
     if not query or not isinstance(query, str):
@@ -14,20 +30,17 @@ def search_hgnc_genes(query):
         return []  # Return an empty list if the query is invalid
 
     # URL for HGNC REST API search with a wildcard on gene symbol that is APPROVED
-    url = f'https://rest.genenames.org/search/*{query}*+AND+status:%22Approved%22'
+    url = f'{hgnc_rest_url}/search/*{query}*+AND+status:%22Approved%22'
     headers = {'Accept': 'application/json'}  # Set Accept header for JSON response
 
     try:
-        # Send GET request to the HGNC API with a timeout to avoid hanging requests
-        response = requests.get(url, headers=headers, timeout=10)
+        # Send GET request to the HGNC API (retried on timeouts, connection errors, 429 and 5xx)
+        response = http_client.get(url, endpoint="hgnc_search", headers=headers)
         # Raise an exception if the response status is not 200 OK
         response.raise_for_status()
-    except requests.exceptions.Timeout:
-        print(f"Request timed out while searching HGNC for {query}.")
-        return []  # Return empty list on timeout
     except requests.exceptions.RequestException as e:
-        print(f"Request error while searching HGNC for {query}: {e}")
-        return []  # Return empty list on request error
+        log_event("request_error", logging.WARNING, endpoint="hgnc_search", query=query, error=str(e))
+        return []  # Return empty list if HGNC rejects the query
 
     try:
         # Parse JSON response
@@ -42,28 +55,37 @@ def search_hgnc_genes(query):
             return []  # Return empty list if no genes found
     except (ValueError, KeyError) as e:
         # Handle cases where JSON parsing fails or the expected keys are missing
-        print(f"Error parsing response from HGNC for {query}: {e}")
+        count("http.errors", endpoint="hgnc_search", reason="bad_response")
+        log_event("response_parse_error", logging.WARNING, endpoint="hgnc_search", query=query, error=str(e))
         return []  # Return empty list on error
 
 
+# Function to build the BioMart XML query for the transcript IDs of a gene symbol
+# Same query as biomart.BiomartDataset.search() builds, sent directly so it goes through the shared client
+# (the biomart package also fetches the registry, dataset list, filters and attributes before every search)
+def biomart_transcript_query(gene_symbol):
+    query = Element('Query', virtualSchemaName='default', formatter='TSV', header='0', uniqueRows='1',
+                    datasetConfigVersion='0.6')
+    dataset = SubElement(query, 'Dataset', name='hsapiens_gene_ensembl', interface='default')
+    SubElement(dataset, 'Filter', name='hgnc_symbol', value=gene_symbol)
+    for attribute in ['ensembl_transcript_id', 'external_gene_name']:  # Attributes to fetch (transcript ID)
+        SubElement(dataset, 'Attribute', name=attribute)
+    return tostring(query, encoding='unicode')
+
+
 # Function to get Ensembl transcript IDs for a given gene symbol.
 # This function queries the Ensembl BioMart service to fetch transcript IDs
 # associated with a particular gene symbol.
+# Raises TransientError if BioMart cannot be reached, so the gene can be retried later in the run.
 def fetch_ensembl_transcript_ids(gene_symbol):
-    # Initialize connection to Ensembl BioMart server
-    server = biomart.BiomartServer('http://www.ensembl.org/biomart')
-    dataset = server.datasets['hsapiens_gene_ensembl']  # Dataset for human genes
-    attributes = ['ensembl_transcript_id', 'external_gene_name']  # Attributes to fetch (transcript ID)
-
     try:
-        # Query Ensembl BioMart for the specified gene symbol
-        response = dataset.search({
-            'attributes': attributes,
-            'filters': {'hgnc_symbol': gene_symbol}
-        })
-    except Exception as e:
-        # Handle any errors when querying Ensembl (e.g., network issues or invalid query)
-        print(f"Error fetching data from Ensembl for {gene_symbol}: {e}")
+        # Query Ensembl BioMart (human genes dataset) for the specified gene symbol
+        response = http_client.get(f"{biomart_url}/martservice", endpoint="ensembl_biomart",
+                                   params={'query': biomart_transcript_query(gene_symbol)})
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        # Handle a query rejected by Ensembl (e.g. an invalid query)
+        log_event("request_error", logging.WARNING, endpoint="ensembl_biomart", gene=gene_symbol, error=str(e))
         return []  # Return an empty list if error occurs
 
     transcript_ids = []  # List to store the transcript IDs
@@ -77,7 +99,8 @@ def fetch_ensembl_transcript_ids(gene_symbol):
                 transcript_ids.append(ensembl_transcript_id)  # Append transcript ID to list
     except (AttributeError, ValueError) as e:
         # Handle errors when processing the response (e.g., malformed data)
-        print(f"Error processing response for {gene_symbol}: {e}")
+        count("http.errors", endpoint="ensembl_biomart", reason="bad_response")
+        log_event("response_parse_error", logging.WARNING, endpoint="ensembl_biomart", gene=gene_symbol, error=str(e))
     
     return transcript_ids  # Return the list of transcript IDs
 
@@ -85,23 +108,21 @@ def fetch_ensembl_transcript_ids(gene_symbol):
 # Function to get genomic coordinates from Ensembl REST API for a given transcript ID.
 # This function queries Ensembl's REST API to get the genomic location (chromosome, start, end)
 # for a given transcript ID.
+# Returns None if Ensembl has no location for the transcript and raises TransientError if Ensembl
+# cannot be reached, so the two are not confused.
 def fetch_ensembl_genome_location(transcript_id):
     # URL for Ensembl's REST API to get genomic data for a transcript ID
-    url = f"https://rest.ensembl.org/lookup/id/{transcript_id}?expand=1"
+    url = f"{ensembl_rest_url}/lookup/id/{transcript_id}?expand=1"
     headers = {'Content-Type': 'application/json'}  # Set Content-Type header for JSON response
 
     try:
         # Send GET request to Ensembl API to get genomic location data
-        response = requests.get(url, headers=headers, timeout=10)
-        # Raise an exception if the response status is not 200 OK
+        response = http_client.get(url, endpoint="ensembl_lookup", headers=headers)
+        # Raise an exception if the response status is not 200 OK (e.g. 400 for an unknown ID)
         response.raise_for_status()
-    except requests.exceptions.Timeout:
-        print(f"Request timed out while fetching location for transcript {transcript_id}.")
-        return None  # Return None if request times out
     except requests.exceptions.RequestException as e:
-        # Catch all request exceptions (e.g., network errors, invalid status codes)
-        print(f"Request error fetching location for transcript {transcript_id}: {e}")
-        return None  # Return None if there is any error
+        log_event("request_error", logging.WARNING, endpoint="ensembl_lookup", transcript=transcript_id, error=str(e))
+        return None  # Return None if Ensembl rejects the lookup
 
     try:
         # Parse JSON response from Ensembl API
@@ -113,10 +134,12 @@ def fetch_ensembl_genome_location(transcript_id):
             end = data['end']
             return chrom, start, end  # Return chromosome, start, and end positions
         else:
-            print(f"No genomic location found for Transcript ID {transcript_id}")
+            log_event("no_location", logging.INFO, endpoint="ensembl_lookup", transcript=transcript_id)
     except (ValueError, KeyError) as e:
         # Handle cases where the response format is incorrect or missing expected fields
-        print(f"Error parsing location data for Transcript ID {transcript_id}: {e}")
+        count("http.errors", endpoint="ensembl_lookup", reason="bad_response")
+        log_event("response_parse_error", logging.WARNING, endpoint="ensembl_lookup", transcript=transcript_id,
+                  error=str(e))
     
     return None  # Return None if no genomic location is found or there is an error
 
@@ -129,20 +152,77 @@ def generate_ucsc_link(chrom, start, end):
     return f"https://genome.ucsc.edu/cgi-bin/hgTracks?db=hg38&position={chrom}%3A{start}-{end}"
 
 
+# Function to look up the locus blocks of one gene symbol, as the lines written to the output file.
+# Returns the lines and the outcome of each transcript ("written" or "no_location"); raises TransientError
+# if a request still fails after its retries, so the whole gene can be looked up again later in the run.
+def gene_locus_lines(gene_symbol):
+    # Fetch Ensembl transcript IDs for the gene symbol
+    transcript_ids = fetch_ensembl_transcript_ids(gene_symbol)
+    if not transcript_ids:
+        return [f"No Ensembl Transcript IDs found for {gene_symbol}"], ["no_transcript_ids"]
+
+    lines, outcomes = [], []
+    # Loop through each transcript ID to fetch genomic location
+    for transcript_id in transcript_ids:
+        lines.append(f"Processing {gene_symbol} with Transcript ID: {transcript_id}")
+
+        # Fetch genomic coordinates for the transcript
+        location_data = fetch_ensembl_genome_location(transcript_id)
+
+        # If location data is found, generate the UCSC link
+        if location_data:
+            chrom, start, end = location_data
+            formatted_start = '{:,}'.format(start)  # Format start coordinate
+            formatted_end = '{:,}'.format(end)  # Format end coordinate
+            location_str = f"Genomic Sequence ({chrom}:{formatted_start}-{formatted_end})"
+
+            # Generate the UCSC link for the location
+            ucsc_link = generate_ucsc_link(chrom, start, end)
+
+            # Gene information and UCSC link
+            lines.append(f"{gene_symbol} ({transcript_id}): {location_str}")
+            lines.append(f"UCSC Genome Browser link: {ucsc_link}")
+            outcomes.append("written")
+        else:
+            lines.append(f"No location found for {gene_symbol} ({transcript_id})")
+            outcomes.append("no_location")
+
+        # Sleep briefly to respect Ensembl's API rate limiting
+        with timer("sleep", reason="rate_limit"):
+            time.sleep(1/10)
+        lines.append("------")
+    return lines, outcomes
+
+
+# Function to print a gene's lines and write them to the output file
+def write_gene_lines(file, lines, outcomes):
+    for line in lines:
+        print(line)
+        file.write(line + '\n')
+    for outcome in outcomes:
+        if outcome == "written":
+            count("loci.written")
+        else:
+            count("loci.skipped", reason=outcome)
+
+
 # Main function to get gene locations based on a query.
 # This function integrates all the above functions to search for genes, fetch transcript IDs,
 # and fetch genomic locations for each transcript.
 # Modified Main function to get gene locations based on a query and write to file
 # Modified Main function to get gene locations based on a query or a list of gene symbols
+# Genes whose lookups fail with a transient error (service down, rate limited past the retries) are looked up
+# again at the end of the run, after the circuit breakers have cooled down. Genes that still fail are written as
+# "Lookup failed for ..." blocks, not as "No location found", and returned so they can be rerun.
 def get_gene_locations(query=None, gene_symbols=None, output_file='data/output.txt'):
     # Validate input query or gene_symbols list
     if query and gene_symbols:
         print("Error: Please provide either a query or a list of gene symbols, not both.")
-        return
+        return []
     
     if not query and not gene_symbols:
         print("Error: Please provide either a query or a list of gene symbols.")
-        return
+        return []
 
     # If gene symbols are provided directly, use them
     if gene_symbols:
@@ -151,74 +231,77 @@ def get_gene_locations(query=None, gene_symbols=None, output_file='data/output.t
         # Otherwise, fetch gene symbols from HGNC based on the query
         gene_symbols_to_process = search_hgnc_genes(query)
         if not gene_symbols_to_process:
-            return  # Exit if no gene symbols were found
+            return []  # Exit if no gene symbols were found
 
     # Open the output file in write mode
     with open(output_file, 'w') as file:
-        #count = 0  # To control which genes to process
-        
+        deferred = {}  # Gene symbols whose lookup failed with a transient error, and the error
+
         # Loop through each gene symbol to process
         for gene_symbol in gene_symbols_to_process:
-            # count += 1
-            
-            # # Skip genes before a specific count (if required)
-            # if count < 116:
-            #     continue
-            
             # #Extract the numeric part of the gene symbol for additional filtering
             # substr_gene_symbol = gene_symbol[5:-1]
                     
             # #Skip symbols with no numeric part or if the numeric part is less than the specified amount
             # if substr_gene_symbol == "" or int(substr_gene_symbol) < 5:
             #     continue
-        
-            # Fetch Ensembl transcript IDs for the gene symbol
-            transcript_ids = fetch_ensembl_transcript_ids(gene_symbol)
-            if not transcript_ids:
-                print(f"No Ensembl Transcript IDs found for {gene_symbol}")
-                file.write(f"No Ensembl Transcript IDs found for {gene_symbol}\n")
-                continue  # Skip if no transcript IDs found
-
-            # Loop through each transcript ID to fetch genomic location
-            for transcript_id in transcript_ids:
-                msg = f"Processing {gene_symbol} with Transcript ID: {transcript_id}"
-                print(msg)
-                file.write(msg + '\n')
-
-                # Fetch genomic coordinates for the transcript
-                location_data = fetch_ensembl_genome_location(transcript_id)
-                
-                # If location data is found, generate and print the UCSC link
-                if location_data:
-                    chrom, start, end = location_data
-                    formatted_start = '{:,}'.format(start)  # Format start coordinate
-                    formatted_end = '{:,}'.format(end)  # Format end coordinate
-                    location_str = f"Genomic Sequence ({chrom}:{formatted_start}-{formatted_end})"
-                    
-                    # Generate the UCSC link for the location
-                    ucsc_link = generate_ucsc_link(chrom, start, end)
-                    
-                    # Print and write the gene information and UCSC link
-                    output_str = f"{gene_symbol} ({transcript_id}): {location_str}"
-                    link_str = f"UCSC Genome Browser link: {ucsc_link}"
-                    print(output_str)
-                    print(link_str)
-                    file.write(output_str + '\n')
-                    file.write(link_str + '\n')
-                else:
-                    no_loc_msg = f"No location found for {gene_symbol} ({transcript_id})"
-                    print(no_loc_msg)
-                    file.write(no_loc_msg + '\n')
-                
-                # Sleep briefly to respect Ensembl's API rate limiting
-                time.sleep(1/10)
-                print("------")
-                file.write("------\n")
-
-# Example usage
-# If you have a list of gene symbols to look up:
-gene_symbols_list = ['MT-TA', 'MT-TC', 'MT-TD', 'MT-TE', 'MT-TF', 'MT-TG', 'MT-TH', 'MT-TI', 'MT-TK', 'MT-TL1', 'MT-TL2', 'MT-TM', 'MT-TN', 'MT-TP', 'MT-TQ', 'MT-TS1', 'MT-TS2', 'MT-TT', 'MT-TV', 'MT-TW', 'MT-TY', 'NMTRL-TAA1-1', 'NMTRL-TAA4-1', 'NMTRQ-TTG3-1', 'NMTRQ-TTG5-1', 'NMTRQ-TTG14-1', 'NMTRS-TGA1-1', 'TRA-AGC9-2', 'TRA-AGC12-2', 'TRA-AGC13-1', 'TRA-AGC13-3', 'TRA-AGC16-1', 'TRA-AGC17-1', 'TRA-AGC18-1', 'TRA-AGC18-2', 'TRA-AGC19-1', 'TRA-AGC20-1', 'TRA-AGC21-1', 'TRA-AGC22-1', 'TRA-TGC8-1', 'TRC-GCA24-1', 'TRD-GTC4-1', 'TRD-GTC5-1', 'TRD-GTC6-1', 'TRD-GTC7-1', 'TRD-GTC8-1', 'TRD-GTC9-1', 'TRE-CTC3-1', 'TRE-CTC5-1', 'TRE-CTC6-1', 'TRE-CTC8-1', 'TRE-CTC17-1', 'TRE-TTC5-1', 'TRE-TTC8-2', 'TRE-TTC16-1', 'TRG-GCC5-1', 'TRG-GCC6-1', 'TRH-GTG2-1', 'TRH-GTG3-1', 'TRK-CTT10-1', 'TRK-CTT11-1', 'TRK-TTT11-1', 'TRK-TTT16-1', 'TRL-AAG5-1', 'TRL-AAG8-1', 'TRL-CAG3-1', 'TRN-ATT1-1', 'TRN-ATT1-2', 'TRN-GTT3-2', 'TRN-GTT11-1', 'TRN-GTT11-2', 'TRN-GTT12-1', 'TRN-GTT13-1', 'TRN-GTT14-1', 'TRN-GTT15-1', 'TRN-GTT15-2', 'TRN-GTT16-1', 'TRN-GTT16-2', 'TRN-GTT16-3', 'TRN-GTT16-4', 'TRN-GTT17-1', 'TRN-GTT18-1', 'TRN-GTT19-1', 'TRN-GTT19-2', 'TRN-GTT20-1', 'TRP-AGG3-1', 'TRQ-CTG8-1', 'TRQ-CTG8-2', 'TRQ-CTG8-3', 'TRQ-CTG10-1', 'TRQ-CTG12-1', 'TRQ-CTG14-1', 'TRQ-CTG15-1', 'TRQ-CTG18-1', 'TRR-CCT5-1', 'TRR-TCG6-1', 'TRS-AGA6-1', 'TRSUP-CTA1-1', 'TRSUP-TTA1-1', 'TRSUP-TTA2-1', 'TRT-AGT7-1', 'TRT-CGT6-1', 'TRU-TCA3-1', 'TRV-AAC7-1', 'TRV-CAC7-1', 'TRV-CAC9-1', 'TRV-CAC10-1', 'TRV-CAC12-1', 'TRW-CCA6-1', 'TRX-CAT2-1', 'TRY-GTA9-1', 'TRY-GTA10-1', 'TRE-TTC8-1', 'TRE-TTC11-1', 'TRE-TTC12-1', 'TRE-TTC13-1', 'TRF-GAA7-1', 'TRG-CCC8-1', 'TRK-CTT15-1', 'TRK-TTT12-1', 'TRL-AAG6-1', 'TRMT10BP1', 'TRMT112P8', 'TRN-GTT16-5', 'TRN-GTT21-1', 'TRQ-CTG17-1', 'TRR-CCT6-1', 'TRX-CAT3-1']
-get_gene_locations(gene_symbols=gene_symbols_list, output_file=f'data/{gene_group}_partial_data.txt')
-
-# If you want to use a query to search HGNC:
-# get_gene_locations(query=gene_group, output_file=f'data/{gene_group}_data.txt')
+            try:
+                write_gene_lines(file, *gene_locus_lines(gene_symbol))
+            except TransientError as e:
+                deferred[gene_symbol] = str(e)
+                log_event("gene_deferred", logging.WARNING, gene=gene_symbol, error=str(e))
+
+        # Look the deferred genes up again once the open circuits let requests through
+        for deferred_pass in range(1, deferred_passes + 1):
+            if not deferred:
+                break
+            wait = http_client.cooldown_remaining()
+            print(f"Retrying {len(deferred)} genes with transient errors (pass {deferred_pass}) in {wait:.0f}s")
+            with timer("sleep", reason="circuit_cooldown"):
+                time.sleep(wait)
+            for gene_symbol in list(deferred):
+                try:
+                    write_gene_lines(file, *gene_locus_lines(gene_symbol))
+                    del deferred[gene_symbol]
+                    count("genes.recovered")
+                except TransientError as e:
+                    deferred[gene_symbol] = str(e)
+
+        # Genes that still fail are kept apart from the genes with no location
+        for gene_symbol, error in deferred.items():
+            count("loci.skipped", reason="transient_error")
+            write_gene_lines(file, [f"Lookup failed for {gene_symbol}: {error}", "------"], [])
+
+    if deferred:
+        print(f"Lookup failed for {len(deferred)} genes with transient errors, rerun them with --genes: "
+              f"{' '.join(deferred)}")
+    return list(deferred)
+
+# Main Execution
+if __name__ == "__main__":
+    # A gene group query can be passed on the command line (used by pipeline.py)
+    parser = argparse.ArgumentParser(description="Map HGNC gene symbols to Ensembl transcript locations.")
+    parser.add_argument("--query", help="Search HGNC for gene symbols starting with this query, e.g. RNU6.")
+    parser.add_argument("--genes", nargs="+", help="Gene symbols to look up instead of a query.")
+    parser.add_argument("--output", help="Output file (default: data/<query>_data.txt).")
+    args = parser.parse_args()
+    start_run("fetch_ncrna_data")
+
+    try:
+        if args.query:
+            # If you want to use a query to search HGNC:
+            failed = get_gene_locations(query=args.query, output_file=args.output or f'data/{args.query}_data.txt')
+        elif args.genes:
+            # Gene symbols listed on the command line, e.g. the genes of an earlier run that failed
+            failed = get_gene_locations(gene_symbols=args.genes, output_file=args.output or 'data/output.txt')
+        else:
+            # Example usage
+            # If you have a list of gene symbols to look up:
+            gene_symbols_list = ['MT-TA', 'MT-TC', 'MT-TD', 'MT-TE', 'MT-TF', 'MT-TG', 'MT-TH', 'MT-TI', 'MT-TK', 'MT-TL1', 'MT-TL2', 'MT-TM', 'MT-TN', 'MT-TP', 'MT-TQ', 'MT-TS1', 'MT-TS2', 'MT-TT', 'MT-TV', 'MT-TW', 'MT-TY', 'NMTRL-TAA1-1', 'NMTRL-TAA4-1', 'NMTRQ-TTG3-1', 'NMTRQ-TTG5-1', 'NMTRQ-TTG14-1', 'NMTRS-TGA1-1', 'TRA-AGC9-2', 'TRA-AGC12-2', 'TRA-AGC13-1', 'TRA-AGC13-3', 'TRA-AGC16-1', 'TRA-AGC17-1', 'TRA-AGC18-1', 'TRA-AGC18-2', 'TRA-AGC19-1', 'TRA-AGC20-1', 'TRA-AGC21-1', 'TRA-AGC22-1', 'TRA-TGC8-1', 'TRC-GCA24-1', 'TRD-GTC4-1', 'TRD-GTC5-1', 'TRD-GTC6-1', 'TRD-GTC7-1', 'TRD-GTC8-1', 'TRD-GTC9-1', 'TRE-CTC3-1', 'TRE-CTC5-1', 'TRE-CTC6-1', 'TRE-CTC8-1', 'TRE-CTC17-1', 'TRE-TTC5-1', 'TRE-TTC8-2', 'TRE-TTC16-1', 'TRG-GCC5-1', 'TRG-GCC6-1', 'TRH-GTG2-1', 'TRH-GTG3-1', 'TRK-CTT10-1', 'TRK-CTT11-1', 'TRK-TTT11-1', 'TRK-TTT16-1', 'TRL-AAG5-1', 'TRL-AAG8-1', 'TRL-CAG3-1', 'TRN-ATT1-1', 'TRN-ATT1-2', 'TRN-GTT3-2', 'TRN-GTT11-1', 'TRN-GTT11-2', 'TRN-GTT12-1', 'TRN-GTT13-1', 'TRN-GTT14-1', 'TRN-GTT15-1', 'TRN-GTT15-2', 'TRN-GTT16-1', 'TRN-GTT16-2', 'TRN-GTT16-3', 'TRN-GTT16-4', 'TRN-GTT17-1', 'TRN-GTT18-1', 'TRN-GTT19-1', 'TRN-GTT19-2', 'TRN-GTT20-1', 'TRP-AGG3-1', 'TRQ-CTG8-1', 'TRQ-CTG8-2', 'TRQ-CTG8-3', 'TRQ-CTG10-1', 'TRQ-CTG12-1', 'TRQ-CTG14-1', 'TRQ-CTG15-1', 'TRQ-CTG18-1', 'TRR-CCT5-1', 'TRR-TCG6-1', 'TRS-AGA6-1', 'TRSUP-CTA1-1', 'TRSUP-TTA1-1', 'TRSUP-TTA2-1', 'TRT-AGT7-1', 'TRT-CGT6-1', 'TRU-TCA3-1', 'TRV-AAC7-1', 'TRV-CAC7-1', 'TRV-CAC9-1', 'TRV-CAC10-1', 'TRV-CAC12-1', 'TRW-CCA6-1', 'TRX-CAT2-1', 'TRY-GTA9-1', 'TRY-GTA10-1', 'TRE-TTC8-1', 'TRE-TTC11-1', 'TRE-TTC12-1', 'TRE-TTC13-1', 'TRF-GAA7-1', 'TRG-CCC8-1', 'TRK-CTT15-1', 'TRK-TTT12-1', 'TRL-AAG6-1', 'TRMT10BP1', 'TRMT112P8', 'TRN-GTT16-5', 'TRN-GTT21-1', 'TRQ-CTG17-1', 'TRR-CCT6-1', 'TRX-CAT3-1']
+            failed = get_gene_locations(gene_symbols=gene_symbols_list, output_file=f'data/{gene_group}_partial_data.txt')
+    except TransientError as e:
+        sys.exit(f"Error: {e}")
+
+    # A non-zero exit status keeps pipeline.py from recording a run with failed lookups as up to date
+    if failed:
+        sys.exit(1)
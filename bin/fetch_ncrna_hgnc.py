@@ -1,10 +1,13 @@
+import os
 import requests
+import http_client
 import pyBigWig
 import time
 
 # Define gene group and BigBed file path
 gene_group = 'RN7SK'
 bigbed_file_path = 'data/hgnc.bb'  # Specify the path to your BigBed file
+hgnc_rest_url = os.environ.get('NCRNA_HGNC_URL', 'https://rest.genenames.org')
 
 
 # Function to fetch chromosomal locations based on the provided BigBed data
@@ -96,12 +99,12 @@ def search_hgnc_genes(query):
         print("Invalid query: must be a non-empty string.")
         return []
     #AND+(locus_type:%22RNA%2C%20transfer%22+OR+locus_type:%22pseudogene%22)+
-    url = f'https://rest.genenames.org/search/*{query}*+AND+status:%22Approved%22'
+    url = f'{hgnc_rest_url}/search/*{query}*+AND+status:%22Approved%22'
     headers = {'Accept': 'application/json'}
     try:
-        response = requests.get(url, headers=headers, timeout=10)
+        response = http_client.get(url, endpoint="hgnc_search", headers=headers)
         response.raise_for_status()
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, http_client.TransientError) as e:
         print(f"Request error: {e}")
         return []
     
@@ -118,4 +121,5 @@ def search_hgnc_genes(query):
 
 
 # Call function with the gene group and output file path
-get_gene_locations(gene_group, f'data/{gene_group}_data_temp.txt', bigbed_file_path)
+if __name__ == "__main__":
+    get_gene_locations(gene_group, f'data/{gene_group}_data_temp.txt', bigbed_file_path)
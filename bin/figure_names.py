@@ -0,0 +1,9 @@
+# Output names of the random forest figures, kept apart from render_figures.py so pipeline.py can list the figures
+# a run writes without importing matplotlib
+
+# Default output names, matching the figures previously saved by hand in 'results'
+figure_names = {
+    'test_histogram': 'test_set_prediction',
+    'train_test_overlay': 'rand_forest_dist_eval',
+    'ambiguous_scatter': 'ambiguous_set_scatter',
+}
@@ -0,0 +1,353 @@
+import os
+import re
+import csv
+import sys
+import glob
+import json
+import time
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+import pyBigWig
+import requests
+import http_client
+from assemble_features import gene_groups, feature_frame
+from instrumentation import start_run, count, timer, log_event
+from sharding import parse_shard, shard_path
+
+# Genome-wide screening mode: every HGNC non-coding RNA locus and ncRNA pseudogene, not only the 15 gene groups
+# Loci are streamed from the HGNC complete set in chunks through locus resolution (batched Ensembl lookups),
+# conservation (phastCons30/phyloP100/phyloP447), GTEx and ENCODE extraction and scoring with the saved model,
+# and each chunk is written to its own CSV, so memory is bounded by the chunk size and an interrupted run can resume
+# A throughput report (loci and bases per second for each stage) is written next to the chunks
+
+hgnc_complete_set = "data/hgnc_complete_set.txt"
+hgnc_complete_set_url = "https://storage.googleapis.com/public-download-files/hgnc/tsv/tsv/hgnc_complete_set.txt"
+ensembl_rest_url = os.environ.get("NCRNA_ENSEMBL_REST_URL", "https://rest.ensembl.org")
+encode_tsv = "data/rna_expression_report_2024_11_20_22h_6m.tsv"
+gtex_dir = "data/GTEX-RNAseq"
+output_dir = "results/genome_screen"
+model_dir = "results/model"
+
+# Conservation tracks and the feature column of each (same files as fetch_conservation_data.py)
+conservation_tracks = {
+    "PhastCons30_median": "data/hg38.phastCons30way.bw",
+    "PhyloP100_median": "data/hg38.phyloP100way.bw",
+    "PhyloP447_median": "data/hg38.phyloP447way.bw",
+}
+
+# Ensembl REST accepts up to 1000 IDs per POST /lookup/id request
+lookup_batch_size = 1000
+
+# HGNC gene groups of the pseudogenes kept as ncRNA pseudogenes (pseudogenes of protein-coding genes are left out)
+ncrna_group_pattern = re.compile(r"RNA|small nuclear|small nucleolar|vault|Y RNA", re.IGNORECASE)
+
+stages = ["resolve", "conservation", "gtex", "encode", "score", "write"]
+
+chunk_columns = ["Gene", "HGNC_ID", "Ensembl_ID", "Locus_type", "Gene_family", "Gene_Type", "Chromosome", "Start",
+                 "End", "PhastCons30_median", "PhyloP100_median", "PhyloP447_median", "PhyloP100_max", "GTEX_max",
+                 "GTEX_tissue", "ENCODE_max", "ENCODE_max_TPM", "functional_probability"]
+
+
+# Function to download the HGNC complete set if it is not in the data folder yet
+def download_hgnc_complete_set(path=hgnc_complete_set, url=hgnc_complete_set_url):
+    print(f"Downloading the HGNC complete set to {path}...")
+    with timer("stage", step="download_hgnc"):
+        response = http_client.get(url, endpoint="hgnc_download", stream=True, timeout=60)
+        response.raise_for_status()
+        with open(f"{path}.tmp", "wb") as file:
+            for block in response.iter_content(chunk_size=1 << 20):
+                file.write(block)
+    os.replace(f"{path}.tmp", path)
+
+
+# Function to decide whether an HGNC record is screened, and its gene type
+# Approved non-coding RNA loci are "Functional", pseudogenes in an ncRNA gene group (or named after one of the
+# 15 ncRNA groups, e.g. RN7SKP1) are "Pseudogene"; everything else returns None
+def screened_type(record, group_prefixes):
+    if record.get("status") != "Approved":
+        return None
+    if record.get("locus_group") == "non-coding RNA":
+        return "Functional"
+    if record.get("locus_type") == "pseudogene":
+        if ncrna_group_pattern.search(record.get("gene_group", "")) or record["symbol"].startswith(group_prefixes):
+            return "Pseudogene"
+    return None
+
+
+# Function to stream the screened loci of the HGNC complete set, one dict per locus
+def iter_hgnc_loci(path, group_prefixes):
+    with open(path, newline="") as file:
+        for record in csv.DictReader(file, delimiter="\t"):
+            gene_type = screened_type(record, group_prefixes)
+            if gene_type is None:
+                continue
+            families = [family for family in record.get("gene_group", "").split("|") if family]
+            yield {"Gene": record["symbol"], "HGNC_ID": record["hgnc_id"], "Ensembl_ID": record.get("ensembl_gene_id", ""),
+                   "Locus_type": record["locus_type"], "Gene_family": families[0] if families else record["locus_type"],
+                   "Gene_Type": gene_type}
+
+
+# Function to group a stream of loci into chunks (lists of at most chunk_size loci)
+def iter_chunks(loci, chunk_size):
+    chunk = []
+    for locus in loci:
+        chunk.append(locus)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# Function to resolve the genomic location of a chunk of loci with batched Ensembl lookups
+# Locations are gene-level (the per-group mode resolves every transcript, one request each); loci without an
+# Ensembl gene ID or location are dropped and counted by reason
+def resolve_chunk(chunk):
+    resolved = []
+    with_ids = [locus for locus in chunk if locus["Ensembl_ID"]]
+    count("loci.skipped", len(chunk) - len(with_ids), reason="no_ensembl_id")
+    for start in range(0, len(with_ids), lookup_batch_size):
+        batch = with_ids[start:start + lookup_batch_size]
+        response = http_client.post(f"{ensembl_rest_url}/lookup/id", endpoint="ensembl_lookup_batch",
+                                    headers={"Content-Type": "application/json", "Accept": "application/json"},
+                                    data=json.dumps({"ids": [locus["Ensembl_ID"] for locus in batch]}), timeout=60)
+        response.raise_for_status()
+        locations = response.json()
+        for locus in batch:
+            location = locations.get(locus["Ensembl_ID"])
+            if not location or "seq_region_name" not in location:
+                count("loci.skipped", reason="no_location")
+                continue
+            chrom = location["seq_region_name"]
+            locus["Chromosome"] = "chrM" if chrom == "MT" else f"chr{chrom}"
+            locus["Start"], locus["End"] = int(location["start"]), int(location["end"])
+            resolved.append(locus)
+    return resolved
+
+
+# Function to add the median conservation of each track (and the max phyloP100) to the loci of a chunk
+# Positions start..end are read as in fetch_conservation_data.py so the features match the per-group tables
+def add_conservation(chunk, tracks):
+    bases = 0
+    for feature, bw in tracks.items():
+        chrom_sizes = bw.chroms()
+        for locus in chunk:
+            chrom, start, end = locus["Chromosome"], locus["Start"], locus["End"] + 1
+            values = None
+            if chrom in chrom_sizes and end <= chrom_sizes[chrom]:
+                try:
+                    values = bw.values(chrom, start, end, numpy=True)
+                except RuntimeError:
+                    values = None
+            if values is None or np.isnan(values).all():
+                locus[feature] = np.nan
+                continue
+            bases += len(values)
+            locus[feature] = float(np.nanmedian(values))
+            if feature == "PhyloP100_median":
+                locus["PhyloP100_max"] = float(np.nanmax(values))
+    count("bigwig.bases", bases, source="conservation")
+    return bases
+
+
+# Function to add the maximum GTEx expression over all tissues (and its tissue) to the loci of a chunk
+def add_gtex(chunk, tissues):
+    bases = 0
+    for locus in chunk:
+        locus["GTEX_max"], locus["GTEX_tissue"] = -np.inf, None
+    for tissue, bw in tissues.items():
+        chrom_sizes = bw.chroms()
+        for locus in chunk:
+            chrom, start, end = locus["Chromosome"], locus["Start"], locus["End"]
+            if chrom not in chrom_sizes or end > chrom_sizes[chrom]:
+                continue
+            try:
+                maximum = bw.stats(chrom, start, end, type="max", exact=True)[0]
+            except RuntimeError:
+                continue
+            bases += end - start
+            if maximum is not None and maximum > locus["GTEX_max"]:
+                locus["GTEX_max"], locus["GTEX_tissue"] = maximum, tissue.replace("_", " ")
+    count("bigwig.bases", bases, source="gtex")
+    return bases
+
+
+# Function to read the maximum ENCODE TPM and FPKM of the screened gene symbols in one pass over the report
+# Only the screened symbols are kept, so memory is bounded by the number of loci, not by the size of the report
+def scan_encode_report(tsv_file, gene_symbols):
+    maxima = {}
+    rows_read = 0
+    with open(tsv_file) as file:
+        next(file)  # Skip the first line of metadata
+        reader = csv.reader(file, delimiter="\t")
+        header = [field.strip() for field in next(reader)]
+        symbol_index, tpm_index, fpkm_index = header.index("Gene symbol"), header.index("TPM"), header.index("FPKM")
+        for row in reader:
+            rows_read += 1
+            symbol = row[symbol_index]
+            if symbol in gene_symbols:
+                tpm, fpkm = float(row[tpm_index]), float(row[fpkm_index])
+                previous = maxima.get(symbol)
+                maxima[symbol] = (tpm, fpkm) if previous is None else (max(previous[0], tpm), max(previous[1], fpkm))
+    count("rows.read", rows_read, input="encode_report")
+    return maxima
+
+
+# Function to add the ENCODE maxima to the loci of a chunk (ENCODE_max is the max FPKM, as in assemble_features.py)
+def add_encode(chunk, encode_maxima):
+    for locus in chunk:
+        tpm, fpkm = encode_maxima.get(locus["Gene"], (np.nan, np.nan))
+        locus["ENCODE_max_TPM"], locus["ENCODE_max"] = tpm, fpkm
+
+
+# Function to open the BigWig files that are present, keyed by feature or tissue
+def open_bigwigs(paths):
+    opened = {}
+    for key, path in paths.items():
+        if os.path.isfile(path):
+            opened[key] = pyBigWig.open(path)
+        else:
+            count("bigwig.files_skipped", reason="not_found")
+            log_event("bigwig_not_found", logging.WARNING, path=path)
+    return opened
+
+
+# Function to run one chunk through every stage and write it, returns the seconds and work done per stage
+def screen_chunk(chunk, tracks, tissues, encode_maxima, model, model_features, chunk_csv):
+    stage_time, stage_work = dict.fromkeys(stages, 0.0), dict.fromkeys(stages, 0)
+
+    def run_stage(stage, function, *arguments):
+        start = time.perf_counter()
+        with timer("stage", step=stage):
+            result = function(*arguments)
+        stage_time[stage] += time.perf_counter() - start
+        return result
+
+    loci = run_stage("resolve", resolve_chunk, chunk)
+    stage_work["resolve"] = len(chunk)
+    stage_work["conservation"] = run_stage("conservation", add_conservation, loci, tracks)
+    stage_work["gtex"] = run_stage("gtex", add_gtex, loci, tissues)
+    run_stage("encode", add_encode, loci, encode_maxima)
+    stage_work["encode"] = len(loci)
+
+    frame = pd.DataFrame(loci, columns=chunk_columns)
+    if model is not None and len(frame):
+        X = feature_frame(frame, model_features).to_numpy()
+        frame["functional_probability"] = run_stage("score", lambda: model.predict_proba(X)[:, 1])
+        stage_work["score"] = len(frame)
+
+    def write_chunk():
+        frame.to_csv(f"{chunk_csv}.tmp", index=False, na_rep="NA", float_format="%.6g")
+        os.replace(f"{chunk_csv}.tmp", chunk_csv)
+
+    run_stage("write", write_chunk)
+    stage_work["write"] = len(frame)
+    count("loci.screened", len(frame))
+    return stage_time, stage_work
+
+
+# Function to write the throughput report: loci (or bases) per second for each stage
+def write_throughput_report(stage_time, stage_work, n_loci, elapsed, report_csv):
+    units = {"conservation": "bases", "gtex": "bases"}
+    rows = [{"Stage": stage, "Seconds": round(stage_time[stage], 3), "Work": stage_work[stage],
+             "Unit": units.get(stage, "loci"),
+             "Per_second": round(stage_work[stage] / stage_time[stage], 1) if stage_time[stage] > 0 else None}
+            for stage in stages]
+    rows.append({"Stage": "total", "Seconds": round(elapsed, 3), "Work": n_loci, "Unit": "loci",
+                 "Per_second": round(n_loci / elapsed, 1) if elapsed > 0 else None})
+    report = pd.DataFrame(rows)
+    report.to_csv(report_csv, index=False)
+    print(report.to_string(index=False))
+
+
+# Main Execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Screen every HGNC ncRNA locus and ncRNA pseudogene genome-wide.")
+    parser.add_argument("--hgnc-file", default=hgnc_complete_set,
+                        help="HGNC complete set TSV (downloaded if missing, default: data/hgnc_complete_set.txt).")
+    parser.add_argument("--chunk-size", type=int, default=2000, help="Loci per chunk (default: 2000).")
+    parser.add_argument("--limit", type=int, help="Screen only the first N loci (for trial runs).")
+    parser.add_argument("--output-dir", default=output_dir, help="Directory of the chunk CSVs and the report.")
+    parser.add_argument("--model-dir", default=model_dir, help="Saved model used for scoring (skipped if absent).")
+    parser.add_argument("--shard", type=parse_shard,
+                        help="Screen only the chunks of shard i of N (i/N, from 0: chunk number modulo N). Chunks "
+                             "keep their serial names, so the shards together write the chunks of a serial run.")
+    parser.add_argument("--resume", action="store_true", help="Keep chunks already written by an earlier run (with the same --chunk-size).")
+    args = parser.parse_args()
+    start_run("genome_screen")
+
+    group_prefixes = tuple(gene_groups)
+
+    if not os.path.isfile(args.hgnc_file):
+        try:
+            download_hgnc_complete_set(args.hgnc_file)
+        except (requests.exceptions.RequestException, http_client.TransientError) as e:
+            sys.exit(f"Error: could not download the HGNC complete set: {e}")
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    # First pass: the screened gene symbols only, to bound the ENCODE scan
+    with timer("stage", step="select_loci"):
+        symbols = {locus["Gene"] for locus in iter_hgnc_loci(args.hgnc_file, group_prefixes)}
+    n_total = min(len(symbols), args.limit) if args.limit else len(symbols)
+    print(f"{len(symbols)} ncRNA loci and ncRNA pseudogenes selected from {args.hgnc_file}")
+
+    stage_time, stage_work = dict.fromkeys(stages, 0.0), dict.fromkeys(stages, 0)
+    start = time.perf_counter()
+    encode_maxima = {}
+    if os.path.isfile(encode_tsv):
+        with timer("stage", step="scan_encode_report"):
+            encode_maxima = scan_encode_report(encode_tsv, symbols)
+        stage_time["encode"] += time.perf_counter() - start
+    else:
+        log_event("encode_report_not_found", logging.WARNING, path=encode_tsv)
+    del symbols
+
+    model, model_features = None, None
+    try:
+        from model_store import load_model
+        model, metadata = load_model(args.model_dir)
+        model_features = metadata["features"]
+    except FileNotFoundError as e:
+        print(f"Scoring skipped: {e}")
+
+    tracks = open_bigwigs(conservation_tracks)
+    # Every GTEx RNA-seq track in the data folder (the files listed in fetch_expression_data.py)
+    tissues = open_bigwigs({os.path.basename(path).split(".")[1]: path
+                            for path in sorted(glob.glob(os.path.join(gtex_dir, "*.RNAseq.bw")))})
+    print(f"{len(tracks)} conservation tracks and {len(tissues)} GTEx tissues found")
+
+    loci = iter_hgnc_loci(args.hgnc_file, group_prefixes)
+    if args.limit:
+        loci = (locus for number, locus in zip(range(args.limit), loci))
+    n_screened = n_seen = 0
+    try:
+        for chunk_number, chunk in enumerate(iter_chunks(loci, args.chunk_size)):
+            n_seen += len(chunk)
+            if args.shard and chunk_number % args.shard[1] != args.shard[0]:
+                continue
+            chunk_csv = os.path.join(args.output_dir, f"screen_chunk_{chunk_number:05d}.csv")
+            if args.resume and os.path.isfile(chunk_csv):
+                count("chunks.skipped", reason="already_written")
+                continue
+            try:
+                chunk_time, chunk_work = screen_chunk(chunk, tracks, tissues, encode_maxima, model, model_features,
+                                                      chunk_csv)
+            except (requests.exceptions.RequestException, http_client.TransientError) as e:
+                sys.exit(f"Error resolving chunk {chunk_number}: {e}\nRerun with --resume to continue from this chunk.")
+            for stage in stages:
+                stage_time[stage] += chunk_time[stage]
+                stage_work[stage] += chunk_work[stage]
+            n_screened += chunk_work["write"]
+            print(f"Chunk {chunk_number}: {chunk_work['write']} of {len(chunk)} loci screened "
+                  f"({n_seen:,} of {n_total:,})")
+    finally:
+        for bw in list(tracks.values()) + list(tissues.values()):
+            bw.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"\n{n_screened} loci screened in {elapsed:.1f}s, chunks written to {args.output_dir}")
+    report_csv = os.path.join(args.output_dir, "throughput_report.csv")
+    write_throughput_report(stage_time, stage_work, n_screened, elapsed,
+                            shard_path(report_csv, args.shard) if args.shard else report_csv)
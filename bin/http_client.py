@@ -0,0 +1,187 @@
+import os
+import time
+import random
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from instrumentation import count, timer, log_event
+
+# Shared HTTP client for the annotation services (HGNC, Ensembl REST, BioMart)
+# One pooled keep-alive session, retries with exponential backoff and full jitter on timeouts, connection errors and
+# 429/5xx responses (429 and 503 wait for Retry-After when the server sends it), and a circuit breaker per host that
+# fails fast after repeated failures until a cooldown has passed
+# Requests that still fail raise TransientError, so callers can tell "try again later" apart from a genuine answer
+# (a 4xx response is returned to the caller as it is)
+# Tuned with environment variables:
+#   NCRNA_HTTP_RETRIES        retries after the first attempt (default: 5)
+#   NCRNA_HTTP_BACKOFF        base delay of the exponential backoff in seconds (default: 0.5)
+#   NCRNA_HTTP_MAX_BACKOFF    cap of one backoff or Retry-After delay in seconds (default: 30)
+#   NCRNA_BREAKER_THRESHOLD   consecutive failures that open the circuit of a host (default: 5)
+#   NCRNA_BREAKER_COOLDOWN    seconds the circuit stays open before one trial request is let through (default: 60)
+
+max_retries = int(os.environ.get("NCRNA_HTTP_RETRIES", "5"))
+backoff_base = float(os.environ.get("NCRNA_HTTP_BACKOFF", "0.5"))
+backoff_max = float(os.environ.get("NCRNA_HTTP_MAX_BACKOFF", "30"))
+breaker_threshold = int(os.environ.get("NCRNA_BREAKER_THRESHOLD", "5"))
+breaker_cooldown = float(os.environ.get("NCRNA_BREAKER_COOLDOWN", "60"))
+
+retry_statuses = {429, 500, 502, 503, 504}
+
+_session = None
+_breakers = {}
+_lock = threading.Lock()
+
+
+# Raised when a request fails in a way that may succeed later: retries exhausted or circuit open
+class TransientError(Exception):
+    pass
+
+
+# Function to get the shared session, created on first use
+def session():
+    global _session
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=8, max_retries=0)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+# Function to read the Retry-After header of a response in seconds (delta-seconds or HTTP date)
+def retry_after(response):
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# Function to compute the backoff delay of a retry: exponential with full jitter
+def backoff_delay(attempt):
+    return random.uniform(0, min(backoff_max, backoff_base * 2 ** attempt))
+
+
+# Circuit breaker of one host: closed (requests go through), open (requests fail fast) and, once the cooldown has
+# passed, half-open (one trial request goes through; success closes the circuit, failure opens it again)
+def _breaker_allows(host):
+    with _lock:
+        breaker = _breakers.setdefault(host, {"failures": 0, "opened": None, "probing": False})
+        if breaker["opened"] is None:
+            return True
+        if breaker["probing"] or time.monotonic() - breaker["opened"] < breaker_cooldown:
+            return False
+        breaker["probing"] = True
+        return True
+
+
+def _record_success(host):
+    with _lock:
+        _breakers[host] = {"failures": 0, "opened": None, "probing": False}
+
+
+# Function to let another trial request through after one that neither succeeded nor failed transiently (e.g. an
+# invalid URL), so the circuit of the host is not left open for the rest of the run
+def _release_probe(host):
+    with _lock:
+        _breakers[host]["probing"] = False
+
+
+def _record_failure(host):
+    with _lock:
+        breaker = _breakers[host]
+        breaker["failures"] += 1
+        if breaker["probing"] or (breaker["opened"] is None and breaker["failures"] >= breaker_threshold):
+            breaker["opened"], breaker["probing"] = time.monotonic(), False
+            opened = True
+        else:
+            opened = False
+    if opened:
+        count("http.circuit_opened", host=host)
+        log_event("circuit_opened", logging.WARNING, host=host, cooldown_s=breaker_cooldown)
+
+
+# Function to get the seconds until every open circuit lets a trial request through
+def cooldown_remaining():
+    with _lock:
+        opened = [breaker["opened"] for breaker in _breakers.values() if breaker["opened"] is not None]
+    if not opened:
+        return 0.0
+    return max(0.0, max(opened) + breaker_cooldown - time.monotonic())
+
+
+# Function to send a request with retries, backoff and the circuit breaker of its host
+# Returns the response for any status outside retry_statuses (the caller checks it), raises TransientError otherwise
+def request(method, url, endpoint, **kwargs):
+    kwargs.setdefault("timeout", 10)
+    host = urlsplit(url).netloc
+    error = None
+    for attempt in range(max_retries + 1):
+        if not _breaker_allows(host):
+            count("http.errors", endpoint=endpoint, reason="circuit_open")
+            raise TransientError(f"circuit open for {host} after repeated failures ({error or 'earlier requests'})")
+
+        delay = None
+        try:
+            with timer("http.request", endpoint=endpoint):
+                response = session().request(method, url, **kwargs)
+        except requests.exceptions.Timeout as e:
+            reason, error = "timeout", e
+        except requests.exceptions.ConnectionError as e:
+            reason, error = "connection_error", e
+        except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ContentDecodingError) as e:
+            # The connection broke off or garbled the body: retried like a connection error
+            reason, error = "read_error", e
+        except BaseException as e:
+            # Any other error (invalid URL, too many redirects, interrupt) is not the host's fault and is not retried
+            _release_probe(host)
+            if isinstance(e, requests.exceptions.RequestException):
+                count("http.errors", endpoint=endpoint, reason=type(e).__name__)
+            raise
+        else:
+            count("http.responses", endpoint=endpoint, status=response.status_code)
+            if response.status_code not in retry_statuses:
+                _record_success(host)
+                return response
+            reason, error = f"status_{response.status_code}", f"HTTP {response.status_code} from {host}"
+            if response.status_code in (429, 503):
+                delay = retry_after(response)
+                if delay is not None:
+                    delay = min(delay, backoff_max)
+
+        # Rate limiting means the host is up, so 429 does not count towards opening its circuit
+        if reason == "status_429":
+            _record_success(host)
+        else:
+            _record_failure(host)
+        count("http.errors", endpoint=endpoint, reason=reason)
+        if attempt == max_retries:
+            break
+        if delay is None:
+            delay = backoff_delay(attempt)
+        count("http.retries", endpoint=endpoint, reason=reason)
+        log_event("request_retry", logging.INFO, endpoint=endpoint, url=url, attempt=attempt + 1, reason=reason,
+                  delay_s=round(delay, 3))
+        with timer("sleep", reason="backoff"):
+            time.sleep(delay)
+
+    raise TransientError(f"{endpoint} request failed after {max_retries + 1} attempts: {error}")
+
+
+def get(url, endpoint, **kwargs):
+    return request("GET", url, endpoint, **kwargs)
+
+
+# POST requests are retried too: the annotation services only use POST for batched read-only lookups
+def post(url, endpoint, **kwargs):
+    return request("POST", url, endpoint, **kwargs)
@@ -0,0 +1,195 @@
+import os
+import sys
+import json
+import time
+import atexit
+import logging
+import resource
+import threading
+import cProfile
+from contextlib import contextmanager
+from collections import defaultdict
+
+# Shared instrumentation for the bin/ scripts: structured logs, counters and timers, a JSON metrics summary per run
+# and an optional profiler. Scripts call start_run() once, then count() / timer() / log_event() on their hot paths
+# Controlled with environment variables, so the module-level scripts need no extra arguments:
+#   NCRNA_METRICS_DIR       directory of the per-run metrics summaries (default: results/metrics, 'off' to disable)
+#   NCRNA_LOG_LEVEL         level of the structured log written to stderr (default: WARNING)
+#   NCRNA_LOG_FILE          also write the structured log to this file, at every level
+#   NCRNA_PROFILE           'cprofile' (writes a .prof file) or 'sample' (writes collapsed stacks for flame graphs)
+#   NCRNA_SAMPLE_INTERVAL   sampling interval of the 'sample' profiler in seconds (default: 0.005)
+
+metrics_dir = os.environ.get("NCRNA_METRICS_DIR", "results/metrics")
+
+logger = logging.getLogger("ncrna")
+
+counters = defaultdict(int)
+timers = {}
+_lock = threading.Lock()
+_run = {}
+
+
+# Function to build the key of a metric from its name and labels, e.g. http.requests[endpoint=hgnc_search]
+def metric_key(name, labels):
+    if not labels:
+        return name
+    return f"{name}[{','.join(f'{key}={value}' for key, value in sorted(labels.items()))}]"
+
+
+# Function to add to a counter
+def count(name, value=1, **labels):
+    key = metric_key(name, labels)
+    with _lock:
+        counters[key] += value
+
+
+# Function to record one timed observation (count, total and max seconds)
+def observe(name, seconds, **labels):
+    key = metric_key(name, labels)
+    with _lock:
+        entry = timers.setdefault(key, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+
+
+# Context manager to time a block of code
+@contextmanager
+def timer(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+# Formatter writing each log record as one JSON object per line
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {"time": round(record.created, 3), "level": record.levelname, "script": _run.get("script"),
+                 "event": record.getMessage()}
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry, default=str)
+
+
+# Function to write a structured log event, e.g. log_event("locus_skipped", gene=..., reason=...)
+def log_event(event, level=logging.INFO, **fields):
+    logger.log(level, event, extra={"fields": fields})
+
+
+def _configure_logging():
+    logger.handlers.clear()
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    stderr_handler = logging.StreamHandler(sys.stderr)
+    stderr_handler.setLevel(os.environ.get("NCRNA_LOG_LEVEL", "WARNING").upper())
+    stderr_handler.setFormatter(JsonFormatter())
+    logger.addHandler(stderr_handler)
+    log_file = os.environ.get("NCRNA_LOG_FILE")
+    if log_file:
+        file_handler = logging.FileHandler(log_file)
+        file_handler.setFormatter(JsonFormatter())
+        logger.addHandler(file_handler)
+
+
+# Sampling profiler: a thread that records the main thread's stack at a fixed interval
+# The result is written as collapsed stacks ("outer;inner count" per line), the input format of flame graph tools
+def _sample_stacks(main_thread_id, interval, samples, stop):
+    while not stop.wait(interval):
+        frame = sys._current_frames().get(main_thread_id)
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        if stack:
+            samples[";".join(reversed(stack))] += 1
+
+
+def _start_profiler(mode):
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        _run["profiler"] = profiler
+    elif mode == "sample":
+        samples, stop = defaultdict(int), threading.Event()
+        interval = float(os.environ.get("NCRNA_SAMPLE_INTERVAL", "0.005"))
+        thread = threading.Thread(target=_sample_stacks, args=(threading.main_thread().ident, interval, samples, stop),
+                                  daemon=True)
+        thread.start()
+        _run["sampler"] = (thread, stop, samples)
+    elif mode:
+        log_event("unknown_profiler", logging.WARNING, profile=mode)
+
+
+def _stop_profiler(output_base):
+    files = {}
+    if "profiler" in _run:
+        _run["profiler"].disable()
+        files["profile"] = f"{output_base}.prof"
+        _run["profiler"].dump_stats(files["profile"])
+    if "sampler" in _run:
+        thread, stop, samples = _run["sampler"]
+        stop.set()
+        thread.join()
+        files["profile"] = f"{output_base}.collapsed.txt"
+        with open(files["profile"], "w") as file:
+            for stack, samples_count in sorted(samples.items(), key=lambda item: -item[1]):
+                file.write(f"{stack} {samples_count}\n")
+    return files
+
+
+# Function to start instrumenting a script run
+# The metrics summary is written when the process exits, including through sys.exit()
+def start_run(script):
+    if _run:
+        return
+    _run.update({"script": script, "argv": sys.argv[1:], "started": time.strftime("%Y-%m-%d %H:%M:%S"),
+                 "start": time.perf_counter(), "cpu_start": time.process_time(), "status": "completed"})
+    _configure_logging()
+
+    previous_hook = sys.excepthook
+
+    def record_error(exc_type, exc, traceback):
+        _run["status"] = f"error: {exc_type.__name__}"
+        previous_hook(exc_type, exc, traceback)
+
+    sys.excepthook = record_error
+    if metrics_dir != "off":
+        _start_profiler(os.environ.get("NCRNA_PROFILE", "").lower())
+        atexit.register(finish_run)
+
+
+# Function to build the metrics summary of the current run
+def metrics_summary():
+    with _lock:
+        timer_summary = {key: {"count": calls, "total_s": round(total, 6), "mean_s": round(total / calls, 6),
+                               "max_s": round(longest, 6)}
+                         for key, (calls, total, longest) in sorted(timers.items())}
+        counter_summary = dict(sorted(counters.items()))
+    return {
+        "script": _run.get("script"),
+        "argv": _run.get("argv"),
+        "started": _run.get("started"),
+        "status": _run.get("status"),
+        "wall_time_s": round(time.perf_counter() - _run.get("start", time.perf_counter()), 6),
+        "cpu_time_s": round(time.process_time() - _run.get("cpu_start", 0.0), 6),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "counters": counter_summary,
+        "timers": timer_summary,
+    }
+
+
+# Function to stop the profiler and write the metrics summary of the run
+def finish_run():
+    if not _run or _run.get("finished"):
+        return None
+    _run["finished"] = True
+    os.makedirs(metrics_dir, exist_ok=True)
+    output_base = os.path.join(metrics_dir, f"{_run['script']}_{time.strftime('%Y%m%d-%H%M%S')}_{os.getpid()}")
+    summary = metrics_summary()
+    summary.update(_stop_profiler(output_base))
+    with open(f"{output_base}.json", "w") as file:
+        json.dump(summary, file, indent=2)
+    return f"{output_base}.json"
@@ -0,0 +1,244 @@
+import os
+import re
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from instrumentation import start_run, count, timer
+
+# In-memory interval index over the resolved loci of all gene groups
+# One sorted-array index per chromosome: starts sorted ascending, with the running maximum of the ends (and the
+# locus holding it), so overlap, nearest-neighbour and containment queries are binary searches that NumPy runs for
+# whole arrays of queries at once
+# Intervals are 0-based half-open; the locus files hold 1-based inclusive Ensembl coordinates (start - 1, end)
+# Used by fetch_conservation_data.py to read overlapping loci once, and on its own to flag loci that share bases
+# with a functional copy and pseudogenes within a distance of a functional gene (results/locus_overlaps.csv)
+
+output_csv = "results/locus_overlaps.csv"
+
+gene_pattern = re.compile(r"Processing (.+?) with Transcript ID: (\S+)")
+location_pattern = re.compile(r"(chr[\w\d_]+|\d+|X|Y|MT):([\d,]+)-([\d,]+)")
+
+
+# Function to read the loci of a {group}_data.txt file, one row per transcript with a location
+def read_locus_file(path, gene_group=None):
+    with open(path) as file:
+        blocks = file.read().split("------")
+    rows = []
+    for block in blocks:
+        gene_match = gene_pattern.search(block)
+        location_match = location_pattern.search(block)
+        if not gene_match or not location_match:
+            continue
+        chrom = location_match.group(1)
+        if chrom == "MT":
+            chrom = "chrM"
+        elif not chrom.startswith("chr"):
+            chrom = f"chr{chrom}"
+        rows.append((gene_match.group(1), gene_match.group(2), chrom,
+                     int(location_match.group(2).replace(",", "")), int(location_match.group(3).replace(",", ""))))
+    loci = pd.DataFrame(rows, columns=["Gene", "Transcript", "Chromosome", "Start", "End"])
+    loci["Gene_group"] = gene_group
+    return loci
+
+
+# Function to read the loci of every gene group, labelled Functional or Pseudogene as in the combined table
+def read_all_loci(data_dir="data"):
+    from assemble_features import gene_groups, label_gene_types
+    frames = []
+    for gene_group in gene_groups:
+        path = os.path.join(data_dir, f"{gene_group}_data.txt")
+        if os.path.isfile(path):
+            frames.append(read_locus_file(path, gene_group))
+    loci = pd.concat(frames, ignore_index=True)
+    loci["Gene_Type"] = label_gene_types(loci["Gene"])
+    return loci
+
+
+# Function to build the index from arrays of chromosomes and 1-based inclusive starts and ends
+# Returns {chrom: {"starts", "ends", "max_end", "max_end_at", "ids", "sorted_ends"}}, ids being positions in the
+# input arrays
+def build_index(chroms, starts, ends):
+    chroms = np.asarray(chroms)
+    starts = np.asarray(starts, dtype=np.int64) - 1
+    ends = np.asarray(ends, dtype=np.int64)
+    index = {}
+    for chrom in np.unique(chroms):
+        ids = np.flatnonzero(chroms == chrom)
+        ids = ids[np.lexsort((ends[ids], starts[ids]))]
+        chrom_ends = ends[ids]
+        max_end = np.maximum.accumulate(chrom_ends)
+        # Position (in the sorted arrays) of the interval that reaches max_end
+        is_new_max = np.r_[True, chrom_ends[1:] > max_end[:-1]]
+        max_end_at = np.maximum.accumulate(np.where(is_new_max, np.arange(len(ids)), 0))
+        index[chrom] = {"starts": starts[ids], "ends": chrom_ends, "max_end": max_end, "max_end_at": max_end_at,
+                        "ids": ids, "sorted_ends": np.sort(chrom_ends)}
+    return index
+
+
+# Function to get the ids of the intervals overlapping [start, end) (0-based half-open)
+def overlapping(index, chrom, start, end):
+    entry = index.get(chrom)
+    if entry is None:
+        return np.empty(0, dtype=np.int64)
+    # Intervals starting before the query end, from the first one whose running max end passes the query start
+    high = np.searchsorted(entry["starts"], end, side="left")
+    low = np.searchsorted(entry["max_end"], start, side="right")
+    candidates = np.arange(low, high)
+    return entry["ids"][candidates[entry["ends"][candidates] > start]]
+
+
+# Function to get the ids of the intervals lying entirely within [start, end)
+def contained_in(index, chrom, start, end):
+    entry = index.get(chrom)
+    if entry is None:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.arange(np.searchsorted(entry["starts"], start, side="left"),
+                           np.searchsorted(entry["starts"], end, side="left"))
+    return entry["ids"][candidates[entry["ends"][candidates] <= end]]
+
+
+# Function to get the ids of the intervals that contain all of [start, end)
+def containing(index, chrom, start, end):
+    entry = index.get(chrom)
+    if entry is None:
+        return np.empty(0, dtype=np.int64)
+    high = np.searchsorted(entry["starts"], start, side="right")
+    low = np.searchsorted(entry["max_end"], end, side="left")
+    candidates = np.arange(low, high)
+    return entry["ids"][candidates[entry["ends"][candidates] >= end]]
+
+
+# Function to count, for arrays of query intervals (1-based inclusive), the indexed intervals overlapping each
+# Every interval starting before the query end overlaps it unless it also ends at or before the query start
+def overlap_counts(index, chroms, starts, ends):
+    chroms = np.asarray(chroms)
+    starts = np.asarray(starts, dtype=np.int64) - 1
+    ends = np.asarray(ends, dtype=np.int64)
+    counts = np.zeros(len(chroms), dtype=np.int64)
+    for chrom in np.unique(chroms):
+        entry = index.get(chrom)
+        if entry is None:
+            continue
+        queries = np.flatnonzero(chroms == chrom)
+        counts[queries] = (np.searchsorted(entry["starts"], ends[queries], side="left")
+                           - np.searchsorted(entry["sorted_ends"], starts[queries], side="right"))
+    return counts
+
+
+# Function to find, for arrays of query intervals (1-based inclusive), the nearest indexed interval
+# Returns the id of the nearest interval (-1 if the chromosome has none), the bases between them (0 when they
+# overlap or are adjacent) and whether they overlap
+# Vectorised per chromosome: the nearest interval on the left is the one with the largest end among those starting
+# before the query end (it overlaps the query if that end is past the query start), the nearest on the right is the
+# first one starting at or after the query end
+def nearest(index, chroms, starts, ends):
+    chroms = np.asarray(chroms)
+    starts = np.asarray(starts, dtype=np.int64) - 1
+    ends = np.asarray(ends, dtype=np.int64)
+    no_gap = np.iinfo(np.int64).max
+    nearest_ids = np.full(len(chroms), -1, dtype=np.int64)
+    gaps = np.full(len(chroms), no_gap, dtype=np.int64)
+    overlaps = np.zeros(len(chroms), dtype=bool)
+
+    for chrom in np.unique(chroms):
+        entry = index.get(chrom)
+        if entry is None:
+            continue
+        queries = np.flatnonzero(chroms == chrom)
+        query_starts, query_ends = starts[queries], ends[queries]
+        n = len(entry["starts"])
+
+        before_end = np.searchsorted(entry["starts"], query_ends, side="left")
+        left = np.maximum(before_end - 1, 0)
+        left_end = np.where(before_end > 0, entry["max_end"][left], -1)
+        left_gap = np.where(before_end > 0, np.maximum(query_starts - left_end, 0), no_gap)
+        right = np.minimum(before_end, n - 1)
+        right_gap = np.where(before_end < n, entry["starts"][right] - query_ends, no_gap)
+
+        use_right = right_gap < left_gap
+        gaps[queries] = np.where(use_right, right_gap, left_gap)
+        nearest_ids[queries] = entry["ids"][np.where(use_right, right, entry["max_end_at"][left])]
+        overlaps[queries] = left_end > query_starts
+    return nearest_ids, gaps, overlaps
+
+
+# Function to merge overlapping intervals into clusters, e.g. to read the bases shared by several loci only once
+# Returns the cluster number of each input interval and the (chrom, start, end) span of each cluster (1-based)
+def merge_clusters(chroms, starts, ends):
+    index = build_index(chroms, starts, ends)
+    cluster_of = np.empty(len(chroms), dtype=np.int64)
+    spans = []
+    for chrom, entry in index.items():
+        # A new cluster starts where an interval begins after every earlier interval has ended
+        new_cluster = np.r_[True, entry["starts"][1:] >= entry["max_end"][:-1]]
+        numbers = np.cumsum(new_cluster) - 1 + len(spans)
+        cluster_of[entry["ids"]] = numbers
+        first = np.flatnonzero(new_cluster)
+        last = np.r_[first[1:], len(new_cluster)] - 1
+        spans.extend((chrom, int(start) + 1, int(end)) for start, end in
+                     zip(entry["starts"][first], entry["max_end"][last]))
+    return cluster_of, spans
+
+
+# Function to annotate every locus: duplicates of an identical interval, overlap with a functional copy and, for
+# pseudogenes, the nearest functional gene and whether it lies within the given distance
+def annotate_loci(loci, distance):
+    functional = loci[loci["Gene_Type"] == "Functional"].reset_index(drop=True)
+    with timer("stage", step="build_index"):
+        functional_index = build_index(functional["Chromosome"], functional["Start"], functional["End"])
+    annotated = loci.copy()
+    is_pseudogene = (annotated["Gene_Type"] == "Pseudogene").to_numpy()
+
+    with timer("stage", step="nearest_functional"):
+        nearest_ids, gaps, overlaps = nearest(functional_index, annotated["Chromosome"], annotated["Start"],
+                                              annotated["End"])
+    found = is_pseudogene & (nearest_ids >= 0)
+    annotated["Nearest_functional"] = np.where(found, functional["Gene"].to_numpy()[np.maximum(nearest_ids, 0)], None)
+    annotated["Functional_distance"] = pd.Series(np.where(found, gaps, 0), dtype="Int64").mask(~found)
+    annotated[f"Within_{distance}bp_of_functional"] = found & (gaps <= distance)
+
+    # A functional locus always overlaps itself (and any other transcript of its gene), so only overlaps with
+    # other functional genes count: all overlapping functional loci minus those of the same gene
+    with timer("stage", step="functional_overlaps"):
+        all_overlaps = overlap_counts(functional_index, functional["Chromosome"], functional["Start"],
+                                      functional["End"])
+        pairs = functional.reset_index().merge(functional, on=["Gene", "Chromosome"], suffixes=("", "_other"))
+        same_gene = pairs[(pairs["Start"] <= pairs["End_other"]) & (pairs["Start_other"] <= pairs["End"])]
+        same_gene_overlaps = same_gene.groupby("index").size().reindex(range(len(functional)), fill_value=0)
+        overlaps[~is_pseudogene] = (all_overlaps - same_gene_overlaps.to_numpy()) > 0
+    annotated["Overlaps_functional"] = overlaps
+
+    # Identical intervals (duplicate transcripts, or genes sharing one location) point at their first copy
+    key = annotated["Chromosome"] + ":" + annotated["Start"].astype(str) + "-" + annotated["End"].astype(str)
+    first = annotated.groupby(key, sort=False)["Gene"].transform("first")
+    annotated["Duplicate_of"] = np.where(key.duplicated(), first, None)
+    return annotated
+
+
+# Main Execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Overlap, duplicate and nearest-functional-gene annotation of loci.")
+    parser.add_argument("--distance", type=int, default=10000,
+                        help="Flag pseudogenes within this many bases of a functional gene (default: 10000).")
+    parser.add_argument("--output", default=output_csv, help="Output CSV file.")
+    args = parser.parse_args()
+    start_run("interval_index")
+
+    loci = read_all_loci()
+    if loci.empty:
+        sys.exit("Error: no loci found in the data folder.")
+    start = time.perf_counter()
+    annotated = annotate_loci(loci, args.distance)
+    elapsed = time.perf_counter() - start
+    annotated.to_csv(args.output, index=False)
+    count("rows.written", len(annotated), output="locus_overlaps")
+
+    pseudogenes = annotated["Gene_Type"] == "Pseudogene"
+    print(f"{len(annotated)} loci annotated in {elapsed:.3f}s")
+    print(f"Duplicate intervals: {annotated['Duplicate_of'].notna().sum()}")
+    print(f"Pseudogenes overlapping a functional gene: {(annotated['Overlaps_functional'] & pseudogenes).sum()}")
+    print(f"Pseudogenes within {args.distance} bp of a functional gene: "
+          f"{(annotated[f'Within_{args.distance}bp_of_functional'] & pseudogenes).sum()}")
+    print(f"Results written to {args.output}")
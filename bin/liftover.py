@@ -0,0 +1,222 @@
+import os
+import sys
+import gzip
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from instrumentation import start_run, count, timer
+
+# Batch coordinate liftover between assemblies (hg38 <-> hg19, T2T-CHM13) with a local UCSC chain file
+# The aligned blocks of every chain are loaded into sorted arrays per source chromosome (as in interval_index.py),
+# and a whole locus table is converted at once: the blocks overlapping each locus are found with binary searches, the
+# bases each chain maps are summed per locus and the chain mapping the most bases gives the new location, from its
+# first to its last mapped base (as UCSC liftOver does)
+# Each locus gets a status:
+#   mapped    one chain maps at least --min-match of its bases
+#   split     the best chain maps at least --min-match, but other chains map some of its bases too
+#   partial   no chain maps --min-match of its bases (deleted or rearranged in the target assembly)
+#   unmapped  no aligned block overlaps it
+# Chain files: https://hgdownload.soe.ucsc.edu/goldenPath/hg38/liftOver/ (e.g. hg38ToHg19.over.chain.gz,
+# hg38ToHs1.over.chain.gz for T2T-CHM13)
+
+output_csv = "results/liftover.csv"
+
+
+# Function to read the aligned blocks of a chain file (gzipped or not)
+# Returns a DataFrame of blocks: source chrom, start, end (0-based half-open), start on the target strand, chain
+# number, target chrom, target strand and target chromosome size
+def read_chain_file(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    chains, block_chain, block_starts, block_sizes, block_query_starts = [], [], [], [], []
+    with opener(path, "rt") as file:
+        for line in file:
+            fields = line.split()
+            if not fields:
+                continue
+            if fields[0] == "chain":
+                # chain score tName tSize tStrand tStart tEnd qName qSize qStrand qStart qEnd id
+                chains.append((fields[2], fields[7], int(fields[8]), fields[9]))
+                source_position, target_position = int(fields[5]), int(fields[10])
+                continue
+            # size [dt dq]: an aligned block, then the gaps before the next block in source and target
+            size = int(fields[0])
+            block_chain.append(len(chains) - 1)
+            block_starts.append(source_position)
+            block_sizes.append(size)
+            block_query_starts.append(target_position)
+            if len(fields) == 3:
+                source_position += size + int(fields[1])
+                target_position += size + int(fields[2])
+
+    chains = pd.DataFrame(chains, columns=["Chromosome", "Target_chromosome", "Target_size", "Target_strand"])
+    block_chain = np.array(block_chain, dtype=np.int64)
+    blocks = chains.iloc[block_chain][["Chromosome", "Target_chromosome", "Target_size", "Target_strand"]]
+    blocks = blocks.reset_index(drop=True)
+    blocks["Start"] = np.array(block_starts, dtype=np.int64)
+    blocks["End"] = blocks["Start"] + np.array(block_sizes, dtype=np.int64)
+    blocks["Target_start"] = np.array(block_query_starts, dtype=np.int64)
+    blocks["Chain"] = block_chain
+    count("liftover.chains", len(chains))
+    count("liftover.blocks", len(blocks))
+    return blocks
+
+
+# Function to index the blocks per source chromosome: sorted starts with the running maximum of the ends
+def index_blocks(blocks):
+    index = {}
+    for chrom, chrom_blocks in blocks.groupby("Chromosome", sort=False):
+        chrom_blocks = chrom_blocks.sort_values(["Start", "End"])
+        index[chrom] = {"starts": chrom_blocks["Start"].to_numpy(), "ends": chrom_blocks["End"].to_numpy(),
+                        "max_end": np.maximum.accumulate(chrom_blocks["End"].to_numpy()),
+                        "rows": chrom_blocks.index.to_numpy()}
+    return index
+
+
+# Function to find every (locus, block) overlap for arrays of loci (0-based half-open), without a loop over loci
+# Candidate blocks of a locus run from the first one whose running max end passes the locus start to the last one
+# starting before the locus end; the candidate ranges are expanded with repeat/cumsum and filtered
+def block_overlaps(index, chroms, starts, ends):
+    locus_ids, block_rows = [], []
+    for chrom in np.unique(chroms):
+        entry = index.get(chrom)
+        if entry is None:
+            continue
+        loci = np.flatnonzero(chroms == chrom)
+        low = np.searchsorted(entry["max_end"], starts[loci], side="right")
+        high = np.searchsorted(entry["starts"], ends[loci], side="left")
+        lengths = np.maximum(high - low, 0)
+        repeated = np.repeat(loci, lengths)
+        positions = np.repeat(low, lengths) + np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths,
+                                                                                    lengths)
+        overlap = entry["ends"][positions] > starts[repeated]
+        locus_ids.append(repeated[overlap])
+        block_rows.append(entry["rows"][positions[overlap]])
+    if not locus_ids:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(locus_ids), np.concatenate(block_rows)
+
+
+# Function to lift over a table of loci with Chromosome, Start and End columns (1-based inclusive)
+# Adds the new location (1-based inclusive, chromosome names as in the chain file), its strand relative to the source,
+# the fraction of bases the chosen chain maps, the number of chains mapping any base and the status
+def lift_loci(loci, blocks, index, min_match=0.95):
+    chroms = loci["Chromosome"].astype(str).to_numpy()
+    starts = loci["Start"].to_numpy(dtype=np.int64) - 1
+    ends = loci["End"].to_numpy(dtype=np.int64)
+
+    with timer("stage", step="block_overlaps"):
+        locus_ids, block_rows = block_overlaps(index, chroms, starts, ends)
+    block_starts = blocks["Start"].to_numpy()[block_rows]
+    overlap_starts = np.maximum(starts[locus_ids], block_starts)
+    overlap_ends = np.minimum(ends[locus_ids], blocks["End"].to_numpy()[block_rows])
+    target_starts = blocks["Target_start"].to_numpy()[block_rows] + (overlap_starts - block_starts)
+    pieces = pd.DataFrame({"Locus": locus_ids, "Chain": blocks["Chain"].to_numpy()[block_rows],
+                           "Bases": overlap_ends - overlap_starts, "Target_start": target_starts,
+                           "Target_end": target_starts + (overlap_ends - overlap_starts)})
+
+    with timer("stage", step="choose_chain"):
+        per_chain = pieces.groupby(["Locus", "Chain"], sort=False).agg(
+            Bases=("Bases", "sum"), Target_start=("Target_start", "min"), Target_end=("Target_end", "max"))
+        per_chain = per_chain.reset_index()
+        chains_per_locus = per_chain.groupby("Locus").size()
+        best = per_chain.sort_values(["Locus", "Bases", "Chain"], ascending=[True, False, True])
+        best = best.drop_duplicates("Locus").set_index("Locus")
+
+    lifted = loci.copy()
+    n_loci = len(loci)
+    chain_info = blocks.drop_duplicates("Chain").set_index("Chain")
+    has_chain = np.zeros(n_loci, dtype=bool)
+    has_chain[best.index.to_numpy()] = True
+    chosen = best.reindex(range(n_loci))
+    info = chain_info.reindex(chosen["Chain"].fillna(-1).astype(np.int64).to_numpy())
+
+    # Coordinates on the minus strand of the target count from its end
+    minus = (info["Target_strand"] == "-").to_numpy()
+    target_size = info["Target_size"].to_numpy(dtype=np.float64)
+    new_start = np.where(minus, target_size - chosen["Target_end"].to_numpy(), chosen["Target_start"].to_numpy())
+    new_end = np.where(minus, target_size - chosen["Target_start"].to_numpy(), chosen["Target_end"].to_numpy())
+    mapped_fraction = chosen["Bases"].to_numpy() / (ends - starts)
+
+    n_chains = chains_per_locus.reindex(range(n_loci), fill_value=0).to_numpy()
+    passes = has_chain & (mapped_fraction >= min_match)
+    status = np.select([~has_chain, ~passes, n_chains > 1], ["unmapped", "partial", "split"], "mapped")
+
+    lifted["New_chromosome"] = np.where(passes, info["Target_chromosome"].to_numpy(), None)
+    lifted["New_start"] = pd.Series(new_start + 1, dtype="Int64").where(passes)
+    lifted["New_end"] = pd.Series(new_end, dtype="Int64").where(passes)
+    lifted["New_strand"] = np.where(passes, info["Target_strand"].to_numpy(), None)
+    lifted["Mapped_fraction"] = np.round(np.nan_to_num(mapped_fraction), 4)
+    lifted["Chains"] = n_chains
+    lifted["Liftover_status"] = status
+    for name in ["mapped", "split", "partial", "unmapped"]:
+        count("liftover.loci", int((status == name).sum()), status=name)
+    return lifted
+
+
+# Function to write the lifted loci of one gene group as a {group}_data.txt file of the target assembly, in the format
+# of fetch_ncrna_data.py (loci that did not lift over are left out)
+def write_locus_file(path, lifted, assembly):
+    kept = lifted[lifted["New_start"].notna()]
+    with open(path, "w") as file:
+        file.write("\n")
+        for row in kept.itertuples(index=False):
+            chrom = row.New_chromosome.replace("chr", "")
+            start, end = int(row.New_start), int(row.New_end)
+            file.write(f"Processing {row.Gene} with Transcript ID: {row.Transcript}\n")
+            file.write(f"{row.Gene} ({row.Transcript}): Genomic Sequence ({chrom}:{start:,}-{end:,})\n")
+            file.write(f"UCSC Genome Browser link: https://genome.ucsc.edu/cgi-bin/hgTracks?db={assembly}&position="
+                       f"{row.New_chromosome}%3A{start}-{end}\n")
+            file.write("------\n")
+    return len(kept)
+
+
+# Main Execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lift over the loci of the gene groups with a UCSC chain file.")
+    parser.add_argument("--chain", required=True, help="UCSC chain file, e.g. data/hg38ToHg19.over.chain.gz.")
+    parser.add_argument("--input", help="CSV file with Chromosome, Start and End columns (1-based inclusive) to lift "
+                                        "over instead of the locus files of the gene groups.")
+    parser.add_argument("--groups", nargs="+", help="Gene groups to lift over (default: all).")
+    parser.add_argument("--min-match", type=float, default=0.95,
+                        help="Fraction of bases one chain must map (default: 0.95, as UCSC liftOver).")
+    parser.add_argument("--output", default=output_csv, help="Output CSV file.")
+    parser.add_argument("--locus-dir", help="Also write {group}_data.txt locus files of the target assembly here.")
+    parser.add_argument("--assembly", default="hg19", help="UCSC name of the target assembly for the browser links "
+                                                           "of --locus-dir (default: hg19).")
+    args = parser.parse_args()
+    start_run("liftover")
+
+    start = time.perf_counter()
+    if args.input:
+        loci = pd.read_csv(args.input)
+        loci["Chromosome"] = loci["Chromosome"].astype(str).where(loci["Chromosome"].astype(str).str.startswith("chr"),
+                                                                  "chr" + loci["Chromosome"].astype(str))
+    else:
+        from interval_index import read_all_loci
+        loci = read_all_loci()
+        if args.groups:
+            loci = loci[loci["Gene_group"].isin(args.groups)].reset_index(drop=True)
+    if loci.empty:
+        sys.exit("Error: no loci to lift over.")
+
+    try:
+        with timer("stage", step="read_chain"):
+            blocks = read_chain_file(args.chain)
+    except (OSError, ValueError, IndexError) as e:
+        sys.exit(f"Error reading chain file '{args.chain}': {e}")
+    index = index_blocks(blocks)
+    lifted = lift_loci(loci, blocks, index, args.min_match)
+    lifted.to_csv(args.output, index=False)
+    count("rows.written", len(lifted), output="liftover")
+
+    if args.locus_dir and {"Gene", "Transcript", "Gene_group"} <= set(lifted.columns):
+        os.makedirs(args.locus_dir, exist_ok=True)
+        for gene_group, group_loci in lifted.groupby("Gene_group", sort=False):
+            written = write_locus_file(os.path.join(args.locus_dir, f"{gene_group}_data.txt"), group_loci,
+                                       args.assembly)
+            print(f"{gene_group}: {written} of {len(group_loci)} loci written to {args.locus_dir}")
+
+    print(f"Lifted over {len(lifted)} loci in {time.perf_counter() - start:.2f}s")
+    print(lifted["Liftover_status"].value_counts().to_string())
+    print(f"Results written to {args.output}")
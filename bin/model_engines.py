@@ -0,0 +1,133 @@
+import time
+import pickle
+import resource
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier, HistGradientBoostingClassifier
+from sklearn.model_selection import train_test_split
+from sklearn.metrics import roc_auc_score
+
+# Selectable model engines for random_forest_genes.py and a benchmark comparing them
+# 'random_forest' is the original exact-split forest, 'hist_gradient_boosting' bins the features into
+# histograms, which keeps fitting and prediction fast once the table grows to genome-wide candidates
+
+engine_names = ['random_forest', 'hist_gradient_boosting']
+
+# Default parameters of each engine (the random forest matches the original script)
+default_params = {
+    'random_forest': {'n_estimators': 100},
+    'hist_gradient_boosting': {'max_iter': 200, 'learning_rate': 0.1},
+}
+
+# Search space of each engine for the 'evaluate' command
+engine_param_grids = {
+    'random_forest': {
+        'n_estimators': [100, 300],
+        'max_depth': [None, 5, 10],
+        'min_samples_leaf': [1, 5],
+        'class_weight': [None, 'balanced'],
+    },
+    'hist_gradient_boosting': {
+        'max_iter': [100, 300],
+        'learning_rate': [0.05, 0.1],
+        'max_leaf_nodes': [15, 31],
+        'class_weight': [None, 'balanced'],
+    },
+}
+
+engine_param_distributions = {
+    'random_forest': {
+        'n_estimators': [50, 100, 200, 300, 500],
+        'max_depth': [None, 3, 5, 8, 10, 15, 20],
+        'min_samples_leaf': [1, 2, 5, 10, 20],
+        'max_features': ['sqrt', None],
+        'class_weight': [None, 'balanced', 'balanced_subsample'],
+    },
+    'hist_gradient_boosting': {
+        'max_iter': [100, 200, 300, 500],
+        'learning_rate': [0.02, 0.05, 0.1, 0.2],
+        'max_leaf_nodes': [7, 15, 31, 63],
+        'min_samples_leaf': [5, 10, 20, 50],
+        'l2_regularization': [0.0, 0.1, 1.0],
+        'class_weight': [None, 'balanced'],
+    },
+}
+
+
+# Function to build a model of the given engine
+# n_jobs only applies to the forest, the gradient boosting engine uses OpenMP threads
+def build_engine(engine='random_forest', params=None, n_jobs=1, random_state=42):
+    params = dict(default_params[engine] if params is None else params)
+    if engine == 'random_forest':
+        return RandomForestClassifier(random_state=random_state, n_jobs=n_jobs, **params)
+    if engine == 'hist_gradient_boosting':
+        return HistGradientBoostingClassifier(random_state=random_state, **params)
+    raise ValueError(f"Model engine '{engine}' is not supported. Choose from {engine_names}.")
+
+
+# Function to make a synthetic upscaled copy of the feature table
+# Rows are resampled with replacement and jittered by a fraction of each feature's spread, so the copies are
+# not exact duplicates of the real genes (near-copies land on both sides of the split, so AUC on the upscaled
+# tables is only a sanity check, the x1 AUC is the one to compare)
+def upscale_features(X, y, scale, jitter=0.05, random_state=42):
+    if scale == 1:
+        return X, y
+    rng = np.random.default_rng(random_state)
+    rows = rng.integers(0, len(y), size=len(y) * scale)
+    X_scaled = X[rows].copy()
+    spread = np.nanstd(X, axis=0).astype(np.float32)
+    X_scaled += rng.normal(0, jitter, size=X_scaled.shape).astype(np.float32) * spread
+    return X_scaled, y[rows]
+
+
+# Function run in a fresh worker process: fit and score one engine on one table size
+# Peak memory is the worker's max resident set size, so each case runs in its own spawned process (a forked one would
+# start with the parent's resident memory already counted in ru_maxrss)
+def benchmark_case(engine, scale, X, y, n_jobs, random_state=42):
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    X_scaled, y_scaled = upscale_features(X, y, scale, random_state=random_state)
+    X_train, X_test, y_train, y_test = train_test_split(X_scaled, y_scaled, test_size=0.2, stratify=y_scaled,
+                                                        random_state=random_state)
+    model = build_engine(engine, n_jobs=n_jobs, random_state=random_state)
+
+    start = time.perf_counter()
+    model.fit(X_train, y_train)
+    fit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    test_probs = model.predict_proba(X_test)[:, 1]
+    predict_time = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {
+        'engine': engine,
+        'scale': scale,
+        'n_rows': len(y_scaled),
+        'fit_time': fit_time,
+        'predict_rows_per_s': len(y_test) / predict_time if predict_time > 0 else float('inf'),
+        'peak_rss_mb': peak_rss_mb,
+        'fit_rss_increase_mb': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss) / 1024,
+        'model_size_mb': len(pickle.dumps(model)) / 1024 ** 2,
+        'auc': roc_auc_score(y_test, test_probs),
+    }
+
+
+# Function to benchmark every engine on the combined table and its synthetic upscaled copies
+def benchmark_engines(X, y, engines=engine_names, scales=(1, 10, 100), n_jobs=-1):
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    y = np.asarray(y, dtype=np.int8)
+    results = []
+    for scale in scales:
+        for engine in engines:
+            # One spawned process per case, so peak memory includes neither the parent's nor the previous case's
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                result = pool.submit(benchmark_case, engine, scale, X, y, n_jobs).result()
+            print(f"{engine} x{scale} ({result['n_rows']} rows): fit {result['fit_time']:.2f}s, "
+                  f"predict {result['predict_rows_per_s']:,.0f} rows/s, peak RSS {result['peak_rss_mb']:.0f} MB, "
+                  f"AUC {result['auc']:.4f}")
+            results.append(result)
+    return pd.DataFrame(results)
@@ -0,0 +1,173 @@
+import os
+import time
+import hashlib
+from itertools import combinations
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.model_selection import RepeatedStratifiedKFold, ParameterGrid, ParameterSampler
+from sklearn.metrics import roc_auc_score
+from model_engines import build_engine, engine_param_grids, engine_param_distributions
+
+# Repeated stratified cross-validation and hyperparameter search for random_forest_genes.py
+# Fold splits are cached on disk so repeated evaluations (and other sweeps) reuse exactly the same folds
+# Each (configuration, repeat, fold) fit runs as its own joblib task so all cores are used
+
+split_cache_dir = "results/cv_splits"
+
+# Function to fingerprint the training data (gene order and labels) so cached splits are only reused for the same data
+def fingerprint_labels(genes, y):
+    digest = hashlib.sha1()
+    digest.update("\n".join(map(str, genes)).encode('utf-8'))
+    digest.update(np.asarray(y, dtype=np.int8).tobytes())
+    return digest.hexdigest()[:16]
+
+
+# Function to load the fold assignment from the cache, or create and cache it
+# Folds are stored as an (n_repeats, n_samples) array holding the test fold of each sample in each repeat
+def load_or_make_splits(genes, y, n_splits=5, n_repeats=3, random_state=42, cache_dir=split_cache_dir):
+    key = f"{fingerprint_labels(genes, y)}_k{n_splits}_r{n_repeats}_s{random_state}"
+    cache_file = os.path.join(cache_dir, f"splits_{key}.npy")
+    if os.path.isfile(cache_file):
+        print(f"Using cached fold splits from {cache_file}")
+        return np.load(cache_file)
+
+    y = np.asarray(y)
+    fold_ids = np.empty((n_repeats, len(y)), dtype=np.int8)
+    splitter = RepeatedStratifiedKFold(n_splits=n_splits, n_repeats=n_repeats, random_state=random_state)
+    for split_number, (_, test_idx) in enumerate(splitter.split(np.zeros(len(y)), y)):
+        fold_ids[split_number // n_splits, test_idx] = split_number % n_splits
+
+    os.makedirs(cache_dir, exist_ok=True)
+    np.save(cache_file, fold_ids)
+    print(f"Fold splits saved to {cache_file}")
+    return fold_ids
+
+
+# Function to list every (repeat, fold, train indices, test indices) of a cached fold assignment
+def iter_folds(fold_ids):
+    n_repeats = fold_ids.shape[0]
+    n_splits = int(fold_ids.max()) + 1
+    for repeat in range(n_repeats):
+        for fold in range(n_splits):
+            test_mask = fold_ids[repeat] == fold
+            yield repeat, fold, np.flatnonzero(~test_mask), np.flatnonzero(test_mask)
+
+
+# Function to build the list of parameter configurations of a model engine for grid or random search
+def parameter_configs(search='grid', n_iter=20, random_state=42, engine='random_forest'):
+    if search == 'grid':
+        return list(ParameterGrid(engine_param_grids[engine]))
+    if search == 'random':
+        return list(ParameterSampler(engine_param_distributions[engine], n_iter=n_iter, random_state=random_state))
+    raise ValueError(f"Search type '{search}' is not supported.")
+
+
+# Function to build a single-threaded model for one configuration (parallelism is across fits)
+def build_model(params, engine='random_forest', random_state=42):
+    return build_engine(engine, params, n_jobs=1, random_state=random_state)
+
+
+# Function to fit and score one configuration on one fold
+def fit_and_score(config_id, params, X, y, repeat, fold, train_idx, test_idx, engine='random_forest'):
+    model = build_model(params, engine)
+
+    start = time.perf_counter()
+    model.fit(X[train_idx], y[train_idx])
+    fit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    test_probs = model.predict_proba(X[test_idx])[:, 1]
+    predict_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    auc = roc_auc_score(y[test_idx], test_probs)
+    score_time = time.perf_counter() - start
+
+    return {'config_id': config_id, 'repeat': repeat, 'fold': fold, 'auc': auc,
+            'fit_time': fit_time, 'predict_time': predict_time, 'score_time': score_time}
+
+
+# Function to cross-validate every configuration on the cached folds, one joblib task per (configuration, fold)
+def evaluate_configs(X, y, configs, fold_ids, n_jobs=-1, task=fit_and_score, **task_kwargs):
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    y = np.asarray(y, dtype=np.int8)
+    folds = list(iter_folds(fold_ids))
+    tasks = (delayed(task)(config_id, params, X, y, repeat, fold, train_idx, test_idx, **task_kwargs)
+             for config_id, params in enumerate(configs)
+             for repeat, fold, train_idx, test_idx in folds)
+    fold_results = Parallel(n_jobs=n_jobs)(tasks)
+    return pd.DataFrame(fold_results)
+
+
+# Function to summarise the per-fold results into mean and spread of AUC and a timing breakdown per configuration
+def summarise_results(fold_results, configs):
+    summary = fold_results.groupby('config_id').agg(
+        auc_mean=('auc', 'mean'),
+        auc_std=('auc', 'std'),
+        auc_min=('auc', 'min'),
+        auc_max=('auc', 'max'),
+        n_fits=('auc', 'size'),
+        fit_time_mean=('fit_time', 'mean'),
+        fit_time_total=('fit_time', 'sum'),
+        predict_time_mean=('predict_time', 'mean'),
+        score_time_mean=('score_time', 'mean'),
+    ).reset_index()
+    summary['params'] = [str(configs[config_id]) for config_id in summary['config_id']]
+    return summary.sort_values('auc_mean', ascending=False, ignore_index=True)
+
+
+# Function to list every non-empty subset of the features, smallest subsets first
+def feature_subsets(all_features):
+    subsets = []
+    for size in range(1, len(all_features) + 1):
+        subsets.extend(combinations(all_features, size))
+    return [list(subset) for subset in subsets]
+
+
+# Function to fit and score the default forest on one feature subset and one fold
+# 'columns' holds the column indices of the subset in the full feature matrix
+def fit_and_score_subset(config_id, columns, X, y, repeat, fold, train_idx, test_idx):
+    model = build_model({'n_estimators': 100})
+    X_subset = X[:, columns]
+
+    start = time.perf_counter()
+    model.fit(X_subset[train_idx], y[train_idx])
+    fit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    test_probs = model.predict_proba(X_subset[test_idx])[:, 1]
+    predict_time = time.perf_counter() - start
+
+    return {'config_id': config_id, 'repeat': repeat, 'fold': fold, 'auc': roc_auc_score(y[test_idx], test_probs),
+            'fit_time': fit_time, 'predict_time': predict_time,
+            'importances': model.feature_importances_}
+
+
+# Function to cross-validate every feature subset on the cached folds and rank them by mean AUC
+def sweep_feature_subsets(X, y, all_features, fold_ids, n_jobs=-1):
+    subsets = feature_subsets(all_features)
+    columns = [[all_features.index(feature) for feature in subset] for subset in subsets]
+
+    start = time.perf_counter()
+    fold_results = evaluate_configs(X, y, columns, fold_ids, n_jobs=n_jobs, task=fit_and_score_subset)
+    wall_time = time.perf_counter() - start
+
+    rows = []
+    for config_id, group in fold_results.groupby('config_id'):
+        mean_importances = np.mean(np.stack(group['importances'].to_numpy()), axis=0)
+        row = {'features': '+'.join(subsets[config_id]), 'n_features': len(subsets[config_id]),
+               'auc_mean': group['auc'].mean(), 'auc_std': group['auc'].std(),
+               'auc_min': group['auc'].min(), 'auc_max': group['auc'].max(),
+               'fit_time_mean': group['fit_time'].mean(), 'predict_time_mean': group['predict_time'].mean(),
+               'runtime_total': group['fit_time'].sum() + group['predict_time'].sum()}
+        # Importance of every feature (empty when the feature is not in the subset)
+        for feature in all_features:
+            row[f'importance_{feature}'] = np.nan
+        for feature, importance in zip(subsets[config_id], mean_importances):
+            row[f'importance_{feature}'] = importance
+        rows.append(row)
+
+    ranking = pd.DataFrame(rows).sort_values(['auc_mean', 'n_features'], ascending=[False, True], ignore_index=True)
+    ranking.insert(0, 'rank', np.arange(1, len(ranking) + 1))
+    return ranking, wall_time
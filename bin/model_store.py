@@ -0,0 +1,109 @@
+import os
+import json
+import time
+import hashlib
+import numpy as np
+import pandas as pd
+import joblib
+import sklearn
+from assemble_features import feature_frame
+
+# Persisted model artifact and chunked batch scorer for random_forest_genes.py
+# 'train' saves the fitted model with its feature list and a fingerprint of the training data
+# 'score' loads the saved model once and scores gene tables in chunks without retraining
+
+model_dir = "results/model"
+model_file = "model.joblib"
+metadata_file = "model_metadata.json"
+
+
+# Function to fingerprint the training data (genes, feature values and labels)
+def training_fingerprint(genes, X, y):
+    digest = hashlib.sha1()
+    digest.update("\n".join(map(str, genes)).encode('utf-8'))
+    digest.update(np.ascontiguousarray(X, dtype=np.float32).tobytes())
+    digest.update(np.asarray(y, dtype=np.int8).tobytes())
+    return digest.hexdigest()
+
+
+# Function to save the fitted model together with its feature list and training data fingerprint
+def save_model(model, features, fingerprint, n_train, output_dir=model_dir, extra_metadata=None):
+    os.makedirs(output_dir, exist_ok=True)
+    # Written uncompressed so the tree arrays can be memory-mapped when loading
+    joblib.dump(model, os.path.join(output_dir, model_file))
+
+    metadata = {
+        'features': list(features),
+        'training_fingerprint': fingerprint,
+        'n_train': int(n_train),
+        'model_class': type(model).__name__,
+        'model_params': {key: value for key, value in model.get_params().items()
+                         if isinstance(value, (int, float, str, bool, type(None)))},
+        'sklearn_version': sklearn.__version__,
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    if extra_metadata:
+        metadata.update(extra_metadata)
+    with open(os.path.join(output_dir, metadata_file), 'w') as file:
+        json.dump(metadata, file, indent=2)
+    return metadata
+
+
+# Function to load a saved model (memory-mapped) and its metadata
+def load_model(input_dir=model_dir, n_jobs=-1):
+    model_path = os.path.join(input_dir, model_file)
+    metadata_path = os.path.join(input_dir, metadata_file)
+    if not os.path.isfile(model_path) or not os.path.isfile(metadata_path):
+        raise FileNotFoundError(f"No saved model found in '{input_dir}'. Run the 'train' command first.")
+
+    with open(metadata_path, 'r') as file:
+        metadata = json.load(file)
+    if metadata.get('sklearn_version') != sklearn.__version__:
+        print(f"Warning: model was saved with scikit-learn {metadata.get('sklearn_version')}, "
+              f"running {sklearn.__version__}")
+
+    model = joblib.load(model_path, mmap_mode='r')
+    # Prediction is parallelised over trees
+    if hasattr(model, 'n_jobs'):
+        model.n_jobs = n_jobs
+    return model, metadata
+
+
+# Function to split an in-memory gene table into chunks
+def iter_frame_chunks(frame, chunksize):
+    for start in range(0, len(frame), chunksize):
+        yield frame.iloc[start:start + chunksize]
+
+
+# Function to stream a gene table from a CSV file in chunks, reading only the gene and feature columns
+def iter_csv_chunks(input_csv, features, chunksize):
+    header = pd.read_csv(input_csv, nrows=0).columns
+    missing = [column for column in ['Gene'] + list(features) if column not in header]
+    if missing:
+        raise ValueError(f"Input file '{input_csv}' is missing columns: {missing}")
+    usecols = ['Gene'] + list(features) + (['Gene_group'] if 'Gene_group' in header else [])
+    dtypes = {feature: np.float32 for feature in features}
+    dtypes['Gene'] = str
+    return pd.read_csv(input_csv, usecols=usecols, dtype=dtypes, chunksize=chunksize)
+
+
+# Function to score gene table chunks and write 'functional_probability' to a CSV file chunk by chunk
+def score_chunks(model, features, chunks, output_csv):
+    os.makedirs(os.path.dirname(output_csv) or '.', exist_ok=True)
+    temp_output_csv = f"{output_csv}.tmp"
+    n_scored = 0
+    start = time.perf_counter()
+
+    with open(temp_output_csv, 'w', newline='') as outfile:
+        for chunk_number, chunk in enumerate(chunks):
+            X = feature_frame(chunk, features).to_numpy()
+            scored = chunk[[column for column in ['Gene', 'Gene_group'] if column in chunk.columns]].copy()
+            scored['functional_probability'] = model.predict_proba(X)[:, 1]
+            scored.to_csv(outfile, index=False, header=(chunk_number == 0))
+            n_scored += len(scored)
+
+    os.replace(temp_output_csv, output_csv)
+    elapsed = time.perf_counter() - start
+    rate = n_scored / elapsed if elapsed > 0 else float('inf')
+    print(f"Scored {n_scored} genes in {elapsed:.2f}s ({rate:,.0f} genes/s)")
+    return n_scored
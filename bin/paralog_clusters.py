@@ -0,0 +1,196 @@
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from instrumentation import start_run, count, timer
+from sequence_features import open_genome, fetch_loci, kmer_ids
+
+# Paralog clustering of the loci within each gene group
+# Each locus sequence (from the local genome, see sequence_features.py) is reduced to its set of canonical k-mers and
+# sketched with MinHash: num_perm multiply-shift hash functions, keeping the minimum of each over the set, so the
+# fraction of equal sketch entries of two loci estimates the Jaccard similarity of their k-mer sets
+# Near-duplicates are found with LSH banding instead of comparing all pairs: the sketch is cut into bands and only loci
+# sharing all rows of at least one band become candidate pairs; candidates whose estimated similarity reaches the
+# threshold are linked and the connected components are the paralog clusters
+# Every locus is also compared with the functional copies of its group (a small set), giving the similarity to the
+# closest functional copy. Written to results/paralog_clusters.csv, one row per gene (its first locus)
+
+output_csv = "results/paralog_clusters.csv"
+
+# Hash values are the high 32 bits of a 64-bit multiply-shift hash, empty sketches are marked with empty_hash
+empty_hash = np.uint64(2 ** 32)
+
+
+# Function to draw the multiply-shift hash functions (odd multipliers, random offsets)
+def hash_functions(num_perm, seed=1):
+    rng = np.random.default_rng(seed)
+    multipliers = rng.integers(0, 2 ** 63, num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    increments = rng.integers(0, 2 ** 63, num_perm, dtype=np.uint64)
+    return multipliers, increments
+
+
+# Function to compute the MinHash sketch of the k-mer set of every locus of a concatenated code array
+# Returns an (n_loci, num_perm) array; loci without a valid k-mer get a sketch of empty_hash
+def minhash_sketches(codes, offsets, k, num_perm, seed=1, perms_per_block=32):
+    n_loci = len(offsets) - 1
+    kmers, valid, locus_of = kmer_ids(codes, offsets, k)
+    kmers, locus_of = kmers[valid].astype(np.uint64), locus_of[valid]
+    sketches = np.full((n_loci, num_perm), empty_hash, dtype=np.uint64)
+    if len(kmers) == 0:
+        return sketches
+    # k-mers are in locus order, so each locus is one segment for minimum.reduceat
+    loci_present, segment_starts = np.unique(locus_of, return_index=True)
+    multipliers, increments = hash_functions(num_perm, seed)
+    with np.errstate(over="ignore"):
+        for start in range(0, num_perm, perms_per_block):
+            block = slice(start, start + perms_per_block)
+            hashes = (kmers[:, None] * multipliers[None, block] + increments[None, block]) >> np.uint64(32)
+            sketches[loci_present, block] = np.minimum.reduceat(hashes, segment_starts, axis=0)
+    return sketches
+
+
+# Function to estimate the Jaccard similarity of pairs of loci from their sketches
+def estimated_similarity(sketches, first, second, pairs_per_block=100_000):
+    similarity = np.empty(len(first))
+    for start in range(0, len(first), pairs_per_block):
+        block = slice(start, start + pairs_per_block)
+        similarity[block] = (sketches[first[block]] == sketches[second[block]]).mean(axis=1)
+    return similarity
+
+
+# Function to find the candidate pairs of LSH banding: loci whose sketches are equal over a whole band
+# Returns the pairs (first < second) colliding in at least one band
+def candidate_pairs(sketches, bands):
+    n_loci, num_perm = sketches.shape
+    rows = num_perm // bands
+    pair_codes = []
+    for band in range(bands):
+        _, bucket = np.unique(sketches[:, band * rows:(band + 1) * rows], axis=0, return_inverse=True)
+        bucket = bucket.ravel()
+        order = np.argsort(bucket, kind="stable")
+        sizes = np.bincount(bucket)
+        bucket_starts = np.r_[0, np.cumsum(sizes)[:-1]]
+        for bucket_start, size in zip(bucket_starts[sizes > 1], sizes[sizes > 1]):
+            members = order[bucket_start:bucket_start + size]
+            first, second = np.triu_indices(size, 1)
+            pair_codes.append(members[first] * n_loci + members[second])
+    if not pair_codes:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    pair_codes = np.unique(np.concatenate(pair_codes))
+    return pair_codes // n_loci, pair_codes % n_loci
+
+
+# Function to cluster the loci of one gene group from their sketches
+# Returns the cluster number of every locus (numbered in locus order) and the number of linked pairs
+def cluster_sketches(sketches, bands, threshold):
+    n_loci = len(sketches)
+    # Loci without a k-mer all share the empty sketch, they stay single-locus clusters
+    has_kmers = np.flatnonzero(sketches[:, 0] != empty_hash)
+    with timer("stage", step="lsh_candidates"):
+        first, second = candidate_pairs(sketches[has_kmers], bands)
+        first, second = has_kmers[first], has_kmers[second]
+    count("paralog.candidate_pairs", len(first))
+    with timer("stage", step="verify_pairs"):
+        linked = estimated_similarity(sketches, first, second) >= threshold
+    graph = coo_matrix((np.ones(linked.sum()), (first[linked], second[linked])), shape=(n_loci, n_loci))
+    _, components = connected_components(graph, directed=False)
+    return pd.factorize(components)[0], int(linked.sum())
+
+
+# Function to find, for every locus, the functional copy with the highest estimated similarity (not itself)
+def closest_functional(sketches, functional, rows_per_block=None):
+    n_loci, num_perm = sketches.shape
+    best = np.full(n_loci, np.nan)
+    best_at = np.full(n_loci, -1, dtype=np.int64)
+    if len(functional) == 0:
+        return best, best_at
+    rows_per_block = rows_per_block or max(1, 2 ** 24 // (len(functional) * num_perm))
+    functional_sketches = sketches[functional]
+    for start in range(0, n_loci, rows_per_block):
+        block = np.arange(start, min(start + rows_per_block, n_loci))
+        similarity = (sketches[block, None, :] == functional_sketches[None, :, :]).mean(axis=2)
+        similarity[block[:, None] == functional[None, :]] = -1
+        similarity[(sketches[block, 0] == empty_hash)] = -1
+        similarity[:, functional_sketches[:, 0] == empty_hash] = -1
+        closest = similarity.argmax(axis=1)
+        value = similarity[np.arange(len(block)), closest]
+        found = value >= 0
+        best[block[found]] = value[found]
+        best_at[block[found]] = functional[closest[found]]
+    return best, best_at
+
+
+# Function to cluster the loci of every gene group and compare them with the functional copies of their group
+def paralog_clusters(loci, genome, k=7, num_perm=128, bands=32, threshold=0.5):
+    loci = loci.drop_duplicates("Gene", keep="first").reset_index(drop=True)
+    codes, offsets = fetch_loci(genome, loci["Chromosome"], loci["Start"], loci["End"])
+    with timer("stage", step="minhash"):
+        sketches = minhash_sketches(codes, offsets, k, num_perm)
+
+    clusters = loci[["Gene", "Gene_group", "Gene_Type"]].copy()
+    clusters["Paralog_cluster"] = -1
+    clusters["Cluster_size"] = 0
+    clusters["Cluster_functional"] = 0
+    clusters["Functional_similarity"] = np.nan
+    clusters["Closest_functional"] = None
+    genes = loci["Gene"].to_numpy()
+    is_functional = (loci["Gene_Type"] == "Functional").to_numpy()
+
+    for gene_group in loci["Gene_group"].unique():
+        start = time.perf_counter()
+        members = np.flatnonzero((loci["Gene_group"] == gene_group).to_numpy())
+        cluster_of, links = cluster_sketches(sketches[members], bands, threshold)
+        sizes = np.bincount(cluster_of)
+        functional_per_cluster = np.bincount(cluster_of, weights=is_functional[members]).astype(np.int64)
+        clusters.loc[members, "Paralog_cluster"] = cluster_of
+        clusters.loc[members, "Cluster_size"] = sizes[cluster_of]
+        clusters.loc[members, "Cluster_functional"] = functional_per_cluster[cluster_of]
+
+        with timer("stage", step="functional_similarity"):
+            similarity, closest = closest_functional(sketches[members], np.flatnonzero(is_functional[members]))
+        found = closest >= 0
+        clusters.loc[members[found], "Functional_similarity"] = similarity[found]
+        clusters.loc[members[found], "Closest_functional"] = genes[members[closest[found]]]
+        count("paralog.clusters", len(sizes), gene_group=gene_group)
+        print(f"{gene_group}: {len(members)} loci, {len(sizes)} clusters ({(sizes > 1).sum()} with several copies, "
+              f"{links} linked pairs) in {time.perf_counter() - start:.2f}s")
+    return clusters
+
+
+# Main Execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MinHash/LSH paralog clustering of the loci of each gene group.")
+    parser.add_argument("--genome", help="hg38 2bit file or FASTA file (default: data/hg38.2bit or data/hg38.fa).")
+    parser.add_argument("--groups", nargs="+", help="Gene groups to cluster (default: all).")
+    parser.add_argument("--k", type=int, default=7, help="k-mer length of the sequence sets (default: 7).")
+    parser.add_argument("--num-perm", type=int, default=128, help="MinHash sketch size (default: 128).")
+    parser.add_argument("--bands", type=int, default=32,
+                        help="LSH bands; must divide --num-perm (default: 32, i.e. 4 rows per band).")
+    parser.add_argument("--threshold", type=float, default=0.5,
+                        help="Estimated Jaccard similarity that links two loci (default: 0.5).")
+    parser.add_argument("--output", default=output_csv, help="Output CSV file.")
+    args = parser.parse_args()
+    if args.num_perm % args.bands:
+        parser.error("--bands must divide --num-perm")
+    start_run("paralog_clusters")
+
+    from interval_index import read_all_loci
+    try:
+        genome = open_genome(args.genome)
+    except (FileNotFoundError, ValueError) as e:
+        sys.exit(f"Error: {e}")
+
+    start = time.perf_counter()
+    loci = read_all_loci()
+    if args.groups:
+        loci = loci[loci["Gene_group"].isin(args.groups)]
+    if loci.empty:
+        sys.exit("Error: no loci found for the selected gene groups.")
+    clusters = paralog_clusters(loci, genome, args.k, args.num_perm, args.bands, args.threshold)
+    clusters.to_csv(args.output, index=False, float_format="%.4g")
+    count("rows.written", len(clusters), output="paralog_clusters")
+    print(f"{len(clusters)} genes clustered in {time.perf_counter() - start:.2f}s")
+    print(f"Results written to {args.output}")
@@ -0,0 +1,267 @@
+import os
+import argparse
+import time
+from math import comb
+from itertools import combinations
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy.stats import ks_2samp, kstwobign, mannwhitneyu, rankdata
+from assemble_features import gene_groups, label_gene_types, exception_genes
+from instrumentation import start_run, count, timer
+
+# Script to compare functional genes and pseudogenes of each gene group with KS and Wilcoxon (Mann-Whitney) tests
+# Python replacement of Kolmogorov-Smirnov_or_wilcoxon_test.R and KS_test_expression.R
+# Adds permutation p-values, which stay valid for the very unbalanced group sizes (e.g. 1 functional vs 70 pseudogenes),
+# and Benjamini-Hochberg FDR across all tests of a table
+# Permutations are generated in batches as NumPy index matrices and every (source, gene group) test runs in a process pool
+
+data_dir = "data"
+
+# Conservation tracks: (name in the results table, path template, value column)
+conservation_sources = [
+    ("phastCons30", "phastCons30_summary/{group}_phastCons30_summary_metrics.csv", "Median_Conservation"),
+    ("phyloP100", "phyloP100_summary/{group}_phyloP100_summary_metrics.csv", "Median_Conservation"),
+    ("phyloP447", "phyloP447_summary/{group}_phyloP447_summary_metrics.csv", "Median_Conservation"),
+]
+
+# Expression sources
+expression_sources = [
+    ("ENCODE", "ENCODE-expr_summary/{group}_expr.csv", "Max_FPKM"),
+    ("GTEX", "GTEX-expr_summary/{group}_expr.csv", "Max Expression"),
+]
+
+# Function to label genes as Kolmogorov-Smirnov_or_wilcoxon_test.R does for the conservation table: a gene with a "P"
+# is a pseudogene unless it is in exception_genes (the expression table uses label_gene_types, as KS_test_expression.R)
+def label_gene_types_r_conservation(genes):
+    genes = pd.Series(genes, dtype=str)
+    is_pseudogene = genes.str.contains("P", regex=False) & ~genes.isin(exception_genes)
+    return pd.Categorical(np.where(is_pseudogene.to_numpy(), "Pseudogene", "Functional"),
+                          categories=["Functional", "Pseudogene"])
+
+
+# Upper bound on the number of elements of one permutation batch (batch size x number of genes)
+max_batch_elements = 2_000_000
+
+
+# Function to read the functional and pseudogene values of one gene group
+# Missing values are kept: the R scripts report the number of rows of each type as the sample counts, and ks.test()
+# drops the missing values itself (see run_group_test)
+def read_group_values(path, value_column, label_genes=label_gene_types):
+    data = pd.read_csv(path, usecols=["Gene", value_column], dtype={"Gene": str, value_column: np.float64})
+    is_functional = np.asarray(label_genes(data["Gene"]) == "Functional")
+    values = data[value_column].to_numpy()
+    return values[is_functional], values[~is_functional]
+
+
+# Function to build batches of permutation label matrices
+# Each batch is a boolean (batch, n) matrix with n_functional True values per row, built from an index matrix of
+# which genes are relabelled functional. When all relabellings fit within n_permutations they are enumerated,
+# which makes the permutation p-value exact
+def permutation_batches(n, n_functional, n_permutations, rng):
+    batch_size = max(1, max_batch_elements // n)
+    exact = comb(n, n_functional) <= n_permutations
+
+    if exact:
+        index_rows = combinations(range(n), n_functional)
+        while True:
+            batch = [row for _, row in zip(range(batch_size), index_rows)]
+            if not batch:
+                return
+            yield exact, _labels_from_indices(np.array(batch, dtype=np.int64), n)
+    else:
+        done = 0
+        while done < n_permutations:
+            size = min(batch_size, n_permutations - done)
+            indices = rng.permuted(np.tile(np.arange(n), (size, 1)), axis=1)[:, :n_functional]
+            yield exact, _labels_from_indices(indices, n)
+            done += size
+
+
+def _labels_from_indices(indices, n):
+    labels = np.zeros((indices.shape[0], n), dtype=bool)
+    labels[np.arange(indices.shape[0])[:, None], indices] = True
+    return labels
+
+
+# Function to compute the two-sample KS statistic for every row of a label matrix at once
+# Values are sorted once, the empirical CDFs are cumulative sums over the sorted labels, compared at the end
+# of every block of tied values
+def ks_statistics(labels, order, tie_ends, n_functional, n_pseudogene):
+    sorted_labels = labels[:, order]
+    cdf_functional = np.cumsum(sorted_labels, axis=1, dtype=np.float64)[:, tie_ends] / n_functional
+    cdf_pseudogene = np.cumsum(~sorted_labels, axis=1, dtype=np.float64)[:, tie_ends] / n_pseudogene
+    return np.abs(cdf_functional - cdf_pseudogene).max(axis=1)
+
+
+# Function to compute the two-sided p-value of a two-sample KS statistic as R's ks.test() does (R >= 4.3):
+# exact when m * n < 10000, counting the lattice paths of the two samples that reach the statistic (only at the end
+# of a block of tied values, so ties are handled exactly), otherwise from the limiting Kolmogorov distribution
+# scipy's ks_2samp() ignores ties in its exact p-value and uses a different asymptotic form, which is up to 2x off
+def ks_p_value(statistic, functional, pseudogenes):
+    m, n = sorted((len(functional), len(pseudogenes)))
+    if m * n >= 10000:
+        return float(kstwobign.sf(np.sqrt(m * n / (m + n)) * statistic))
+    values = np.sort(np.concatenate([functional, pseudogenes]))
+    block_ends = np.append(values[1:] != values[:-1], True)
+    # Threshold half a lattice step below the statistic, so paths reaching it exactly are counted
+    threshold = (0.5 + np.floor(statistic * m * n - 1e-7)) / (m * n)
+
+    def reaches(i, j):
+        return block_ends[i + j - 1] and abs(i / m - j / n) >= threshold
+
+    # Path counts to (i, j), scaled by 1 / C(i + n, n) so they stay finite: paths[j] of all paths and hit[j] of the
+    # paths that reached the threshold on the way. hit[n] at i = m is the p-value, summed directly rather than as
+    # 1 - P(D < statistic) so very small p-values keep their precision
+    paths = np.ones(n + 1)
+    hit = np.zeros(n + 1)
+    for j in range(1, n + 1):
+        hit[j] = paths[j] if reaches(0, j) else hit[j - 1]
+    for i in range(1, m + 1):
+        weight = i / (i + n)
+        paths[0] *= weight
+        hit[0] = paths[0] if reaches(i, 0) else weight * hit[0]
+        for j in range(1, n + 1):
+            paths[j] = weight * paths[j] + paths[j - 1]
+            hit[j] = paths[j] if reaches(i, j) else weight * hit[j] + hit[j - 1]
+    return min(1.0, hit[n])
+
+
+# Function to compute the centred Mann-Whitney U statistic |U - n1*n2/2| for every row of a label matrix at once
+def wilcoxon_statistics(labels, ranks, n_functional, n_pseudogene):
+    rank_sums = labels @ ranks
+    u_statistics = rank_sums - n_functional * (n_functional + 1) / 2
+    return np.abs(u_statistics - n_functional * n_pseudogene / 2)
+
+
+# Function to run the KS and Wilcoxon tests with permutation p-values for one (source, gene group)
+def run_group_test(task):
+    source, gene_group, functional, pseudogenes, n_permutations, seed = task
+    result = {"Source": source, "Gene_group": gene_group,
+              "Statistic": np.nan, "p_value": np.nan,
+              "Functional_Sample_Count": len(functional), "Pseudogene_Sample_Count": len(pseudogenes),
+              "Wilcoxon_Statistic": np.nan, "Wilcoxon_p_value": np.nan,
+              "KS_permutation_p_value": np.nan, "Wilcoxon_permutation_p_value": np.nan,
+              "Permutations": 0, "Exact_permutation": False, "Runtime_s": np.nan}
+    # The tests leave the missing values out, as ks.test() in R (-inf, the GTEx maximum of a gene without data, is kept)
+    functional, pseudogenes = functional[~np.isnan(functional)], pseudogenes[~np.isnan(pseudogenes)]
+    n_functional, n_pseudogene = len(functional), len(pseudogenes)
+    if n_functional == 0 or n_pseudogene == 0:
+        return result
+
+    start = time.perf_counter()
+    ks_statistic = ks_2samp(functional, pseudogenes).statistic
+    wilcoxon_result = mannwhitneyu(functional, pseudogenes, alternative="two-sided")
+    result.update({"Statistic": ks_statistic, "p_value": ks_p_value(ks_statistic, functional, pseudogenes),
+                   "Wilcoxon_Statistic": wilcoxon_result.statistic, "Wilcoxon_p_value": wilcoxon_result.pvalue})
+
+    # Pooled values with the observed labels first
+    values = np.concatenate([functional, pseudogenes])
+    n = len(values)
+    order = np.argsort(values, kind="stable")
+    sorted_values = values[order]
+    tie_ends = np.flatnonzero(np.append(sorted_values[1:] != sorted_values[:-1], True))
+    ranks = rankdata(values)
+
+    observed = np.zeros((1, n), dtype=bool)
+    observed[0, :n_functional] = True
+    # Small tolerance so permutations equal to the observed statistic count as at least as extreme
+    observed_ks = ks_statistics(observed, order, tie_ends, n_functional, n_pseudogene)[0] - 1e-12
+    observed_wilcoxon = wilcoxon_statistics(observed, ranks, n_functional, n_pseudogene)[0] - 1e-9
+
+    rng = np.random.default_rng(seed)
+    ks_extreme = wilcoxon_extreme = total = 0
+    exact = False
+    for exact, labels in permutation_batches(n, n_functional, n_permutations, rng):
+        ks_extreme += int((ks_statistics(labels, order, tie_ends, n_functional, n_pseudogene) >= observed_ks).sum())
+        wilcoxon_extreme += int((wilcoxon_statistics(labels, ranks, n_functional, n_pseudogene)
+                                 >= observed_wilcoxon).sum())
+        total += labels.shape[0]
+
+    if exact:
+        # Every relabelling (including the observed one) was enumerated
+        result["KS_permutation_p_value"] = ks_extreme / total
+        result["Wilcoxon_permutation_p_value"] = wilcoxon_extreme / total
+    else:
+        result["KS_permutation_p_value"] = (ks_extreme + 1) / (total + 1)
+        result["Wilcoxon_permutation_p_value"] = (wilcoxon_extreme + 1) / (total + 1)
+    result.update({"Permutations": total, "Exact_permutation": exact, "Runtime_s": time.perf_counter() - start})
+    return result
+
+
+# Function to compute Benjamini-Hochberg adjusted p-values (missing p-values stay missing)
+def benjamini_hochberg(p_values):
+    p_values = np.asarray(p_values, dtype=np.float64)
+    adjusted = np.full_like(p_values, np.nan)
+    valid = np.flatnonzero(~np.isnan(p_values))
+    if len(valid) == 0:
+        return adjusted
+    order = valid[np.argsort(p_values[valid])]
+    ranked = p_values[order] * len(valid) / np.arange(1, len(valid) + 1)
+    adjusted[order] = np.minimum(np.minimum.accumulate(ranked[::-1])[::-1], 1.0)
+    return adjusted
+
+
+# Function to build one test per (source, gene group) plus the pooled test of each source
+def build_tasks(sources, n_permutations, seed, data_dir=data_dir, label_genes=label_gene_types):
+    tasks = []
+    for source, path_template, value_column in sources:
+        pooled_functional, pooled_pseudogenes = [], []
+        for gene_group in gene_groups:
+            path = os.path.join(data_dir, path_template.format(group=gene_group))
+            if not os.path.isfile(path):
+                print(f"File does not exist for gene {gene_group} in {source}")
+                count("groups.skipped", reason="missing_file")
+                functional, pseudogenes = np.array([]), np.array([])
+            else:
+                functional, pseudogenes = read_group_values(path, value_column, label_genes)
+            pooled_functional.append(functional)
+            pooled_pseudogenes.append(pseudogenes)
+            tasks.append((source, gene_group, functional, pseudogenes, n_permutations, [seed, len(tasks)]))
+        tasks.append((source, "Pooled", np.concatenate(pooled_functional), np.concatenate(pooled_pseudogenes),
+                      n_permutations, [seed, len(tasks)]))
+    return tasks
+
+
+# Function to run every test of a results table in the process pool and add the FDR columns
+def run_tests(sources, source_column, n_permutations=10000, seed=42, workers=None, label_genes=label_gene_types):
+    with timer("stage", step="read_groups"):
+        tasks = build_tasks(sources, n_permutations, seed, label_genes=label_genes)
+    # Largest tests first so the pool is not left waiting on one big pooled test at the end
+    tasks.sort(key=lambda task: -(len(task[2]) + len(task[3])))
+    with timer("stage", step="permutation_tests"), ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(run_group_test, tasks))
+    count("tests.run", len(results), table=source_column)
+    count("permutations", sum(result["Permutations"] for result in results), table=source_column)
+
+    table = pd.DataFrame(results)
+    source_order = {source: number for number, (source, _, _) in enumerate(sources)}
+    group_order = {gene_group: number for number, gene_group in enumerate(gene_groups + ["Pooled"])}
+    table = table.sort_values(["Source", "Gene_group"], key=lambda column: column.map(
+        source_order if column.name == "Source" else group_order), ignore_index=True)
+    table["KS_permutation_FDR"] = benjamini_hochberg(table["KS_permutation_p_value"])
+    table["Wilcoxon_permutation_FDR"] = benjamini_hochberg(table["Wilcoxon_permutation_p_value"])
+    return table.rename(columns={"Source": source_column})
+
+
+# Main Execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="KS and Wilcoxon tests of functional genes vs pseudogenes "
+                                                 "with permutation p-values and FDR.")
+    parser.add_argument("--permutations", type=int, default=10000, help="Permutations per test (default: 10000).")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores).")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed.")
+    parser.add_argument("--conservation-output", default="results/ks_test_conservation_results.csv")
+    parser.add_argument("--expression-output", default="results/ks_test_expression_results.csv")
+    args = parser.parse_args()
+    start_run("permutation_tests")
+
+    for sources, source_column, output_csv, label_genes in [
+            (conservation_sources, "Conservation_Type", args.conservation_output, label_gene_types_r_conservation),
+            (expression_sources, "Expression_Type", args.expression_output, label_gene_types)]:
+        start = time.perf_counter()
+        table = run_tests(sources, source_column, n_permutations=args.permutations, seed=args.seed,
+                          workers=args.workers, label_genes=label_genes)
+        table.to_csv(output_csv, index=False)
+        print(f"{len(table)} tests with {args.permutations} permutations in {time.perf_counter() - start:.2f}s")
+        print(f"Results written to {output_csv}")
@@ -0,0 +1,398 @@
+import os
+import sys
+import ast
+import json
+import time
+import hashlib
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from assemble_features import gene_groups, feature_sources
+from summarise_conservation import track_files
+from figure_names import figure_names
+from instrumentation import start_run, count, observe
+
+# Declarative DAG runner for the workflow, run from the repository root:
+# [fetch_ncrna_data + cleanup_txt_data] -> fetch_conservation_data (x3 tracks) -> summarise_conservation
+#                                       -> fetch_expression_data, fetch_ENCODE_expr -> assemble_features -> random_forest_genes
+# The curated locus files data/<group>_data.txt are source inputs; the fetch_ncrna nodes that rebuild them from a live
+# HGNC query are only added with --rebuild-loci
+# Every node is one (stage, gene group[, track]) with its command, input files and output files
+# Dependencies follow from which node writes each input file
+# The content hashes of inputs and outputs and the command of every successful node are recorded, so a node only
+# reruns when an input, output, script or parameter changed. Independent nodes run in parallel
+# If an upstream node reruns but writes identical outputs, the nodes below it are not rerun
+
+state_file = "results/pipeline/state.json"
+log_dir = "results/pipeline/logs"
+# Rebuilt locus files are written here first and only moved into data/ once the lookup and cleanup succeeded
+loci_staging_dir = "results/pipeline/loci"
+# Gene groups whose locus file was assembled from an explicit list of gene symbols, not an HGNC query, so a query
+# cannot rebuild it
+curated_locus_groups = ["TRNA"]
+
+# BigWig file of each conservation track (as used by fetch_conservation_data.py)
+track_bigwigs = {
+    "phastCons30": "data/hg38.phastCons30way.bw",
+    "phyloP100": "data/hg38.phyloP100way.bw",
+    "phyloP447": "data/hg38.phyloP447way.bw",
+}
+encode_tsv = "data/rna_expression_report_2024_11_20_22h_6m.tsv"
+
+stage_names = ["fetch_ncrna", "fetch_conservation", "summarise_conservation", "fetch_expression", "fetch_encode",
+               "assemble_features", "random_forest"]
+
+
+# Function to read the GTEx file list of fetch_expression_data.py without running the script (as benchmarks.py does)
+# Every listed track is an input of the fetch_expression nodes, so a missing file blocks them
+def gtex_file_paths(script="bin/fetch_expression_data.py"):
+    with open(script) as file:
+        tree = ast.parse(file.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(target, "id", None) == "rna_seq_files" for target in node.targets):
+            return ast.literal_eval(node.value)
+    raise ValueError(f"rna_seq_files not found in {script}")
+
+
+# Function to describe one node of the DAG
+# 'promote' maps files the commands write to a staging path to the outputs they replace once every command succeeded
+def make_node(stage, key, commands, inputs, outputs, params, promote=None):
+    return {"id": f"{stage}:{key}" if key else stage, "stage": stage, "commands": commands,
+            "inputs": sorted(set(inputs)), "outputs": sorted(set(outputs)), "params": params,
+            "promote": promote or {}}
+
+
+def python_command(script, *arguments):
+    return [sys.executable, f"bin/{script}", *arguments]
+
+
+# Function to build every node of the workflow
+def build_nodes(groups=gene_groups, tracks=list(track_files), rebuild_loci=False):
+    nodes = []
+    gtex_bigwigs = gtex_file_paths()
+    # Each stage also depends on the helper modules its script imports, so editing one of them reruns the stage
+    ncrna_scripts = ["bin/fetch_ncrna_data.py", "bin/cleanup_txt_data.py", "bin/http_client.py",
+                     "bin/instrumentation.py"]
+    bigwig_scripts = ["bin/bigwig_cache.py", "bin/remote_bigwig.py", "bin/http_client.py", "bin/sharding.py",
+                      "bin/instrumentation.py"]
+
+    for group in groups:
+        gene_file = f"data/{group}_data.txt"
+        if rebuild_loci and group not in curated_locus_groups:
+            # HGNC/Ensembl lookup and the cleanup edit the same staged file, so they form one node
+            staged_file = os.path.join(loci_staging_dir, f"{group}_data.txt")
+            nodes.append(make_node(
+                "fetch_ncrna", group,
+                [python_command("fetch_ncrna_data.py", "--query", group, "--output", staged_file),
+                 python_command("cleanup_txt_data.py", "--input", staged_file, "--no-hyphen", "keep")],
+                ncrna_scripts, [gene_file],
+                {"group": group, "no_hyphen": "keep"}, promote={staged_file: gene_file}))
+
+        for track in tracks:
+            scores_csv, summary_csv = (template.format(group=group) for template in track_files[track])
+            nodes.append(make_node(
+                "fetch_conservation", f"{track}:{group}",
+                [python_command("fetch_conservation_data.py", "--group", group, "--track", track)],
+                ["bin/fetch_conservation_data.py", "bin/interval_index.py"] + bigwig_scripts
+                + [gene_file, track_bigwigs[track]], [scores_csv],
+                {"group": group, "track": track}))
+            nodes.append(make_node(
+                "summarise_conservation", f"{track}:{group}",
+                [python_command("summarise_conservation.py", "--group", group, "--track", track)],
+                ["bin/summarise_conservation.py", "bin/instrumentation.py", scores_csv], [summary_csv],
+                {"group": group, "track": track}))
+
+        gtex_csv = f"data/GTEX-expr_summary/{group}_expr.csv"
+        nodes.append(make_node(
+            "fetch_expression", group,
+            [python_command("fetch_expression_data.py", "--group", group, "--output", gtex_csv)],
+            ["bin/fetch_expression_data.py"] + bigwig_scripts + [gene_file] + gtex_bigwigs, [gtex_csv],
+            {"group": group}))
+        nodes.append(make_node(
+            "fetch_encode", group,
+            [python_command("fetch_ENCODE_expr.py", "--groups", group)],
+            ["bin/fetch_ENCODE_expr.py", "bin/instrumentation.py", gene_file, encode_tsv], [f"data/ENCODE-expr_summary/{group}_expr.csv"],
+            {"group": group}))
+
+    # The combined table is built from every gene group, so it always reads all of them
+    feature_files = [os.path.join("data", template.format(group=group))
+                     for group in gene_groups for template, _, _ in feature_sources]
+    nodes.append(make_node(
+        "assemble_features", None, [python_command("assemble_features.py")],
+        ["bin/assemble_features.py", "bin/instrumentation.py"] + feature_files, ["results/combined_gene_data.csv"], {}))
+
+    model_scripts = ["bin/random_forest_genes.py", "bin/assemble_features.py", "bin/render_figures.py",
+                     "bin/figure_names.py", "bin/model_engines.py", "bin/model_evaluation.py", "bin/model_store.py",
+                     "bin/instrumentation.py"]
+    nodes.append(make_node(
+        "random_forest", None, [python_command("random_forest_genes.py", "run", "--render", "--figure-dir", "results")],
+        model_scripts + ["results/combined_gene_data.csv"],
+        ["results/ambiguous_gene_predictions.csv"] + [f"results/{name}.png" for name in figure_names.values()],
+        {"figure_dir": "results", "formats": ["png"]}))
+    return nodes
+
+
+# Function to link every node to the nodes writing its inputs and sort the nodes topologically
+def link_nodes(nodes):
+    producers = {}
+    for node in nodes:
+        for path in node["outputs"]:
+            if path in producers:
+                raise ValueError(f"'{path}' is written by both {producers[path]} and {node['id']}")
+            producers[path] = node["id"]
+    for node in nodes:
+        node["deps"] = sorted({producers[path] for path in node["inputs"] if path in producers})
+
+    by_id = {node["id"]: node for node in nodes}
+    ordered, visiting, visited = [], set(), set()
+
+    def visit(node_id):
+        if node_id in visited:
+            return
+        if node_id in visiting:
+            raise ValueError(f"Cycle in the pipeline at {node_id}")
+        visiting.add(node_id)
+        for dep in by_id[node_id]["deps"]:
+            visit(dep)
+        visiting.discard(node_id)
+        visited.add(node_id)
+        ordered.append(by_id[node_id])
+
+    for node in nodes:
+        visit(node["id"])
+    return ordered
+
+
+# Function to select the target nodes and every node upstream of them
+# With --groups or --tracks, nodes covering all groups or tracks are only targets when their stage is named
+def select_nodes(nodes, stages=None, groups=None, tracks=None):
+    by_id = {node["id"]: node for node in nodes}
+
+    def matches(node, key, values):
+        if not values:
+            return True
+        if key in node["params"]:
+            return node["params"][key] in values
+        return bool(stages)
+
+    targets = {node["id"] for node in nodes
+               if (not stages or node["stage"] in stages)
+               and matches(node, "group", groups) and matches(node, "track", tracks)}
+    selected, stack = set(), list(targets)
+    while stack:
+        node_id = stack.pop()
+        if node_id not in selected:
+            selected.add(node_id)
+            stack.extend(by_id[node_id]["deps"])
+    return [node for node in nodes if node["id"] in selected], targets
+
+
+# Function to load the recorded state (node records and the file hash cache)
+def load_state(path=state_file):
+    if not os.path.isfile(path):
+        return {"nodes": {}, "hash_cache": {}}
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def save_state(state, path=state_file):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as file:
+        json.dump(state, file, indent=1, sort_keys=True)
+    os.replace(temp_path, path)
+
+
+# Function to get the SHA-256 content hash of a file (None if it does not exist)
+# Hashes are cached by size and modification time, so large BigWig files are only read again when they change
+def file_hash(path, hash_cache):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    cached = hash_cache.get(path)
+    if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+        return cached[2]
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    hash_cache[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+    return digest.hexdigest()
+
+
+def hash_files(paths, hash_cache):
+    return {path: file_hash(path, hash_cache) for path in paths}
+
+
+# Function to decide whether a node must run, returns the reason or None when it is up to date
+def stale_reason(node, state):
+    record = state["nodes"].get(node["id"])
+    hash_cache = state["hash_cache"]
+    missing = [path for path in node["outputs"] if not os.path.isfile(path)]
+    if missing:
+        return f"missing output {missing[0]}"
+    if record is None:
+        return "no record of a previous run"
+    if record["commands"] != node["commands"] or record["params"] != node["params"]:
+        return "command or parameters changed"
+    for path, digest in hash_files(node["inputs"], hash_cache).items():
+        if record["inputs"].get(path) != digest:
+            return f"input changed: {path}"
+    for path, digest in hash_files(node["outputs"], hash_cache).items():
+        if record["outputs"].get(path) != digest:
+            return f"output modified: {path}"
+    return None
+
+
+# Function to record a node as up to date with the current content of its inputs and outputs
+def record_node(node, state, runtime=None):
+    state["nodes"][node["id"]] = {
+        "commands": node["commands"],
+        "params": node["params"],
+        "inputs": hash_files(node["inputs"], state["hash_cache"]),
+        "outputs": hash_files(node["outputs"], state["hash_cache"]),
+        "finished": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "runtime_s": runtime,
+    }
+
+
+# Function run in a worker thread: run the commands of one node, logging their output
+def run_node(node):
+    os.makedirs(log_dir, exist_ok=True)
+    for staged_path in node["promote"]:
+        os.makedirs(os.path.dirname(staged_path), exist_ok=True)
+    log_path = os.path.join(log_dir, f"{node['id'].replace(':', '_')}.log")
+    start = time.perf_counter()
+    with open(log_path, "w") as log:
+        for command in node["commands"]:
+            log.write(f"$ {' '.join(command)}\n")
+            log.flush()
+            returncode = subprocess.run(command, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT).returncode
+            if returncode != 0:
+                return False, f"exit code {returncode}, see {log_path}", time.perf_counter() - start
+    for staged_path, path in node["promote"].items():
+        if not os.path.isfile(staged_path):
+            return False, f"output not written: {staged_path}, see {log_path}", time.perf_counter() - start
+        os.replace(staged_path, path)
+    missing = [path for path in node["outputs"] if not os.path.isfile(path)]
+    if missing:
+        return False, f"output not written: {missing[0]}, see {log_path}", time.perf_counter() - start
+    return True, None, time.perf_counter() - start
+
+
+# Function to show what would run, assuming every stale node changes its outputs
+def dry_run(nodes, state, forced):
+    will_run = set()
+    for node in nodes:
+        reason = "forced" if node["id"] in forced else stale_reason(node, state)
+        if reason is None:
+            upstream = [dep for dep in node["deps"] if dep in will_run]
+            if upstream:
+                reason = f"upstream {upstream[0]} will run"
+        if reason is None:
+            print(f"  up to date  {node['id']}")
+            continue
+        missing_inputs = [path for path in node["inputs"] if not os.path.isfile(path)
+                          and not any(path in other["outputs"] for other in nodes if other["id"] in will_run)]
+        if missing_inputs:
+            # Would fail, and the nodes below it keep their current outputs
+            print(f"  blocked     {node['id']}  ({reason}, missing input {missing_inputs[0]})")
+            continue
+        will_run.add(node["id"])
+        print(f"  would run   {node['id']}  ({reason})")
+    print(f"{len(will_run)} of {len(nodes)} nodes would run")
+
+
+# Function to run the stale nodes in dependency order, independent nodes in parallel
+def execute(nodes, state, forced, jobs):
+    status = {}
+    pending = list(nodes)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            for node in list(pending):
+                if any(dep not in status or dep in running for dep in node["deps"]):
+                    continue
+                pending.remove(node)
+                # Checked once the upstream nodes have finished, so unchanged upstream outputs do not trigger a rerun
+                reason = "forced" if node["id"] in forced else stale_reason(node, state)
+                if reason is None:
+                    # Also when an upstream node failed, its outputs are only replaced on success
+                    status[node["id"]] = "up to date"
+                    continue
+                failed = [dep for dep in node["deps"] if status[dep] in ("failed", "skipped")]
+                if failed:
+                    status[node["id"]] = "skipped"
+                    print(f"  skipped     {node['id']}  (upstream {failed[0]} failed)")
+                    continue
+                missing_inputs = [path for path in node["inputs"] if not os.path.isfile(path)]
+                if missing_inputs:
+                    status[node["id"]] = "failed"
+                    print(f"  failed      {node['id']}  (missing input {missing_inputs[0]})")
+                    continue
+                print(f"  running     {node['id']}  ({reason})")
+                status[node["id"]] = "running"
+                running[node["id"]] = (pool.submit(run_node, node), node)
+
+            if not running:
+                continue
+            finished, _ = wait([future for future, _ in running.values()], return_when=FIRST_COMPLETED)
+            for node_id, (future, node) in list(running.items()):
+                if future not in finished:
+                    continue
+                del running[node_id]
+                ok, error, runtime = future.result()
+                observe("node", runtime, stage=node["stage"])
+                if ok:
+                    status[node_id] = "done"
+                    record_node(node, state, runtime)
+                    save_state(state)
+                    print(f"  done        {node_id}  ({runtime:.1f}s)")
+                else:
+                    status[node_id] = "failed"
+                    print(f"  failed      {node_id}  ({error})")
+
+    counts = {name: list(status.values()).count(name) for name in ["done", "up to date", "failed", "skipped"]}
+    for name, node_count in counts.items():
+        count("nodes", node_count, status=name.replace(" ", "_"))
+    print(", ".join(f"{count} {name}" for name, count in counts.items()))
+    return counts["failed"] == 0 and counts["skipped"] == 0
+
+
+# Main Execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the workflow as a DAG, rebuilding only stale nodes.")
+    parser.add_argument("--stages", nargs="+", choices=stage_names,
+                        help="Target stages (their upstream nodes are included). Default: all.")
+    parser.add_argument("--groups", nargs="+", choices=gene_groups, help="Restrict to these gene groups.")
+    parser.add_argument("--tracks", nargs="+", choices=list(track_files), help="Restrict to these conservation tracks.")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Nodes run in parallel (default: all cores).")
+    parser.add_argument("--dry-run", action="store_true", help="Show which nodes would run and why, without running.")
+    parser.add_argument("--force", action="store_true", help="Rerun the target nodes even if they are up to date.")
+    parser.add_argument("--adopt", action="store_true",
+                        help="Record the existing outputs of the target nodes as up to date without running them.")
+    parser.add_argument("--rebuild-loci", action="store_true",
+                        help="Also rebuild the locus files data/<group>_data.txt from a live HGNC query (except "
+                             f"{', '.join(curated_locus_groups)}). They are written under {loci_staging_dir} and only "
+                             "replace the files in data/ when the lookup and cleanup succeed. Default: the locus "
+                             "files are source inputs.")
+    args = parser.parse_args()
+    start_run("pipeline")
+
+    nodes = link_nodes(build_nodes(rebuild_loci=args.rebuild_loci))
+    nodes, targets = select_nodes(nodes, args.stages, args.groups, args.tracks)
+    state = load_state()
+    forced = targets if args.force else set()
+
+    if args.adopt:
+        adopted = [node for node in nodes if node["id"] in targets and all(map(os.path.isfile, node["outputs"]))]
+        for node in adopted:
+            record_node(node, state)
+        save_state(state)
+        print(f"Recorded {len(adopted)} of {len(targets)} target nodes as up to date")
+    elif args.dry_run:
+        dry_run(nodes, state, forced)
+    elif not execute(nodes, state, forced, args.jobs):
+        sys.exit(1)
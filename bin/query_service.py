@@ -0,0 +1,308 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+import pandas as pd
+from instrumentation import start_run, count, timer, log_event
+from assemble_features import gene_groups, feature_columns, feature_frame, output_csv as combined_csv
+from summarise_conservation import track_files
+from interval_index import read_all_loci, build_index, overlapping
+
+# Local read-only HTTP query service over the assembled gene features
+# Loads the combined table (with the functional probability of the saved model, when there is one), the loci, the
+# GTEx and ENCODE summaries and the per-position conservation scores into memory, and answers JSON queries:
+#   /health                                        store version, load time and sources
+#   /genes/<gene>                                  features, probability, loci, expression and conservation summary
+#   /groups/<group>                                every gene of a gene group
+#   /region?chrom=chr1&start=1000&end=2000         genes whose loci overlap a 1-based inclusive range
+#   /functional?min_probability=0.5[&group=RNU6]   genes at or above a functional probability
+#   /conservation/<gene>?track=phyloP100           per-position scores of a gene
+# The per-position scores are converted once to .npy arrays in results/query_store/ (rebuilt when the CSV changes)
+# and memory-mapped, so they take no RAM until read. The sources are polled and the whole store is rebuilt and
+# swapped in when the pipeline writes new outputs; queries keep using the previous store until then
+
+host = "127.0.0.1"
+port = 8765
+store_dir = "results/query_store"
+model_dir = "results/model"
+poll_interval = 5.0
+
+expression_files = {"GTEX": "data/GTEX-expr_summary/{group}_expr.csv",
+                    "ENCODE": "data/ENCODE-expr_summary/{group}_expr.csv"}
+
+# The current store; a reload replaces the whole dictionary, so each request sees one consistent version
+_store = None
+
+
+# Function to list the files the store is built from (missing files are skipped)
+def source_files():
+    paths = [combined_csv, os.path.join(model_dir, "model.joblib"), os.path.join(model_dir, "model_metadata.json")]
+    for gene_group in gene_groups:
+        paths.append(f"data/{gene_group}_data.txt")
+        paths.extend(template.format(group=gene_group) for template in expression_files.values())
+        paths.extend(scores_template.format(group=gene_group) for scores_template, _ in track_files.values())
+    return [path for path in paths if os.path.isfile(path)]
+
+
+# Function to get the modification time and size of every source file, compared between polls
+def source_signature():
+    signature = {}
+    for path in source_files():
+        stat = os.stat(path)
+        signature[path] = (stat.st_mtime_ns, stat.st_size)
+    return signature
+
+
+# Function to convert one per-position conservation CSV to memory-mappable arrays, unless they are up to date
+# Writes {track}_{group}_scores.npy, {track}_{group}_positions.npy and {track}_{group}_index.json (gene -> chrom and
+# row range); rows of a gene are contiguous in the CSV, as fetch_conservation_data.py writes them
+def build_conservation_arrays(track, gene_group, scores_csv):
+    prefix = os.path.join(store_dir, f"{track}_{gene_group}")
+    index_path = f"{prefix}_index.json"
+    if os.path.isfile(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(scores_csv):
+        return prefix
+    with timer("stage", step="conservation_arrays"):
+        scores = pd.read_csv(scores_csv, dtype={"Gene": str, "Chromosome": str, "Position": np.int64,
+                                                "Score": np.float32})
+        genes = scores["Gene"].to_numpy()
+        starts = np.flatnonzero(np.r_[True, genes[1:] != genes[:-1]])
+        stops = np.r_[starts[1:], len(genes)]
+        index = {}
+        for start, stop in zip(starts, stops):
+            index.setdefault(genes[start], [str(scores["Chromosome"].iat[start]), int(start), int(stop)])
+        os.makedirs(store_dir, exist_ok=True)
+        # Written to new files and renamed: the previous store may still have the old ones memory-mapped
+        for name, values in [("scores", scores["Score"]), ("positions", scores["Position"])]:
+            with open(f"{prefix}_{name}.npy.tmp", "wb") as file:
+                np.save(file, values.to_numpy())
+            os.replace(f"{prefix}_{name}.npy.tmp", f"{prefix}_{name}.npy")
+        # The index is written last, so an interrupted conversion is redone on the next load
+        with open(f"{index_path}.tmp", "w") as file:
+            json.dump(index, file)
+        os.replace(f"{index_path}.tmp", index_path)
+    count("query_store.arrays_built", track=track)
+    return prefix
+
+
+# Function to compute the functional probability of every gene with the saved model (None if there is no model)
+def functional_probabilities(genes):
+    from model_store import load_model
+    try:
+        model, metadata = load_model(model_dir, n_jobs=1)
+    except FileNotFoundError:
+        return None, None
+    probabilities = model.predict_proba(feature_frame(genes, metadata["features"]).to_numpy())[:, 1]
+    return probabilities, metadata.get("created")
+
+
+# Function to load everything the queries need into one store dictionary
+def load_store():
+    start = time.perf_counter()
+    signature = source_signature()
+    genes = pd.read_csv(combined_csv, na_values="NA").drop_duplicates("Gene").set_index("Gene", drop=False)
+    probabilities, model_created = functional_probabilities(genes)
+    genes["functional_probability"] = probabilities if probabilities is not None else np.nan
+
+    loci = read_all_loci()
+    locus_index = build_index(loci["Chromosome"], loci["Start"], loci["End"])
+
+    expression = {}
+    for source, template in expression_files.items():
+        frames = [pd.read_csv(template.format(group=gene_group)).assign(Gene_group=gene_group)
+                  for gene_group in gene_groups if os.path.isfile(template.format(group=gene_group))]
+        if frames:
+            expression[source] = pd.concat(frames, ignore_index=True).drop_duplicates("Gene").set_index("Gene")
+
+    conservation = {}
+    for track, (scores_template, _) in track_files.items():
+        for gene_group in gene_groups:
+            scores_csv = scores_template.format(group=gene_group)
+            if not os.path.isfile(scores_csv):
+                continue
+            prefix = build_conservation_arrays(track, gene_group, scores_csv)
+            with open(f"{prefix}_index.json") as file:
+                index = json.load(file)
+            arrays = {"scores": np.load(f"{prefix}_scores.npy", mmap_mode="r"),
+                      "positions": np.load(f"{prefix}_positions.npy", mmap_mode="r")}
+            for gene, (chrom, first, last) in index.items():
+                conservation.setdefault(track, {})[gene] = (arrays, chrom, first, last)
+
+    elapsed = time.perf_counter() - start
+    version = (_store["version"] + 1) if _store else 1
+    log_event("store_loaded", logging.INFO, version=version, genes=len(genes), elapsed_s=round(elapsed, 3))
+    return {"version": version, "loaded_at": time.strftime("%Y-%m-%d %H:%M:%S"), "load_s": round(elapsed, 3),
+            "signature": signature, "genes": genes, "loci": loci, "locus_index": locus_index,
+            "expression": expression, "conservation": conservation, "model_created": model_created}
+
+
+# Function to poll the sources and swap in a rebuilt store when they change (a failed rebuild keeps the old store)
+def watch_sources(interval):
+    global _store
+    while True:
+        time.sleep(interval)
+        try:
+            if source_signature() == _store["signature"]:
+                continue
+            store = load_store()
+        except Exception as e:
+            count("query_store.reload_errors")
+            log_event("store_reload_failed", logging.WARNING, error=str(e))
+            continue
+        _store = store
+        count("query_store.reloads")
+        print(f"Reloaded the store (version {store['version']}) in {store['load_s']}s")
+
+
+# Function to turn a gene table into JSON records (missing values as null)
+def records(frame):
+    return json.loads(frame.to_json(orient="records"))
+
+
+# Function to summarise the conservation scores of one gene and track
+def conservation_summary(entry):
+    arrays, chrom, first, last = entry
+    scores = np.asarray(arrays["scores"][first:last])
+    return {"positions": last - first, "median": float(np.nanmedian(scores)) if len(scores) else None,
+            "max": float(np.nanmax(scores)) if len(scores) else None}
+
+
+# Query handlers: each takes the store, the path parts after the endpoint and the query parameters and returns
+# (status, body)
+def query_gene(store, parts, params):
+    if len(parts) != 1 or parts[0] not in store["genes"].index:
+        return 404, {"error": f"unknown gene '{parts[0] if parts else ''}'"}
+    gene = parts[0]
+    body = records(store["genes"].loc[[gene]])[0]
+    body["loci"] = records(store["loci"].loc[store["loci"]["Gene"] == gene,
+                                             ["Transcript", "Chromosome", "Start", "End"]])
+    body["expression"] = {source: records(table.loc[[gene]].drop(columns="Gene_group"))[0]
+                          for source, table in store["expression"].items() if gene in table.index}
+    body["conservation"] = {track: conservation_summary(genes[gene])
+                            for track, genes in store["conservation"].items() if gene in genes}
+    return 200, body
+
+
+def query_group(store, parts, params):
+    if len(parts) != 1 or parts[0] not in gene_groups:
+        return 404, {"error": f"unknown gene group '{parts[0] if parts else ''}'", "gene_groups": gene_groups}
+    genes = store["genes"]
+    return 200, records(genes[genes["Gene_group"] == parts[0]])
+
+
+def query_region(store, parts, params):
+    try:
+        chrom = params["chrom"][0]
+        start, end = int(params["start"][0]), int(params["end"][0])
+    except (KeyError, ValueError):
+        return 400, {"error": "region queries need chrom, start and end (1-based inclusive)"}
+    if not chrom.startswith("chr"):
+        chrom = f"chr{chrom}"
+    loci = store["loci"].iloc[np.sort(overlapping(store["locus_index"], chrom, start - 1, end))]
+    genes = store["genes"][["Gene"] + feature_columns + ["Gene_Type", "Gene_group", "functional_probability"]]
+    matches = loci[["Gene", "Transcript", "Chromosome", "Start", "End"]].merge(genes.reset_index(drop=True),
+                                                                               on="Gene", how="left")
+    return 200, records(matches)
+
+
+def query_functional(store, parts, params):
+    try:
+        threshold = float(params.get("min_probability", ["0.5"])[0])
+    except ValueError:
+        return 400, {"error": "min_probability must be a number"}
+    genes = store["genes"]
+    if genes["functional_probability"].isna().all():
+        return 503, {"error": f"no saved model in '{model_dir}', run 'random_forest_genes.py train' first"}
+    selected = genes[genes["functional_probability"] >= threshold]
+    if "group" in params:
+        selected = selected[selected["Gene_group"] == params["group"][0]]
+    return 200, records(selected.sort_values("functional_probability", ascending=False))
+
+
+def query_conservation(store, parts, params):
+    track = params.get("track", ["phyloP100"])[0]
+    genes = store["conservation"].get(track)
+    if genes is None:
+        return 404, {"error": f"unknown track '{track}'", "tracks": sorted(store["conservation"])}
+    if len(parts) != 1 or parts[0] not in genes:
+        return 404, {"error": f"no {track} scores for gene '{parts[0] if parts else ''}'"}
+    arrays, chrom, first, last = genes[parts[0]]
+    return 200, {"gene": parts[0], "track": track, "chrom": chrom,
+                 "positions": arrays["positions"][first:last].tolist(),
+                 "scores": records(pd.Series(arrays["scores"][first:last]).round(4))}
+
+
+def query_health(store, parts, params):
+    return 200, {"version": store["version"], "loaded_at": store["loaded_at"], "load_s": store["load_s"],
+                 "genes": len(store["genes"]), "loci": len(store["loci"]), "model_created": store["model_created"],
+                 "conservation_tracks": sorted(store["conservation"]), "sources": len(store["signature"])}
+
+
+endpoints = {"health": query_health, "genes": query_gene, "groups": query_group, "region": query_region,
+             "functional": query_functional, "conservation": query_conservation}
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [unquote(part) for part in url.path.strip("/").split("/") if part]
+        endpoint = parts[0] if parts else "health"
+        handler = endpoints.get(endpoint)
+        store = _store
+        with timer("query.request", endpoint=endpoint if handler else "unknown"):
+            if handler is None:
+                status, body = 404, {"error": f"unknown endpoint '/{endpoint}'", "endpoints": sorted(endpoints)}
+            else:
+                try:
+                    status, body = handler(store, parts[1:], parse_qs(url.query))
+                except Exception as e:
+                    log_event("query_failed", logging.ERROR, path=self.path, error=repr(e))
+                    status, body = 500, {"error": f"query failed: {e}"}
+            payload = json.dumps(body).encode()
+        count("query.requests", endpoint=endpoint if handler else "unknown", status=status)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("X-Store-Version", str(store["version"]))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Main Execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local read-only HTTP query service over the gene feature store.")
+    parser.add_argument("--host", default=host, help=f"Address to listen on (default: {host}).")
+    parser.add_argument("--port", type=int, default=port, help=f"Port to listen on (default: {port}).")
+    parser.add_argument("--model-dir", default=model_dir,
+                        help=f"Saved model used for the probabilities (default: {model_dir}).")
+    parser.add_argument("--poll", type=float, default=poll_interval,
+                        help=f"Seconds between checks for new outputs, 0 to disable (default: {poll_interval}).")
+    args = parser.parse_args()
+    model_dir = args.model_dir
+    start_run("query_service")
+
+    try:
+        _store = load_store()
+    except (FileNotFoundError, ValueError) as e:
+        sys.exit(f"Error loading the feature store: {e}")
+    print(f"Loaded {len(_store['genes'])} genes and {len(_store['loci'])} loci in {_store['load_s']}s"
+          + ("" if _store["model_created"] else f" (no saved model in {model_dir}, probabilities are empty)"))
+    if args.poll > 0:
+        threading.Thread(target=watch_sources, args=(args.poll,), daemon=True).start()
+
+    server = ThreadingHTTPServer((args.host, args.port), QueryHandler)
+    print(f"Serving on http://{args.host}:{args.port}/ (endpoints: {', '.join(sorted(endpoints))})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -1,16 +1,17 @@
+import sys
+import argparse
+import time
 import pandas as pd
 import numpy as np
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report, roc_auc_score
-import matplotlib.pyplot as plt
-import seaborn as sns
+from assemble_features import load_combined_table, feature_frame
+from model_engines import engine_names
+from instrumentation import start_run, timer
 
-# Load the dataset
-data = pd.read_csv('results/combined_gene_data.csv')
-
-# Extract relevant features and labels
-data['label'] = data['Gene_Type'].apply(lambda x: 1 if x == 'Functional' else 0)
+# Features used by the model
+features = ['PhyloP100_median', 'ENCODE_max']
 
 # List of ambiguous genes (assuming you have them defined)
 # You can modify this to use any criteria you have for ambiguous genes
@@ -25,151 +26,320 @@ ambiguous_genes = ['RNU6-1189P', 'RNU6-82P', 'RNU2-2P', 'RNU1-27P', 'RNU1-28P',
                     'TRK-CTT6-1', 'TRE-CTC11-1', 'TRE-CTC9-1', 'TRE-TTC4-2', 'TRG-CCC4-1', 'TRN-GTT2-7', 'TRV-AAC1-3', 'TRN-GTT2-8', 'TRV-CAC8-1', 'TRG-GCC1-4', 
                     'TRG-TCC4-1', 'TRL-CAG1-3', 'TRK-TTT2-1', 'TRA-AGC9-1', 'TRL-CAA5-1', 'TRK-CTT7-1', 'TRY-ATA1-1', 'TRK-CTT5-1', 'TRR-CCT8-1']
 
-# Step 1: Exclude ambiguous genes from the dataset
-data_non_ambiguous = data[~data['Gene'].isin(ambiguous_genes)]
-
-# Diagnostics: Print number of functional and pseudogenes in the full dataset
-print("Total counts in full dataset:")
-print(f"Functional Genes: {data[data['label'] == 1].shape[0]}")
-print(f"Pseudogenes: {data[data['label'] == 0].shape[0]}")
-
-# Step 2: Split the non-ambiguous data into training and test sets (90% training, 10% testing)
-X = data_non_ambiguous[['PhyloP100_median', 'ENCODE_max']]  # Features
-y = data_non_ambiguous['label']  # Labels
-
-# Randomly split into 90% training and 10% test
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.1, random_state=42)
-
-# Diagnostics: Print the number of functional and pseudogenes in the training and test sets
-print("\nTraining Set Counts:")
-print(f"Functional Genes: {y_train.sum()}")
-print(f"Pseudogenes: {len(y_train) - y_train.sum()}")
-
-print("\nTest Set Counts:")
-print(f"Functional Genes: {y_test.sum()}")
-print(f"Pseudogenes: {len(y_test) - y_test.sum()}")
-
-# Step 3: Initialize the Random Forest Classifier and train the model
-model = RandomForestClassifier(n_estimators=100, random_state=42)
-print("\nTraining the Random Forest model...")
-model.fit(X_train, y_train)
-
-# Step 4: Evaluate the model on the test set
-print("\nEvaluating the model on the test set...")
-test_predictions = model.predict(X_test)
-test_probs = model.predict_proba(X_test)[:, 1]  # Probabilities for functional genes
-
-# Print the classification report and ROC AUC score for the test set
-print("\nTest Classification Report:")
-print(classification_report(y_test, test_predictions))
-print(f"Test ROC AUC Score: {roc_auc_score(y_test, test_probs):.2f}")
-
-# Step 5: Predict on ambiguous genes
-# Select ambiguous genes from the original dataset
-ambiguous_data = data[data['Gene'].isin(ambiguous_genes)]
-
-# Diagnostics: Check if ambiguous data is empty
-if ambiguous_data.empty:
-    print("\nNo ambiguous genes found in the dataset.")
-else:
-    # Print the number of functional and pseudogenes in ambiguous genes
-    print("\nAmbiguous Genes Counts:")
-    print(f"Functional Genes: {ambiguous_data[ambiguous_data['label'] == 1].shape[0]}")
-    print(f"Pseudogenes: {ambiguous_data[ambiguous_data['label'] == 0].shape[0]}")
-
-    # Predict probabilities for ambiguous genes
-    print("\nPredicting probabilities for ambiguous genes...")
-    X_ambiguous = ambiguous_data[['PhyloP100_median', 'ENCODE_max']]
-    ambiguous_probs = model.predict_proba(X_ambiguous)[:, 1]
-
-    # Add the predicted probabilities to the ambiguous data
-    ambiguous_data['functional_probability'] = ambiguous_probs
-
-    # Save the ambiguous gene predictions to a CSV file
-    ambiguous_data[['Gene', 'functional_probability']].to_csv('results/ambiguous_gene_predictions.csv', index=False)
-
-    # Optionally, print ambiguous gene predictions for review
-    print("\nPredictions for ambiguous genes:")
-    print(ambiguous_data[['Gene', 'functional_probability']])
-
-# Step 6: Add the predicted probabilities for all genes in the full dataset
-print("\nAdding predicted probabilities for all genes in the full dataset...")
-data['functional_probability'] = model.predict_proba(data[['PhyloP100_median', 'ENCODE_max']])[:, 1]
-
-
-# Visualizations for Test Data Distribution
-
-# Predicted probabilities for test data
-test_functional_probs = test_probs[y_test == 1]  # Probabilities for true functional genes
-test_pseudogene_probs = test_probs[y_test == 0]  # Probabilities for true pseudogenes
-
-# Set font to Times New Roman
-plt.rcParams['font.family'] = 'DejaVu Serif'
-# Set global font size for everything in the plot
-plt.rcParams.update({'font.size': 28,  # Global font size for all text
-                     'axes.labelsize': 28,  # Axis labels font size
-                     'xtick.labelsize': 28,  # X-axis tick label font size
-                     'ytick.labelsize': 28,  # Y-axis tick label font size
-                     'legend.fontsize': 22,  # Legend font size
-                     'figure.titlesize': 28})  # Global figure title font size
-
-# Create the histogram for test data probabilities
-plt.figure(figsize=(10, 6))
-sns.histplot(test_functional_probs, bins=20, color='firebrick', alpha=0.7, label='Functional Genes')
-sns.histplot(test_pseudogene_probs, bins=20, color='cornflowerblue', alpha=0.7, label='Pseudogenes')
-
-# Add titles and labels
-plt.xlabel('Probability of Being Functional')
-plt.ylabel('Frequency')
-plt.legend(title='Gene Type')
-plt.grid(axis='y', linestyle='--', alpha=0.7)
-
-# Show the plot
-plt.tight_layout()
-plt.show()
-
-# Predicted probabilities for training data
-train_probs = model.predict_proba(X_train)[:, 1]
-train_functional_probs = train_probs[y_train == 1]
-train_pseudogene_probs = train_probs[y_train == 0]
-
-# Overlay training data distributions
-plt.figure(figsize=(10, 6))
-sns.histplot(test_functional_probs, bins=20, color='firebrick', alpha=0.7, label='Test Functional Genes')
-sns.histplot(test_pseudogene_probs, bins=20, color='cornflowerblue', alpha=0.7, label='Test Pseudogenes')
-sns.histplot(train_functional_probs, bins=20, color='lightpink', alpha=0.5, label='Train Functional Genes', linestyle='--')
-sns.histplot(train_pseudogene_probs, bins=20, color='lightblue', alpha=0.5, label='Train Pseudogenes', linestyle='--')
-
-# Add titles and labels
-plt.xlabel('Probability of Being Functional')
-plt.ylabel('Frequency')
-plt.legend(title='Gene Type')
-plt.grid(axis='y', linestyle='--', alpha=0.7)
-
-# Show the plot
-plt.tight_layout()
-plt.show()
-
-
-# Scatter plot of ambiguous gene probabilities
-plt.figure(figsize=(10, 6))
-
-# Filter out ambiguous data
-ambiguous_data = data[data['Gene'].isin(ambiguous_genes)]
-
-# Scatter plot for ambiguous genes
-plt.scatter(ambiguous_data['PhyloP100_median'], ambiguous_data['ENCODE_max'], 
-            c=ambiguous_data['functional_probability'], cmap='coolwarm', s=100, edgecolors='black')
-
-
-# Add titles and labels
-plt.xlabel('PhyloP100 Median')
-plt.ylabel('ENCODE Max')
-plt.colorbar(label='Functional Probability')
-
-# Disable grid for better clarity
-plt.grid(False)
-
-# Show the plot
-plt.tight_layout()
-plt.show()
\ No newline at end of file
+
+# Function to assemble the dataset in-process (also rewrites results/combined_gene_data.csv for the R scripts,
+# unless write_csv is False)
+def load_data(write_csv=True):
+    with timer("stage", step="load_data"):
+        data = load_combined_table(write_csv=write_csv)
+
+    # Extract relevant features and labels
+    data['label'] = (data['Gene_Type'] == 'Functional').astype(np.int8)
+    return data
+
+
+# Function to train on a single 90/10 split, score the ambiguous genes and plot the probability distributions
+def run_model(data, render=None):
+    # Step 1: Exclude ambiguous genes from the dataset
+    data_non_ambiguous = data[~data['Gene'].isin(ambiguous_genes)]
+
+    # Diagnostics: Print number of functional and pseudogenes in the full dataset
+    print("Total counts in full dataset:")
+    print(f"Functional Genes: {data[data['label'] == 1].shape[0]}")
+    print(f"Pseudogenes: {data[data['label'] == 0].shape[0]}")
+
+    # Step 2: Split the non-ambiguous data into training and test sets (90% training, 10% testing)
+    X = feature_frame(data_non_ambiguous, features)  # Features
+    y = data_non_ambiguous['label']  # Labels
+
+    # Randomly split into 90% training and 10% test
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.1, random_state=42)
+
+    # Diagnostics: Print the number of functional and pseudogenes in the training and test sets
+    print("\nTraining Set Counts:")
+    print(f"Functional Genes: {y_train.sum()}")
+    print(f"Pseudogenes: {len(y_train) - y_train.sum()}")
+
+    print("\nTest Set Counts:")
+    print(f"Functional Genes: {y_test.sum()}")
+    print(f"Pseudogenes: {len(y_test) - y_test.sum()}")
+
+    # Step 3: Initialize the Random Forest Classifier and train the model
+    model = RandomForestClassifier(n_estimators=100, random_state=42)
+    print("\nTraining the Random Forest model...")
+    with timer("stage", step="fit"):
+        model.fit(X_train, y_train)
+
+    # Step 4: Evaluate the model on the test set
+    print("\nEvaluating the model on the test set...")
+    with timer("stage", step="predict"):
+        test_predictions = model.predict(X_test)
+        test_probs = model.predict_proba(X_test)[:, 1]  # Probabilities for functional genes
+
+    # Print the classification report and ROC AUC score for the test set
+    print("\nTest Classification Report:")
+    print(classification_report(y_test, test_predictions))
+    print(f"Test ROC AUC Score: {roc_auc_score(y_test, test_probs):.2f}")
+
+    # Step 5: Predict on ambiguous genes
+    # Select ambiguous genes from the original dataset
+    ambiguous_data = data[data['Gene'].isin(ambiguous_genes)].copy()
+
+    # Diagnostics: Check if ambiguous data is empty
+    if ambiguous_data.empty:
+        print("\nNo ambiguous genes found in the dataset.")
+    else:
+        # Print the number of functional and pseudogenes in ambiguous genes
+        print("\nAmbiguous Genes Counts:")
+        print(f"Functional Genes: {ambiguous_data[ambiguous_data['label'] == 1].shape[0]}")
+        print(f"Pseudogenes: {ambiguous_data[ambiguous_data['label'] == 0].shape[0]}")
+
+        # Predict probabilities for ambiguous genes
+        print("\nPredicting probabilities for ambiguous genes...")
+        X_ambiguous = feature_frame(ambiguous_data, features)
+        ambiguous_probs = model.predict_proba(X_ambiguous)[:, 1]
+
+        # Add the predicted probabilities to the ambiguous data
+        ambiguous_data['functional_probability'] = ambiguous_probs
+
+        # Save the ambiguous gene predictions to a CSV file
+        ambiguous_data[['Gene', 'functional_probability']].to_csv('results/ambiguous_gene_predictions.csv', index=False)
+
+        # Optionally, print ambiguous gene predictions for review
+        print("\nPredictions for ambiguous genes:")
+        print(ambiguous_data[['Gene', 'functional_probability']])
+
+    # Step 6: Add the predicted probabilities for all genes in the full dataset
+    print("\nAdding predicted probabilities for all genes in the full dataset...")
+    data['functional_probability'] = model.predict_proba(feature_frame(data, features))[:, 1]
+
+    # Predicted probabilities for training data
+    train_probs = model.predict_proba(X_train)[:, 1]
+
+    plot_results(data, y_train, train_probs, y_test, test_probs, render=render)
+
+
+# Function to plot the test/train probability distributions and the ambiguous gene scatter
+# With 'render' the figures are saved headless (Agg backend, process pool) instead of shown with plt.show()
+def plot_results(data, y_train, train_probs, y_test, test_probs, render=None):
+    from render_figures import build_figure_specs, render_figures, show_figures
+
+    # Filter out ambiguous data
+    ambiguous_data = data[data['Gene'].isin(ambiguous_genes)]
+    specs = build_figure_specs(y_train, train_probs, y_test, test_probs, ambiguous_data)
+
+    if render:
+        render_figures(specs, **render)
+    else:
+        show_figures(specs)
+
+
+# Function to run repeated stratified K-fold with a grid or random search over the forest parameters
+def evaluate_model(data, n_splits=5, n_repeats=3, search='grid', n_iter=20, n_jobs=-1,
+                   output_csv='results/cv_evaluation_results.csv', engine='random_forest'):
+    from model_evaluation import load_or_make_splits, parameter_configs, evaluate_configs, summarise_results
+
+    # Ambiguous genes are never used for training or evaluation
+    data_non_ambiguous = data[~data['Gene'].isin(ambiguous_genes)].reset_index(drop=True)
+    X = feature_frame(data_non_ambiguous, features).to_numpy()
+    y = data_non_ambiguous['label'].to_numpy()
+
+    start = time.perf_counter()
+    fold_ids = load_or_make_splits(data_non_ambiguous['Gene'], y, n_splits=n_splits, n_repeats=n_repeats)
+    split_time = time.perf_counter() - start
+
+    configs = parameter_configs(search, n_iter=n_iter, engine=engine)
+    print(f"\nEvaluating {len(configs)} {engine} configurations with {n_repeats}x repeated {n_splits}-fold "
+          f"stratified cross-validation ({len(configs) * n_repeats * n_splits} fits)...")
+
+    start = time.perf_counter()
+    fold_results = evaluate_configs(X, y, configs, fold_ids, n_jobs=n_jobs, engine=engine)
+    cv_time = time.perf_counter() - start
+
+    summary = summarise_results(fold_results, configs)
+    summary.to_csv(output_csv, index=False)
+
+    pd.set_option('display.width', 200)
+    print("\nCross-validation results (sorted by mean ROC AUC):")
+    print(summary[['auc_mean', 'auc_std', 'auc_min', 'auc_max', 'fit_time_mean', 'predict_time_mean',
+                   'params']].to_string(index=False, float_format='{:.4f}'.format))
+    print(f"\nSplit preparation: {split_time:.3f}s, cross-validation wall time: {cv_time:.2f}s "
+          f"(total fit time {fold_results['fit_time'].sum():.2f}s)")
+    print(f"Results written to {output_csv}")
+    return summary
+
+
+# Function to cross-validate a model on every non-empty subset of the five numerical features
+def sweep_features(data, n_splits=5, n_repeats=3, n_jobs=-1, output_csv='results/feature_subset_sweep.csv'):
+    from assemble_features import feature_columns
+    from model_evaluation import load_or_make_splits, sweep_feature_subsets
+
+    data_non_ambiguous = data[~data['Gene'].isin(ambiguous_genes)].reset_index(drop=True)
+    X = feature_frame(data_non_ambiguous, feature_columns).to_numpy()
+    y = data_non_ambiguous['label'].to_numpy()
+
+    # Same fingerprint as 'evaluate', so the cached folds are shared between the two commands
+    fold_ids = load_or_make_splits(data_non_ambiguous['Gene'], y, n_splits=n_splits, n_repeats=n_repeats)
+
+    n_subsets = 2 ** len(feature_columns) - 1
+    print(f"\nSweeping {n_subsets} feature subsets with {n_repeats}x repeated {n_splits}-fold "
+          f"stratified cross-validation ({n_subsets * n_repeats * n_splits} fits)...")
+    ranking, wall_time = sweep_feature_subsets(X, y, list(feature_columns), fold_ids, n_jobs=n_jobs)
+    ranking.to_csv(output_csv, index=False)
+
+    pd.set_option('display.width', 200)
+    print("\nFeature subsets ranked by mean ROC AUC:")
+    print(ranking[['rank', 'features', 'auc_mean', 'auc_std', 'fit_time_mean', 'runtime_total']]
+          .to_string(index=False, float_format='{:.4f}'.format))
+    print(f"\nSweep wall time: {wall_time:.2f}s")
+    print(f"Results written to {output_csv}")
+    return ranking
+
+
+# Function to train the model on all non-ambiguous genes and save it with its feature list and data fingerprint
+def train_model(data, output_dir='results/model', engine='random_forest'):
+    from model_engines import build_engine
+    from model_store import training_fingerprint, save_model
+
+    data_non_ambiguous = data[~data['Gene'].isin(ambiguous_genes)]
+    # Fitted on a plain float32 array so chunks from any gene table can be scored without column names
+    X = feature_frame(data_non_ambiguous, features).to_numpy()
+    y = data_non_ambiguous['label']
+
+    print(f"\nTraining the {engine} model on {len(y)} genes "
+          f"({y.sum()} functional, {len(y) - y.sum()} pseudogenes)...")
+    model = build_engine(engine, n_jobs=-1)
+    start = time.perf_counter()
+    model.fit(X, y)
+    print(f"Training took {time.perf_counter() - start:.2f}s")
+
+    fingerprint = training_fingerprint(data_non_ambiguous['Gene'], X, y)
+    save_model(model, features, fingerprint, len(y), output_dir, extra_metadata={'engine': engine})
+    print(f"Model saved to {output_dir} (training data fingerprint {fingerprint[:12]})")
+
+
+# Function to score genes with the saved model, without retraining
+# Scores the ambiguous genes by default, a whole gene group with 'group', or any gene table CSV with 'input_csv'
+def score_genes(group=None, input_csv=None, output_csv=None, model_dir='results/model', chunksize=50000):
+    from model_store import load_model, iter_frame_chunks, iter_csv_chunks, score_chunks
+
+    model, metadata = load_model(model_dir)
+    model_features = metadata['features']
+    print(f"Loaded {metadata['model_class']} trained on {metadata['n_train']} genes "
+          f"({metadata['created']}, fingerprint {metadata['training_fingerprint'][:12]})")
+
+    if input_csv:
+        chunks = iter_csv_chunks(input_csv, model_features, chunksize)
+        output_csv = output_csv or 'results/candidate_gene_predictions.csv'
+    else:
+        # Scoring only reads the combined table, so results/combined_gene_data.csv is left as it is
+        data = load_data(write_csv=False)
+        if group:
+            genes = data[data['Gene_group'] == group]
+            if genes.empty:
+                raise ValueError(f"Gene group '{group}' is not in the combined gene table.")
+            output_csv = output_csv or f'results/{group}_gene_predictions.csv'
+        else:
+            genes = data[data['Gene'].isin(ambiguous_genes)]
+            output_csv = output_csv or 'results/ambiguous_gene_scores.csv'
+        chunks = iter_frame_chunks(genes, chunksize)
+
+    score_chunks(model, model_features, chunks, output_csv)
+    print(f"Results written to {output_csv}")
+
+
+# Function to compare the model engines on the combined table and on synthetic upscaled copies of it
+def benchmark_models(data, scales=(1, 10, 100), engines=None, n_jobs=-1,
+                     output_csv='results/model_engine_benchmark.csv'):
+    from model_engines import benchmark_engines
+
+    engines = engines or engine_names
+    data_non_ambiguous = data[~data['Gene'].isin(ambiguous_genes)]
+    X = feature_frame(data_non_ambiguous, features).to_numpy()
+    y = data_non_ambiguous['label'].to_numpy()
+
+    print(f"\nBenchmarking {', '.join(engines)} on {len(y)} genes at scales {', '.join(f'x{scale}' for scale in scales)}...")
+    results = benchmark_engines(X, y, engines=engines, scales=scales, n_jobs=n_jobs)
+    results.to_csv(output_csv, index=False)
+
+    pd.set_option('display.width', 200)
+    print("\nModel engine benchmark:")
+    print(results.to_string(index=False, float_format='{:.4f}'.format))
+    print(f"Results written to {output_csv}")
+    return results
+
+
+# Main Execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Random forest model of functional ncRNA genes vs pseudogenes.")
+    subparsers = parser.add_subparsers(dest='command')
+
+    run_parser = subparsers.add_parser('run', help="Train on a single 90/10 split and score the ambiguous genes (default).")
+    run_parser.add_argument('--render', action='store_true',
+                            help="Save the figures headless (Agg backend) instead of showing them.")
+    run_parser.add_argument('--figure-dir', default='results', help="Directory for rendered figures.")
+    run_parser.add_argument('--formats', nargs='+', default=['png'], help="Figure formats, e.g. png pdf svg.")
+    run_parser.add_argument('--dpi', type=int, default=150, help="Resolution of raster figures.")
+    run_parser.add_argument('--workers', type=int, default=3, help="Processes used to render figures.")
+
+    evaluate_parser = subparsers.add_parser('evaluate', help="Repeated stratified K-fold with a parameter search.")
+    evaluate_parser.add_argument('--folds', type=int, default=5, help="Number of folds (default: 5).")
+    evaluate_parser.add_argument('--repeats', type=int, default=3, help="Number of repeats (default: 3).")
+    evaluate_parser.add_argument('--search', choices=['grid', 'random'], default='grid',
+                                 help="Grid search or random search over the forest parameters.")
+    evaluate_parser.add_argument('--n-iter', type=int, default=20, help="Configurations sampled in random search.")
+    evaluate_parser.add_argument('--n-jobs', type=int, default=-1, help="Number of parallel jobs (default: all cores).")
+    evaluate_parser.add_argument('--output', default='results/cv_evaluation_results.csv', help="Output CSV file.")
+    evaluate_parser.add_argument('--engine', choices=engine_names, default='random_forest', help="Model engine.")
+
+    sweep_parser = subparsers.add_parser('sweep', help="Cross-validate every subset of the five numerical features.")
+    sweep_parser.add_argument('--folds', type=int, default=5, help="Number of folds (default: 5).")
+    sweep_parser.add_argument('--repeats', type=int, default=3, help="Number of repeats (default: 3).")
+    sweep_parser.add_argument('--n-jobs', type=int, default=-1, help="Number of parallel jobs (default: all cores).")
+    sweep_parser.add_argument('--output', default='results/feature_subset_sweep.csv', help="Output CSV file.")
+
+    train_parser = subparsers.add_parser('train', help="Train on all non-ambiguous genes and save the model.")
+    train_parser.add_argument('--model-dir', default='results/model', help="Directory for the saved model.")
+    train_parser.add_argument('--engine', choices=engine_names, default='random_forest', help="Model engine.")
+
+    score_parser = subparsers.add_parser('score', help="Score genes with the saved model (ambiguous genes by default).")
+    score_target = score_parser.add_mutually_exclusive_group()
+    score_target.add_argument('--group', help="Score every gene of a gene group, e.g. RNU6.")
+    score_target.add_argument('--input', help="Score a gene table CSV with 'Gene' and the model's feature columns.")
+    score_parser.add_argument('--output', help="Output CSV file.")
+    score_parser.add_argument('--model-dir', default='results/model', help="Directory of the saved model.")
+    score_parser.add_argument('--chunksize', type=int, default=50000, help="Genes scored per chunk.")
+
+    benchmark_parser = subparsers.add_parser('benchmark', help="Compare the model engines on the combined table "
+                                                               "and synthetic upscaled copies of it.")
+    benchmark_parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100],
+                                  help="Upscaling factors of the combined table (default: 1 10 100).")
+    benchmark_parser.add_argument('--engines', choices=engine_names, nargs='+', help="Engines to compare (default: all).")
+    benchmark_parser.add_argument('--n-jobs', type=int, default=-1, help="Cores used by the forest (default: all).")
+    benchmark_parser.add_argument('--output', default='results/model_engine_benchmark.csv', help="Output CSV file.")
+
+    args = parser.parse_args()
+    start_run(f"random_forest_genes_{args.command or 'run'}")
+
+    if args.command == 'score':
+        try:
+            score_genes(group=args.group, input_csv=args.input, output_csv=args.output,
+                        model_dir=args.model_dir, chunksize=args.chunksize)
+        except (FileNotFoundError, ValueError) as e:
+            sys.exit(f"Error: {e}")
+    elif args.command == 'train':
+        train_model(load_data(), output_dir=args.model_dir, engine=args.engine)
+    elif args.command == 'benchmark':
+        benchmark_models(load_data(), scales=args.scales, engines=args.engines, n_jobs=args.n_jobs,
+                         output_csv=args.output)
+    elif args.command == 'sweep':
+        sweep_features(load_data(), n_splits=args.folds, n_repeats=args.repeats, n_jobs=args.n_jobs,
+                       output_csv=args.output)
+    elif args.command == 'evaluate':
+        evaluate_model(load_data(), n_splits=args.folds, n_repeats=args.repeats, search=args.search,
+                       n_iter=args.n_iter, n_jobs=args.n_jobs, output_csv=args.output, engine=args.engine)
+    elif args.command == 'run' and args.render:
+        run_model(load_data(), render={'figure_dir': args.figure_dir, 'formats': args.formats,
+                                       'dpi': args.dpi, 'workers': args.workers})
+    else:
+        run_model(load_data())
@@ -0,0 +1,290 @@
+import os
+import json
+import zlib
+import struct
+import shutil
+import hashlib
+import logging
+import tempfile
+from collections import OrderedDict
+import numpy as np
+import pyBigWig
+import http_client
+from instrumentation import count, timer, log_event
+
+# Remote BigWig tracks read by URL with HTTP range requests, through a persistent local block cache
+# The file is read in fixed-size blocks, kept on disk under results/remote_cache/<url hash>/ (one file per block, named
+# by its offset), so reruns and other stages reuse what was downloaded. When reads move forward through the file (sorted
+# loci), a missing block is fetched together with up to NCRNA_REMOTE_PREFETCH following blocks in one request, so the
+# next loci mostly hit blocks fetched ahead of them; scattered reads fetch only the blocks they need
+# Disk use and download time scale with the loci queried, not the file size. The blocks of a URL are dropped when its
+# size or validator (ETag or Last-Modified) changes
+# The BigWig format (header, chromosome B+ tree, R-tree index, zlib-compressed data blocks) is read here, because
+# pyBigWig is often built without remote file support; RemoteBigWig has the pyBigWig methods used by the pipeline
+# (isBigWig, chroms, values, close), so open_track() can return either
+# Tuned with environment variables:
+#   NCRNA_REMOTE_CACHE      block cache directory (default: results/remote_cache)
+#   NCRNA_REMOTE_BLOCK_KB   block size in KB (default: 64)
+#   NCRNA_REMOTE_PREFETCH   blocks fetched ahead of a missing block (default: 4)
+
+cache_dir = os.environ.get("NCRNA_REMOTE_CACHE", "results/remote_cache")
+block_size = int(os.environ.get("NCRNA_REMOTE_BLOCK_KB", "64")) * 1024
+prefetch_blocks = int(os.environ.get("NCRNA_REMOTE_PREFETCH", "4"))
+
+bigwig_magic = 0x888FFC26
+chrom_tree_magic = 0x78CA8C91
+index_magic = 0x2468ACE0
+
+# Decompressed data blocks kept in memory per track (neighbouring loci usually share a data block)
+data_blocks_in_memory = 256
+
+
+# Function to write a cache file atomically through a temporary file of its own, so processes sharing the cache never
+# write to the same temporary file and readers only ever see complete files
+def write_atomically(path, data):
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix=f".{os.path.basename(path)}.", suffix=".tmp",
+                                     delete=False) as file:
+        temp_path = file.name
+        try:
+            file.write(data)
+        except BaseException:
+            file.close()
+            os.unlink(temp_path)
+            raise
+    os.replace(temp_path, path)
+
+
+# Function to tell a URL from a local path
+def is_remote(path):
+    return path.startswith(("http://", "https://"))
+
+
+# Function to open a track by local path (pyBigWig) or by URL (RemoteBigWig)
+# A missing track raises FileNotFoundError either way (a 404 for a URL)
+def open_track(path):
+    if is_remote(path):
+        return RemoteBigWig(path)
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"'{path}' not found")
+    return pyBigWig.open(path)
+
+
+# Persistent block cache of one URL
+# Reads byte ranges of the remote file, fetching the missing blocks with range requests
+class BlockCache:
+    def __init__(self, url):
+        self.url = url
+        self.directory = os.path.join(cache_dir, hashlib.sha1(f"{url}#{block_size}".encode()).hexdigest()[:20])
+        response = http_client.request("HEAD", url, "remote_bigwig", allow_redirects=True)
+        if response.status_code == 404:
+            raise FileNotFoundError(f"'{url}' not found")
+        if response.status_code != 200:
+            raise RuntimeError(f"HEAD {url} returned HTTP {response.status_code}")
+        self.size = int(response.headers["Content-Length"])
+        validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+        self.fingerprint = hashlib.sha1(f"{url}\n{self.size}\n{validator}".encode()).hexdigest()
+        self.last_block = None
+
+        # Blocks of an earlier version of the file are dropped
+        meta_file = os.path.join(self.directory, "meta.json")
+        meta = {"url": url, "size": self.size, "validator": validator, "block_size": block_size}
+        if os.path.isfile(meta_file):
+            with open(meta_file) as file:
+                if json.load(file) != meta:
+                    shutil.rmtree(self.directory, ignore_errors=True)
+                    count("remote.cache_invalidated")
+                    log_event("remote_cache_invalidated", logging.INFO, url=url)
+        if not os.path.isfile(meta_file):
+            os.makedirs(self.directory, exist_ok=True)
+            write_atomically(meta_file, json.dumps(meta).encode())
+
+    def block_path(self, block):
+        return os.path.join(self.directory, f"{block * block_size:015d}")
+
+    # Function to fetch the blocks first..last (inclusive) with one range request and store them
+    def fetch_blocks(self, first, last):
+        start, end = first * block_size, min((last + 1) * block_size, self.size) - 1
+        response = http_client.get(self.url, "remote_bigwig", headers={"Range": f"bytes={start}-{end}"})
+        if response.status_code != 206:
+            raise RuntimeError(f"range request to {self.url} returned HTTP {response.status_code} (the server "
+                               f"must support range requests)")
+        data = response.content
+        if len(data) != end - start + 1:
+            raise RuntimeError(f"range request to {self.url} returned {len(data)} bytes, expected {end - start + 1}")
+        count("remote.requests")
+        count("remote.bytes_downloaded", len(data))
+        blocks = {}
+        for block in range(first, last + 1):
+            blocks[block] = data[(block - first) * block_size:(block - first + 1) * block_size]
+            write_atomically(self.block_path(block), blocks[block])
+        count("remote.blocks_fetched", last - first + 1)
+        return blocks
+
+    # Function to read size bytes at offset
+    def read(self, offset, size):
+        if size <= 0:
+            return b""
+        first, last = offset // block_size, (offset + size - 1) // block_size
+        last_block = (self.size - 1) // block_size
+        blocks = {}
+        block = first
+        while block <= last:
+            path = self.block_path(block)
+            if os.path.isfile(path):
+                with open(path, "rb") as file:
+                    blocks[block] = file.read()
+                count("remote.block_hits")
+                block += 1
+                continue
+            # A run of missing blocks, extended by the blocks prefetched after it (while they are missing too) when
+            # the read follows the previous one
+            sequential = self.last_block is not None and 0 <= first - self.last_block <= prefetch_blocks + 1
+            run_end = block
+            while run_end < min(last + (prefetch_blocks if sequential else 0), last_block) and not os.path.isfile(
+                    self.block_path(run_end + 1)):
+                run_end += 1
+            with timer("remote.fetch"):
+                blocks.update(self.fetch_blocks(block, run_end))
+            block = run_end + 1
+        self.last_block = last
+        data = b"".join(blocks[block] for block in range(first, last + 1))
+        return data[offset - first * block_size:offset - first * block_size + size]
+
+
+# BigWig file read from a URL through the block cache, with the pyBigWig methods used by the pipeline
+class RemoteBigWig:
+    def __init__(self, url):
+        self.url = url
+        self.file = BlockCache(url)
+        self.fingerprint = self.file.fingerprint
+        header = self.file.read(0, 64)
+        magic = struct.unpack("<I", header[:4])[0]
+        self.endian = "<" if magic == bigwig_magic else ">"
+        if struct.unpack(f"{self.endian}I", header[:4])[0] != bigwig_magic:
+            raise RuntimeError(f"'{url}' is not a BigWig file")
+        (_, _, _, chrom_tree_offset, _, self.index_offset, _, _, _, _, self.uncompress_buffer_size,
+         _) = struct.unpack(f"{self.endian}IHHQQQHHQQIQ", header)
+        self.chrom_sizes, self.chrom_ids = self.read_chrom_tree(chrom_tree_offset)
+        if struct.unpack(f"{self.endian}I", self.file.read(self.index_offset, 4))[0] != index_magic:
+            raise RuntimeError(f"'{url}' has no valid data index")
+        self.nodes = {}
+        self.data_blocks = OrderedDict()
+        item = [("start_chrom", "u4"), ("start_base", "u4"), ("end_chrom", "u4"), ("end_base", "u4")]
+        self.leaf_dtype = np.dtype([(name, f"{self.endian}{kind}") for name, kind in item]
+                                   + [("offset", f"{self.endian}u8"), ("size", f"{self.endian}u8")])
+        self.branch_dtype = np.dtype([(name, f"{self.endian}{kind}") for name, kind in item]
+                                     + [("offset", f"{self.endian}u8")])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def isBigWig(self):
+        return True
+
+    def close(self):
+        self.nodes.clear()
+        self.data_blocks.clear()
+
+    def chroms(self, chrom=None):
+        return dict(self.chrom_sizes) if chrom is None else self.chrom_sizes.get(chrom)
+
+    # Function to read the chromosome B+ tree: names, sizes and ids
+    def read_chrom_tree(self, offset):
+        magic, _, key_size, _, _, _ = struct.unpack(f"{self.endian}IIIIQQ", self.file.read(offset, 32))
+        if magic != chrom_tree_magic:
+            raise RuntimeError(f"'{self.url}' has no valid chromosome tree")
+        sizes, ids = {}, {}
+        pending = [offset + 32]
+        while pending:
+            node = pending.pop()
+            is_leaf, _, n_items = struct.unpack(f"{self.endian}BBH", self.file.read(node, 4))
+            item_size = key_size + 8
+            items = self.file.read(node + 4, n_items * item_size)
+            for number in range(n_items):
+                item = items[number * item_size:(number + 1) * item_size]
+                if is_leaf:
+                    name = item[:key_size].rstrip(b"\0").decode()
+                    chrom_id, chrom_size = struct.unpack(f"{self.endian}II", item[key_size:])
+                    sizes[name], ids[name] = chrom_size, chrom_id
+                else:
+                    pending.append(struct.unpack(f"{self.endian}Q", item[key_size:])[0])
+        return sizes, ids
+
+    # Function to read one R-tree node as a structured array (parsed nodes are kept)
+    def read_node(self, offset):
+        node = self.nodes.get(offset)
+        if node is None:
+            is_leaf, _, n_items = struct.unpack(f"{self.endian}BBH", self.file.read(offset, 4))
+            dtype = self.leaf_dtype if is_leaf else self.branch_dtype
+            node = (bool(is_leaf), np.frombuffer(self.file.read(offset + 4, n_items * dtype.itemsize), dtype=dtype))
+            self.nodes[offset] = node
+        return node
+
+    # Function to find the data blocks overlapping [start, end) of a chromosome: (offset, size) pairs
+    def overlapping_blocks(self, chrom_id, start, end):
+        found = []
+        pending = [self.index_offset + 48]
+        while pending:
+            is_leaf, items = self.read_node(pending.pop())
+            # (chrom, base) pairs compared in order: item start before the query end, item end after the query start
+            starts_before = (items["start_chrom"] < chrom_id) | ((items["start_chrom"] == chrom_id)
+                                                                 & (items["start_base"] < end))
+            ends_after = (items["end_chrom"] > chrom_id) | ((items["end_chrom"] == chrom_id)
+                                                           & (items["end_base"] > start))
+            hits = items[starts_before & ends_after]
+            if is_leaf:
+                found.extend(zip(hits["offset"].tolist(), hits["size"].tolist()))
+            else:
+                pending.extend(reversed(hits["offset"].tolist()))
+        return found
+
+    # Function to read and parse one data block: chrom id and the start, end and value of each item
+    def read_data_block(self, offset, size):
+        parsed = self.data_blocks.get(offset)
+        if parsed is not None:
+            self.data_blocks.move_to_end(offset)
+            return parsed
+        data = self.file.read(offset, size)
+        if self.uncompress_buffer_size:
+            data = zlib.decompress(data)
+        chrom_id, chrom_start, _, item_step, item_span, kind, _, n_items = struct.unpack(
+            f"{self.endian}IIIIIBBH", data[:24])
+        if kind == 1:  # bedGraph: start, end, value
+            items = np.frombuffer(data, dtype=f"{self.endian}u4", count=3 * n_items, offset=24).reshape(-1, 3)
+            starts, ends = items[:, 0].astype(np.int64), items[:, 1].astype(np.int64)
+            values = items[:, 2].copy().view(f"{self.endian}f4")
+        elif kind == 2:  # variableStep: start, value
+            items = np.frombuffer(data, dtype=f"{self.endian}u4", count=2 * n_items, offset=24).reshape(-1, 2)
+            starts = items[:, 0].astype(np.int64)
+            ends = starts + item_span
+            values = items[:, 1].copy().view(f"{self.endian}f4")
+        else:  # fixedStep: value
+            starts = chrom_start + np.arange(n_items, dtype=np.int64) * item_step
+            ends = starts + item_span
+            values = np.frombuffer(data, dtype=f"{self.endian}f4", count=n_items, offset=24)
+        parsed = (chrom_id, starts, ends, values.astype(np.float32))
+        self.data_blocks[offset] = parsed
+        if len(self.data_blocks) > data_blocks_in_memory:
+            self.data_blocks.popitem(last=False)
+        return parsed
+
+    # Function to get the value of every base of [start, end) (NaN without data), as pyBigWig values()
+    def values(self, chrom, start, end, numpy=False):
+        if chrom not in self.chrom_sizes or start < 0 or start >= end or end > self.chrom_sizes[chrom]:
+            raise RuntimeError("Invalid interval bounds!")
+        chrom_id = self.chrom_ids[chrom]
+        result = np.full(end - start, np.nan, dtype=np.float32)
+        for offset, size in self.overlapping_blocks(chrom_id, start, end):
+            block_chrom, starts, ends, values = self.read_data_block(offset, size)
+            if block_chrom != chrom_id:
+                continue
+            inside = (starts < end) & (ends > start)
+            clipped_starts = np.maximum(starts[inside], start) - start
+            lengths = np.minimum(ends[inside], end) - start - clipped_starts
+            positions = (np.repeat(clipped_starts - np.cumsum(lengths) + lengths, lengths)
+                         + np.arange(lengths.sum()))
+            result[positions] = np.repeat(values[inside], lengths)
+        return result if numpy else result.tolist()
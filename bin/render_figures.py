@@ -0,0 +1,132 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import matplotlib
+import matplotlib.pyplot as plt
+import seaborn as sns
+from figure_names import figure_names
+
+# Figure specs and headless rendering for random_forest_genes.py (and the profiles of conservation_profile.py)
+# Each figure is described by a plain dict (kind, output name and the arrays it needs) so it can be
+# drawn interactively with plt.show() or rendered with the Agg backend in a small process pool
+
+# Function to set the fonts used for every figure
+def set_plot_style():
+    # Set font to Times New Roman
+    plt.rcParams['font.family'] = 'DejaVu Serif'
+    # Set global font size for everything in the plot
+    plt.rcParams.update({'font.size': 28,  # Global font size for all text
+                         'axes.labelsize': 28,  # Axis labels font size
+                         'xtick.labelsize': 28,  # X-axis tick label font size
+                         'ytick.labelsize': 28,  # Y-axis tick label font size
+                         'legend.fontsize': 22,  # Legend font size
+                         'figure.titlesize': 28})  # Global figure title font size
+
+
+# Function to build the specs of every figure of a modelling run
+def build_figure_specs(y_train, train_probs, y_test, test_probs, ambiguous_data):
+    y_train = np.asarray(y_train)
+    y_test = np.asarray(y_test)
+    test_probs = {'functional': np.asarray(test_probs)[y_test == 1],  # Probabilities for true functional genes
+                  'pseudogene': np.asarray(test_probs)[y_test == 0]}  # Probabilities for true pseudogenes
+    train_probs = {'functional': np.asarray(train_probs)[y_train == 1],
+                   'pseudogene': np.asarray(train_probs)[y_train == 0]}
+
+    return [
+        {'kind': 'test_histogram', 'name': figure_names['test_histogram'], 'test_probs': test_probs},
+        {'kind': 'train_test_overlay', 'name': figure_names['train_test_overlay'],
+         'test_probs': test_probs, 'train_probs': train_probs},
+        {'kind': 'ambiguous_scatter', 'name': figure_names['ambiguous_scatter'],
+         'phylop100': ambiguous_data['PhyloP100_median'].to_numpy(),
+         'encode': ambiguous_data['ENCODE_max'].to_numpy(),
+         'probability': ambiguous_data['functional_probability'].to_numpy()},
+    ]
+
+
+# Function to draw one figure spec on a new figure and return it
+def draw_figure(spec):
+    set_plot_style()
+    figure = plt.figure(figsize=(10, 6))
+
+    if spec['kind'] == 'test_histogram':
+        # Create the histogram for test data probabilities
+        sns.histplot(spec['test_probs']['functional'], bins=20, color='firebrick', alpha=0.7, label='Functional Genes')
+        sns.histplot(spec['test_probs']['pseudogene'], bins=20, color='cornflowerblue', alpha=0.7, label='Pseudogenes')
+
+    elif spec['kind'] == 'train_test_overlay':
+        # Overlay training data distributions
+        sns.histplot(spec['test_probs']['functional'], bins=20, color='firebrick', alpha=0.7,
+                     label='Test Functional Genes')
+        sns.histplot(spec['test_probs']['pseudogene'], bins=20, color='cornflowerblue', alpha=0.7,
+                     label='Test Pseudogenes')
+        sns.histplot(spec['train_probs']['functional'], bins=20, color='lightpink', alpha=0.5,
+                     label='Train Functional Genes', linestyle='--')
+        sns.histplot(spec['train_probs']['pseudogene'], bins=20, color='lightblue', alpha=0.5,
+                     label='Train Pseudogenes', linestyle='--')
+
+    elif spec['kind'] == 'ambiguous_scatter':
+        # Scatter plot for ambiguous genes
+        plt.scatter(spec['phylop100'], spec['encode'],
+                    c=spec['probability'], cmap='coolwarm', s=100, edgecolors='black')
+        plt.xlabel('PhyloP100 Median')
+        plt.ylabel('ENCODE Max')
+        plt.colorbar(label='Functional Probability')
+        # Disable grid for better clarity
+        plt.grid(False)
+
+    elif spec['kind'] == 'conservation_profile':
+        # Median and interquartile range per position of the functional copies and the pseudogenes
+        colors = {'Functional': 'firebrick', 'Pseudogene': 'cornflowerblue'}
+        for profile_class, summary in spec['classes'].items():
+            plt.fill_between(spec['position'], summary['Q25'], summary['Q75'], color=colors[profile_class],
+                             alpha=0.3, linewidth=0)
+            plt.plot(spec['position'], summary['Median'], color=colors[profile_class], label=profile_class)
+        plt.xlabel(spec['xlabel'])
+        plt.ylabel(spec['ylabel'])
+        plt.legend(title='Gene Type')
+
+    else:
+        raise ValueError(f"Figure kind '{spec['kind']}' is not supported.")
+
+    if spec['kind'] in ('test_histogram', 'train_test_overlay'):
+        # Add titles and labels
+        plt.xlabel('Probability of Being Functional')
+        plt.ylabel('Frequency')
+        plt.legend(title='Gene Type')
+        plt.grid(axis='y', linestyle='--', alpha=0.7)
+
+    plt.tight_layout()
+    return figure
+
+
+# Function run in a worker process: draw one spec with the Agg backend and save it in every requested format
+def render_figure(spec, figure_dir, formats, dpi):
+    matplotlib.use('Agg', force=True)
+    start = time.perf_counter()
+    figure = draw_figure(spec)
+    output_files = []
+    for file_format in formats:
+        output_file = os.path.join(figure_dir, f"{spec['name']}.{file_format}")
+        figure.savefig(output_file, format=file_format, dpi=dpi)
+        output_files.append(output_file)
+    plt.close(figure)
+    return output_files, time.perf_counter() - start
+
+
+# Function to render every figure spec to files in a small process pool
+def render_figures(specs, figure_dir='results', formats=('png',), dpi=150, workers=3):
+    os.makedirs(figure_dir, exist_ok=True)
+    workers = max(1, min(workers, len(specs)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(render_figure, spec, figure_dir, tuple(formats), dpi) for spec in specs]
+        for future in futures:
+            output_files, elapsed = future.result()
+            print(f"Saved {', '.join(output_files)} ({elapsed:.2f}s)")
+
+
+# Function to draw every figure spec interactively, one window at a time
+def show_figures(specs):
+    for spec in specs:
+        draw_figure(spec)
+        plt.show()
@@ -0,0 +1,314 @@
+import os
+import sys
+import mmap
+import time
+import struct
+import argparse
+import numpy as np
+import pandas as pd
+from instrumentation import start_run, count, timer
+
+# Sequence access and sequence features of the loci
+# A local hg38 2bit file or FASTA file (indexed with a .fai file, built here if missing) is memory-mapped, so only
+# the bytes of the loci are read from disk and the genome is never loaded into RAM
+# Sequences are NumPy arrays of base codes (A=0, C=1, G=2, T=3, N=4); features are computed for all loci at once:
+# length, GC content, CpG observed/expected ratio, the canonical k-mer spectrum (strand-independent, since the loci
+# have no strand) and the Jensen-Shannon divergence of that spectrum from the closest functional copy of the group
+# Written to results/sequence_features.csv, which assemble_features.py can join to the combined table
+
+genome_files = ["data/hg38.2bit", "data/hg38.fa"]
+output_csv = "results/sequence_features.csv"
+
+bases = np.array(list("ACGTN"))
+
+# Byte -> base code, for FASTA files (lowercase soft-masked bases are read as uppercase)
+fasta_codes = np.full(256, 4, dtype=np.uint8)
+for code, base in enumerate("ACGT"):
+    fasta_codes[ord(base)] = fasta_codes[ord(base.lower())] = code
+
+# 2bit packs four bases per byte, first base in the two most significant bits, T=0 C=1 A=2 G=3
+twobit_codes = np.array([3, 1, 0, 2], dtype=np.uint8)[
+    (np.arange(256, dtype=np.uint8)[:, None] >> np.array([6, 4, 2, 0], dtype=np.uint8)) & 3]
+
+
+# Function to open a 2bit file: memory map and per-sequence offsets (sequence headers are read on first use)
+def open_twobit(path):
+    with open(path, "rb") as file:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    signature = struct.unpack("<I", data[:4])[0]
+    endian = "<" if signature == 0x1A412743 else ">"
+    if struct.unpack(f"{endian}I", data[:4])[0] != 0x1A412743:
+        raise ValueError(f"'{path}' is not a 2bit file")
+    version, sequence_count = struct.unpack(f"{endian}II", data[4:12])
+    offset_format = f"{endian}Q" if version == 1 else f"{endian}I"
+    offsets, position = {}, 16
+    for _ in range(sequence_count):
+        name_size = data[position]
+        name = data[position + 1:position + 1 + name_size].decode()
+        position += 1 + name_size
+        offsets[name] = struct.unpack_from(offset_format, data, position)[0]
+        position += struct.calcsize(offset_format)
+    return {"kind": "2bit", "path": path, "data": data, "endian": endian, "offsets": offsets, "records": {}}
+
+
+# Function to read the header of one 2bit sequence: size, N blocks and the offset of the packed bases
+def twobit_record(genome, chrom):
+    record = genome["records"].get(chrom)
+    if record is None:
+        data, endian = genome["data"], genome["endian"]
+        position = genome["offsets"][chrom]
+        size, n_block_count = struct.unpack_from(f"{endian}II", data, position)
+        position += 8
+        n_starts = np.frombuffer(data, dtype=f"{endian}u4", count=n_block_count, offset=position).astype(np.int64)
+        n_sizes = np.frombuffer(data, dtype=f"{endian}u4", count=n_block_count,
+                                offset=position + 4 * n_block_count).astype(np.int64)
+        position += 8 * n_block_count
+        mask_block_count = struct.unpack_from(f"{endian}I", data, position)[0]
+        position += 4 + 8 * mask_block_count + 4
+        record = genome["records"][chrom] = {"size": size, "n_starts": n_starts, "n_ends": n_starts + n_sizes,
+                                             "dna_offset": position}
+    return record
+
+
+# Function to read the .fai index of a FASTA file (name, length, offset, bases per line, bytes per line)
+def read_fai(path):
+    index = {}
+    with open(path) as file:
+        for line in file:
+            name, length, offset, line_bases, line_width = line.split("\t")[:5]
+            index[name] = {"size": int(length), "offset": int(offset), "line_bases": int(line_bases),
+                           "line_width": int(line_width)}
+    return index
+
+
+# Function to build the .fai index of a FASTA file in one streaming pass (same format as samtools faidx)
+def build_fai(path):
+    entries, name = [], None
+    with open(path, "rb") as file:
+        offset = 0
+        for line in file:
+            if line.startswith(b">"):
+                if name is not None:
+                    entries.append((name, length, sequence_offset, line_bases, line_width))
+                name = line[1:].split()[0].decode()
+                length, line_bases, line_width, sequence_offset = 0, None, None, offset + len(line)
+            elif name is not None:
+                stripped = len(line.rstrip(b"\r\n"))
+                if line_bases is None:
+                    line_bases, line_width = stripped, len(line)
+                length += stripped
+            offset += len(line)
+        if name is not None:
+            entries.append((name, length, sequence_offset, line_bases, line_width))
+    with open(f"{path}.fai", "w") as file:
+        for entry in entries:
+            file.write("\t".join(map(str, entry)) + "\n")
+
+
+# Function to open an indexed FASTA file as a memory map
+def open_fasta(path):
+    if not os.path.isfile(f"{path}.fai"):
+        print(f"Indexing {path}...")
+        build_fai(path)
+    with open(path, "rb") as file:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return {"kind": "fasta", "path": path, "data": data, "records": read_fai(f"{path}.fai")}
+
+
+# Function to open a 2bit or FASTA genome (the first of genome_files found if no path is given)
+def open_genome(path=None):
+    if path is None:
+        path = next((candidate for candidate in genome_files if os.path.isfile(candidate)), None)
+        if path is None:
+            raise FileNotFoundError(f"No genome sequence found, expected one of {genome_files}")
+    return open_twobit(path) if path.endswith(".2bit") else open_fasta(path)
+
+
+# Function to get the size of each sequence of a genome
+def chrom_sizes(genome):
+    if genome["kind"] == "2bit":
+        return {chrom: twobit_record(genome, chrom)["size"] for chrom in genome["offsets"]}
+    return {chrom: record["size"] for chrom, record in genome["records"].items()}
+
+
+# Function to fetch the base codes of [start, end) (0-based half-open) of a sequence
+def fetch(genome, chrom, start, end):
+    data = genome["data"]
+    if genome["kind"] == "2bit":
+        record = twobit_record(genome, chrom)
+        end = min(end, record["size"])
+        if start >= end:
+            return np.empty(0, dtype=np.uint8)
+        first_byte, last_byte = start // 4, (end + 3) // 4
+        packed = np.frombuffer(data, dtype=np.uint8, count=last_byte - first_byte,
+                               offset=record["dna_offset"] + first_byte)
+        codes = twobit_codes[packed].ravel()[start - 4 * first_byte:end - 4 * first_byte]
+        # N blocks overlapping the range
+        overlapping = np.flatnonzero((record["n_starts"] < end) & (record["n_ends"] > start))
+        if len(overlapping):
+            codes = codes.copy()
+            for block in overlapping:
+                codes[max(record["n_starts"][block], start) - start:min(record["n_ends"][block], end) - start] = 4
+        return codes
+
+    record = genome["records"][chrom]
+    end = min(end, record["size"])
+    if start >= end:
+        return np.empty(0, dtype=np.uint8)
+    line_bases, line_width = record["line_bases"], record["line_width"]
+    first = record["offset"] + (start // line_bases) * line_width + start % line_bases
+    last = record["offset"] + (end // line_bases) * line_width + end % line_bases
+    raw = np.frombuffer(data, dtype=np.uint8, count=last - first, offset=first)
+    raw = raw[(raw != ord("\n")) & (raw != ord("\r"))]
+    return fasta_codes[raw]
+
+
+# Function to fetch the sequences of many loci (1-based inclusive coordinates) as one concatenated code array
+# Returns the codes and the offsets of each locus in it (locus i is codes[offsets[i]:offsets[i + 1]])
+def fetch_loci(genome, chroms, starts, ends):
+    sizes = chrom_sizes(genome)
+    pieces = []
+    with timer("sequence.fetch", source=genome["kind"]):
+        for chrom, start, end in zip(chroms, starts, ends):
+            if chrom not in sizes:
+                count("loci.skipped", reason="chrom_not_in_genome")
+                pieces.append(np.empty(0, dtype=np.uint8))
+                continue
+            pieces.append(fetch(genome, chrom, int(start) - 1, int(end)))
+    lengths = np.array([len(piece) for piece in pieces], dtype=np.int64)
+    count("sequence.bases", int(lengths.sum()), source=genome["kind"])
+    offsets = np.r_[0, np.cumsum(lengths)]
+    return (np.concatenate(pieces) if pieces else np.empty(0, dtype=np.uint8)), offsets
+
+
+# Function to get the id of every k-mer of a concatenated code array and whether it is valid
+# (entirely inside one locus and without N)
+def kmer_ids(codes, offsets, k):
+    n_kmers = len(codes) - k + 1
+    if n_kmers <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=bool), np.empty(0, dtype=np.int64)
+    windows = np.lib.stride_tricks.sliding_window_view(codes, k)
+    weights = 4 ** np.arange(k - 1, -1, -1, dtype=np.int64)
+    forward = (windows.astype(np.int64) & 3) @ weights
+    # Reverse complement: complement is 3 - code, read backwards
+    reverse = ((3 - windows[:, ::-1].astype(np.int64)) & 3) @ weights
+    canonical = np.minimum(forward, reverse)
+
+    has_n = np.convolve(codes == 4, np.ones(k, dtype=np.int64), mode="valid") > 0
+    locus_of = np.searchsorted(offsets, np.arange(n_kmers), side="right") - 1
+    inside = np.arange(n_kmers) + k <= offsets[locus_of + 1]
+    return canonical, inside & ~has_n, locus_of
+
+
+# Function to get the canonical k-mers (those that are not the reverse complement of a smaller k-mer) as strings
+def canonical_kmers(k):
+    ids = np.arange(4 ** k, dtype=np.int64)
+    digits = (ids[:, None] // 4 ** np.arange(k - 1, -1, -1)) % 4
+    reverse = (3 - digits[:, ::-1]) @ 4 ** np.arange(k - 1, -1, -1)
+    keep = ids <= reverse
+    return ids[keep], ["".join(bases[row]) for row in digits[keep]]
+
+
+# Function to compute the canonical k-mer spectrum of every locus (frequencies, each row sums to 1)
+def kmer_spectra(codes, offsets, k):
+    n_loci = len(offsets) - 1
+    canonical, valid, locus_of = kmer_ids(codes, offsets, k)
+    counts = np.bincount(locus_of[valid] * 4 ** k + canonical[valid], minlength=n_loci * 4 ** k)
+    keep, names = canonical_kmers(k)
+    counts = counts.reshape(n_loci, 4 ** k)[:, keep].astype(np.float64)
+    totals = counts.sum(axis=1, keepdims=True)
+    return np.divide(counts, totals, out=np.full_like(counts, np.nan), where=totals > 0), names
+
+
+# Function to compute length, GC content and CpG observed/expected ratio of every locus
+def composition(codes, offsets):
+    locus_of = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    n_loci = len(offsets) - 1
+    called = np.bincount(locus_of, weights=codes < 4, minlength=n_loci)
+    gc = np.bincount(locus_of, weights=(codes == 1) | (codes == 2), minlength=n_loci)
+    c = np.bincount(locus_of, weights=codes == 1, minlength=n_loci)
+    g = np.bincount(locus_of, weights=codes == 2, minlength=n_loci)
+    same_locus = locus_of[:-1] == locus_of[1:]
+    cpg = np.bincount(locus_of[:-1][same_locus], weights=((codes[:-1] == 1) & (codes[1:] == 2))[same_locus],
+                      minlength=n_loci)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gc_content = np.where(called > 0, gc / called, np.nan)
+        cpg_ratio = np.where(c * g > 0, cpg * called / (c * g), np.nan)
+    return np.diff(offsets), gc_content, cpg_ratio
+
+
+# Function to compute the Jensen-Shannon divergence (base 2, between 0 and 1) of each spectrum to each reference
+def js_divergence(spectra, references, rows_per_block=2048):
+    divergence = np.empty((len(spectra), len(references)))
+    for start in range(0, len(spectra), rows_per_block):
+        p = spectra[start:start + rows_per_block, None, :]
+        q = references[None, :, :]
+        m = (p + q) / 2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            kl_p = np.where(p > 0, p * np.log2(p / m), 0).sum(axis=2)
+            kl_q = np.where(q > 0, q * np.log2(q / m), 0).sum(axis=2)
+        divergence[start:start + rows_per_block] = (kl_p + kl_q) / 2
+    return divergence
+
+
+# Function to compute the sequence features of the loci of every gene group
+# One row per gene (its first locus, duplicate transcripts usually share the location)
+def sequence_features(loci, genome, k=3):
+    loci = loci.drop_duplicates("Gene", keep="first").reset_index(drop=True)
+    codes, offsets = fetch_loci(genome, loci["Chromosome"], loci["Start"], loci["End"])
+    with timer("stage", step="sequence_features"):
+        length, gc_content, cpg_ratio = composition(codes, offsets)
+        spectra, kmer_names = kmer_spectra(codes, offsets, k)
+
+    features = loci[["Gene", "Gene_group"]].copy()
+    features["Length"] = length
+    features["GC_content"] = gc_content
+    features["CpG_ratio"] = cpg_ratio
+    features["Kmer_divergence"] = np.nan
+    features["Closest_functional"] = None
+
+    # Divergence from the closest functional copy of the same gene group (functional genes are compared with the
+    # other functional copies)
+    is_functional = (loci["Gene_Type"] == "Functional").to_numpy()
+    has_spectrum = ~np.isnan(spectra).any(axis=1)
+    for gene_group in loci["Gene_group"].unique():
+        in_group = (loci["Gene_group"] == gene_group).to_numpy() & has_spectrum
+        references = np.flatnonzero(in_group & is_functional)
+        if len(references) == 0:
+            continue
+        members = np.flatnonzero(in_group)
+        divergence = js_divergence(spectra[members], spectra[references])
+        divergence[members[:, None] == references[None, :]] = np.inf
+        closest = divergence.argmin(axis=1)
+        best = divergence[np.arange(len(members)), closest]
+        found = np.isfinite(best)
+        features.loc[members[found], "Kmer_divergence"] = best[found]
+        features.loc[members[found], "Closest_functional"] = loci["Gene"].to_numpy()[references[closest[found]]]
+
+    spectrum = pd.DataFrame(spectra, columns=[f"kmer_{name}" for name in kmer_names])
+    return pd.concat([features, spectrum], axis=1)
+
+
+# Main Execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sequence features of the loci of all gene groups.")
+    parser.add_argument("--genome", help="hg38 2bit file or FASTA file (default: data/hg38.2bit or data/hg38.fa).")
+    parser.add_argument("--k", type=int, default=3, help="k-mer length of the spectra (default: 3).")
+    parser.add_argument("--output", default=output_csv, help="Output CSV file.")
+    args = parser.parse_args()
+    start_run("sequence_features")
+
+    from interval_index import read_all_loci
+    try:
+        genome = open_genome(args.genome)
+    except (FileNotFoundError, ValueError) as e:
+        sys.exit(f"Error: {e}")
+
+    start = time.perf_counter()
+    loci = read_all_loci()
+    features = sequence_features(loci, genome, args.k)
+    features.to_csv(args.output, index=False, float_format="%.6g")
+    count("rows.written", len(features), output="sequence_features")
+    print(f"Sequence features of {len(features)} genes ({features['Length'].sum():,} bases) "
+          f"in {time.perf_counter() - start:.2f}s")
+    print(f"Results written to {args.output}")
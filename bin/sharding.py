@@ -0,0 +1,170 @@
+import os
+import sys
+import glob
+import json
+import zlib
+import hashlib
+import argparse
+from instrumentation import start_run, count, timer
+
+# Shard mode of the per-locus stages and deterministic merge of their partial outputs
+# With --shard i/N a stage processes only the units (loci or genes) assigned to shard i, partitioned by a stable hash
+# of a key (crc32, the same on every node and Python version) or by chromosome, and writes its output to
+# <output>.shard-i-of-N next to a manifest <output>.shard-i-of-N.json. The manifest records the stage, the input
+# fingerprint, the partition and, for each unit of the shard, its position in the serial order and the number of rows
+# it wrote. The manifest is written last, so a shard without one did not finish
+# 'python bin/sharding.py merge <output>' checks that all N shards are present and ran on the same input, and
+# interleaves their rows back in serial order, giving the same file as a serial run. Shards can run on any nodes that
+# share the file system, no coordination is needed
+
+partitions = ["hash", "chrom"]
+
+
+# Function to parse a --shard value "i/N" (0 <= i < N)
+def parse_shard(value):
+    try:
+        index, n_shards = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got '{value}'")
+    if n_shards < 1 or not 0 <= index < n_shards:
+        raise argparse.ArgumentTypeError(f"shard index must be between 0 and N - 1, got '{value}'")
+    return index, n_shards
+
+
+# Function to add the --shard and --shard-by options to the parser of a stage
+def add_shard_arguments(parser):
+    parser.add_argument("--shard", type=parse_shard, help="Process only shard i of N (i/N, from 0) and write a "
+                                                          "partial output for 'sharding.py merge'.")
+    parser.add_argument("--shard-by", choices=partitions, default="hash",
+                        help="Partition by a stable hash of the locus or gene (default) or by chromosome.")
+
+
+# Function to get the shard of a key (a locus, a gene or a chromosome)
+def shard_of(key, n_shards):
+    return zlib.crc32(str(key).encode()) % n_shards
+
+
+# Function to get the path of the partial output of a shard
+def shard_path(output, shard):
+    index, n_shards = shard
+    return f"{output}.shard-{index}-of-{n_shards}"
+
+
+# Function to fingerprint the input files of a stage (content hash), so shards of different inputs are not merged
+def input_fingerprint(paths):
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+# Function to write the manifest of a finished shard
+# units: [(serial position, rows written)] of the units of this shard, in serial order
+def write_manifest(output, shard, stage, partition, inputs, total_units, units):
+    index, n_shards = shard
+    manifest = {"stage": stage, "output": output, "shard": index, "n_shards": n_shards, "partition": partition,
+                "inputs": sorted(inputs), "input_fingerprint": input_fingerprint(inputs),
+                "total_units": total_units, "units": [[int(position), int(rows)] for position, rows in units]}
+    path = f"{shard_path(output, shard)}.json"
+    with open(f"{path}.tmp", "w") as file:
+        json.dump(manifest, file)
+    os.replace(f"{path}.tmp", path)
+    count("shard.units", len(units), stage=stage)
+    print(f"Shard {index}/{n_shards}: {len(units)} of {total_units} units written to {shard_path(output, shard)}")
+
+
+# Function to read and check the manifests of all shards of an output
+def read_manifests(output):
+    manifests = []
+    for path in glob.glob(f"{glob.escape(output)}.shard-*-of-*.json"):
+        with open(path) as file:
+            manifests.append(json.load(file))
+    if not manifests:
+        raise ValueError(f"no finished shards of '{output}' found")
+    first = manifests[0]
+    for manifest in manifests:
+        for key in ["stage", "n_shards", "partition", "input_fingerprint", "total_units"]:
+            if manifest[key] != first[key]:
+                raise ValueError(f"shards of '{output}' disagree on {key}: {first[key]} and {manifest[key]}")
+    present = {manifest["shard"] for manifest in manifests}
+    missing = sorted(set(range(first["n_shards"])) - present)
+    if missing:
+        raise ValueError(f"shards {missing} of {first['n_shards']} of '{output}' are missing or unfinished")
+    return sorted(manifests, key=lambda manifest: manifest["shard"])
+
+
+# Function to merge the partial outputs of all shards into the output of a serial run
+# The header line is written once, then the rows of each unit in serial order
+def merge(output, clean=False):
+    manifests = read_manifests(output)
+    n_shards, total_units = manifests[0]["n_shards"], manifests[0]["total_units"]
+    owner = [None] * total_units
+    for manifest in manifests:
+        for position, rows in manifest["units"]:
+            if owner[position] is not None:
+                raise ValueError(f"unit {position} of '{output}' was written by shards {owner[position][0]} and "
+                                 f"{manifest['shard']}")
+            owner[position] = (manifest["shard"], rows)
+    uncovered = [position for position, entry in enumerate(owner) if entry is None]
+    if uncovered:
+        raise ValueError(f"{len(uncovered)} units of '{output}' are in no shard (first: {uncovered[0]})")
+
+    partial_files = [open(shard_path(output, (index, n_shards)), newline="") for index in range(n_shards)]
+    rows_written = 0
+    try:
+        headers = {partial_file.readline() for partial_file in partial_files}
+        if len(headers) != 1:
+            raise ValueError(f"shards of '{output}' have different headers")
+        with timer("stage", step="merge_shards"), open(f"{output}.tmp", "w", newline="") as outfile:
+            outfile.write(headers.pop())
+            for shard, rows in owner:
+                partial_file = partial_files[shard]
+                for _ in range(rows):
+                    line = partial_file.readline()
+                    if not line:
+                        raise ValueError(f"shard {shard} of '{output}' has fewer rows than its manifest")
+                    outfile.write(line)
+                rows_written += rows
+            if any(partial_file.readline() for partial_file in partial_files):
+                raise ValueError(f"a shard of '{output}' has more rows than its manifest")
+    except ValueError:
+        if os.path.exists(f"{output}.tmp"):
+            os.remove(f"{output}.tmp")
+        raise
+    finally:
+        for partial_file in partial_files:
+            partial_file.close()
+    os.replace(f"{output}.tmp", output)
+    count("rows.written", rows_written, output="shard_merge")
+
+    if clean:
+        for index in range(n_shards):
+            os.remove(shard_path(output, (index, n_shards)))
+            os.remove(f"{shard_path(output, (index, n_shards))}.json")
+    return n_shards, rows_written
+
+
+# Main Execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the partial outputs of sharded stage runs.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    merge_parser = subparsers.add_parser("merge", help="Merge the shards of one or more outputs.")
+    merge_parser.add_argument("outputs", nargs="+", help="Output file(s) of the serial run, e.g. "
+                                                         "data/phyloP100_summary/RNU6_cons_phyloP100_.csv.")
+    merge_parser.add_argument("--clean", action="store_true", help="Remove the shard files after merging.")
+    args = parser.parse_args()
+    start_run("sharding")
+
+    failed = False
+    for output in args.outputs:
+        try:
+            n_shards, rows_written = merge(output, args.clean)
+        except (OSError, ValueError) as e:
+            print(f"Error merging '{output}': {e}", file=sys.stderr)
+            failed = True
+            continue
+        print(f"Merged {n_shards} shards into {output} ({rows_written} rows)")
+    if failed:
+        sys.exit(1)
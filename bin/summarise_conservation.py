@@ -0,0 +1,54 @@
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+from instrumentation import start_run, count, timer
+
+# Script to summarise the per-position conservation scores of a gene group into per-gene metrics
+# Same summary as the Boxplot_gene_*way.R scripts (median and max score per gene, missing scores removed),
+# without drawing the boxplot, so it can run for one (gene group, track) at a time in pipeline.py
+# Genes are written in alphabetical order (the R scripts order them by gene number)
+
+# Per-position scores and summary metrics of each track, as written by fetch_conservation_data.py and the R scripts
+track_files = {
+    "phastCons30": ("data/phastCons30_summary/{group}_cons.csv",
+                    "data/phastCons30_summary/{group}_phastCons30_summary_metrics.csv"),
+    "phyloP100": ("data/phyloP100_summary/{group}_cons_phyloP100_.csv",
+                  "data/phyloP100_summary/{group}_phyloP100_summary_metrics.csv"),
+    "phyloP447": ("data/phyloP447_summary/{group}_cons_phyloP447_.csv",
+                  "data/phyloP447_summary/{group}_phyloP447_summary_metrics.csv"),
+}
+
+
+# Function to compute the median and max conservation of each gene
+def summarise_scores(scores_csv):
+    with timer("csv.read", source="conservation_scores"):
+        scores = pd.read_csv(scores_csv, usecols=["Gene", "Score"], dtype={"Gene": str, "Score": np.float64})
+    count("rows.read", len(scores), source="conservation_scores")
+    count("positions.skipped", int(scores["Score"].isna().sum()), reason="no_score")
+    scores = scores[scores["Score"].notna()]
+    summary = scores.groupby("Gene", sort=True)["Score"].agg(["median", "max"])
+    return summary.rename(columns={"median": "Median_Conservation", "max": "Max_Conservation"}).reset_index()
+
+
+# Main Execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarise per-position conservation scores per gene.")
+    parser.add_argument("--group", required=True, help="Gene group, e.g. RNU6.")
+    parser.add_argument("--track", required=True, choices=list(track_files), help="Conservation track.")
+    args = parser.parse_args()
+    start_run("summarise_conservation")
+
+    scores_template, summary_template = track_files[args.track]
+    scores_csv = scores_template.format(group=args.group)
+    summary_csv = summary_template.format(group=args.group)
+    if not os.path.isfile(scores_csv):
+        sys.exit(f"Error: Input file '{scores_csv}' does not exist.")
+
+    summary = summarise_scores(scores_csv)
+    temp_summary_csv = f"{summary_csv}.tmp"
+    summary.to_csv(temp_summary_csv, index=False)
+    os.replace(temp_summary_csv, summary_csv)
+    count("rows.written", len(summary), output="summary_metrics")
+    print(f"{len(summary)} genes summarised, results written to {summary_csv}")